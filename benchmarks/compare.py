@@ -0,0 +1,95 @@
+"""
+compares two result files written by `benchmarks.locks` and flags regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 0.1]
+
+A scenario regresses if its p50 or p99 latency grew, or its throughput
+fell, by more than `--threshold` (a fraction). Exits with status 1 if
+any scenario regressed.
+"""
+from __future__ import print_function
+import argparse
+import json
+import sys
+
+# (result field, True if bigger is better)
+METRICS = (
+    ('calls_per_sec', True),
+    ('p50_us', False),
+    ('p99_us', False),
+)
+
+
+def load_results(path):
+    with open(path) as f:
+        return dict((result['name'], result) for result in json.load(f)['results'])
+
+
+def change(before, after):
+    """
+    returns the relative change from `before` to `after`,
+    or None if it can't be computed.
+    """
+    if before is None or after is None or not before:
+        return None
+    return (after - before) / float(before)
+
+
+def compare(baseline, candidate, threshold):
+    """
+    returns a list of (scenario name, {metric: change}, regressed metrics)
+    for the scenarios found in both `baseline` and `candidate`.
+    """
+    rows = []
+    for name in sorted(set(baseline) & set(candidate)):
+        changes = {}
+        regressed = []
+        for metric, bigger_is_better in METRICS:
+            delta = change(baseline[name].get(metric), candidate[name].get(metric))
+            changes[metric] = delta
+            if delta is None:
+                continue
+            if (-delta if bigger_is_better else delta) > threshold:
+                regressed.append(metric)
+        rows.append((name, changes, regressed))
+    return rows
+
+
+def format_change(delta):
+    if delta is None:
+        return '-'
+    return '%+.1f%%' % (100 * delta)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+    rows = compare(baseline, candidate, args.threshold)
+    print('%-44s %10s %10s %10s' % ('scenario', 'calls/s', 'p50', 'p99'))
+    regressions = 0
+    for name, changes, regressed in rows:
+        if regressed:
+            regressions += 1
+        print('%-44s %10s %10s %10s%s' % (
+            name,
+            format_change(changes['calls_per_sec']),
+            format_change(changes['p50_us']),
+            format_change(changes['p99_us']),
+            '  REGRESSED: ' + ', '.join(regressed) if regressed else ''
+        ))
+    missing = set(baseline) - set(candidate)
+    if missing:
+        print('%i scenarios of %s are missing from %s' % (len(missing), args.baseline, args.candidate))
+    print('%i of %i scenarios regressed by more than %.0f%%' % (
+        regressions, len(rows), 100 * args.threshold
+    ))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
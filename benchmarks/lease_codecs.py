@@ -0,0 +1,73 @@
+"""
+compares the size and encode/decode cost of the lease value formats.
+
+    python -m benchmarks.lease_codecs [--iterations N]
+"""
+from __future__ import print_function
+import argparse
+import pickle
+import time
+import timeit
+from pylocks.core import lease_codecs
+from pylocks.core.lock_lease_data import LockLeaseData
+from pylocks.core.lock_settings import LockSettings
+from pylocks.util import make_id
+
+
+def make_lease_data():
+    settings = LockSettings(prefix='person', ttl=60, arity=1, root_prefix='pylocks')
+    request = settings.make_request('3bd1c9a0')
+    return LockLeaseData(request=request, id=make_id(), acquired_at=time.time())
+
+
+def legacy_format():
+    # plain pickles, as written before lease values were framed
+    return (
+        lambda lease: pickle.dumps(lease, 2),
+        lambda data, key: lease_codecs.decode_lease(data, key=key)
+    )
+
+
+def registered_format(name):
+    codec = lease_codecs.get_codec(name)
+    return (
+        codec.encode,
+        lambda data, key: lease_codecs.decode_lease(data, key=key)
+    )
+
+
+def measure(encode, decode, lease, iterations):
+    data = encode(lease)
+    key = lease.key
+    encode_secs = timeit.timeit(lambda: encode(lease), number=iterations)
+    decode_secs = timeit.timeit(lambda: decode(data, key), number=iterations)
+    id_secs = timeit.timeit(lambda: LockLeaseData.read_id(data), number=iterations)
+    return {
+        'bytes': len(data),
+        'encode_us': 1e6 * encode_secs / iterations,
+        'decode_us': 1e6 * decode_secs / iterations,
+        'read_id_us': 1e6 * id_secs / iterations,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args(argv)
+    lease = make_lease_data()
+    formats = [
+        ('legacy pickle', legacy_format()),
+        ('pickle', registered_format('pickle')),
+        ('compact', registered_format('compact')),
+    ]
+    print('%-14s %8s %11s %11s %11s' % ('format', 'bytes', 'encode us', 'decode us', 'read_id us'))
+    for name, (encode, decode) in formats:
+        result = measure(encode, decode, lease, args.iterations)
+        print('%-14s %8i %11.2f %11.2f %11.2f' % (
+            name, result['bytes'], result['encode_us'],
+            result['decode_us'], result['read_id_us']
+        ))
+
+
+if __name__ == '__main__':
+    main()
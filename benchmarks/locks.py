@@ -0,0 +1,365 @@
+"""
+measures the latency and throughput of lock operations against local redislite servers.
+
+    python -m benchmarks.locks [--operations acquire,release ...] [--output results.json]
+
+Every operation runs once per combination of process count, thread count
+and contention level:
+
+    distinct    every call uses a key no other call uses
+    zipf        keys are drawn from a Zipfian distribution over `--keyspace` keys
+    hot         every call uses the same key
+
+Only the operation itself is timed; any setup it needs (e.g. acquiring
+the lock a `release` releases) is not. Calls whose setup fails, e.g.
+because another thread holds the hot key, are counted as skipped.
+
+With `--shards 1,2,4`, every scenario also runs with its keys spread
+over that many servers; see `ShardedBlockingRedisLock`.
+
+Compare two result files with `python -m benchmarks.compare`.
+"""
+from __future__ import print_function
+import argparse
+import bisect
+import json
+import multiprocessing
+import platform
+import random
+import sys
+import threading
+import time
+import redis
+from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
+from pylocks.errors import LockAlreadyHeld, LockExpired, LockNotOwned
+from pylocks.util import monotonic
+
+CONTENTION_LEVELS = ('distinct', 'zipf', 'hot')
+
+# operations which take a batch of keys run once per `--batch-sizes` entry
+BATCHED_OPERATIONS = ('macquire', 'mrelease_expected')
+
+FAILURES = (LockAlreadyHeld, LockExpired, LockNotOwned)
+
+
+class KeyChooser(object):
+    """
+    draws lock arguments according to a contention level.
+    """
+    def __init__(self, contention, keyspace, worker_name, seed):
+        self.contention = contention
+        self.worker_name = worker_name
+        self.random = random.Random(seed)
+        self.counter = 0
+        if contention == 'zipf':
+            weights = [1.0 / (rank ** 1.1) for rank in range(1, keyspace + 1)]
+            total = sum(weights)
+            self.cumulative = []
+            running = 0.0
+            for weight in weights:
+                running += weight
+                self.cumulative.append(running / total)
+
+    def one(self):
+        if self.contention == 'hot':
+            return 'hot'
+        if self.contention == 'zipf':
+            rank = bisect.bisect_left(self.cumulative, self.random.random())
+            return 'zipf-%i' % min(rank, len(self.cumulative) - 1)
+        self.counter += 1
+        return '%s-%i' % (self.worker_name, self.counter)
+
+    def many(self, count):
+        # macquire maps each args list to one handle, so drop repeats
+        return list(set(self.one() for _ in range(count)))
+
+
+def time_call(fn, *args):
+    """
+    returns a tuple of (seconds taken, result or None, True if fn didn't fail).
+
+    the operations below return (seconds taken or None if their setup
+    failed, True if the timed call didn't fail, number of keys it used).
+    """
+    started_at = monotonic()
+    try:
+        result = fn(*args)
+    except FAILURES:
+        return monotonic() - started_at, None, False
+    return monotonic() - started_at, result, True
+
+
+def acquire(lock, keys, batch_size):
+    elapsed, handle, ok = time_call(lock.acquire, keys.one())
+    if ok:
+        handle.release(ignore_failure=True)
+    return elapsed, ok, 1
+
+
+def macquire(lock, keys, batch_size):
+    args_lists = keys.many(batch_size)
+    elapsed, result, ok = time_call(lock.macquire, args_lists)
+    locked = result[0] if ok else {}
+    if locked:
+        lock.mrelease_expected(dict((args, handle.id) for args, handle in locked.items()))
+    return elapsed, ok, len(args_lists)
+
+
+def release(lock, keys, batch_size):
+    try:
+        handle = lock.acquire(keys.one())
+    except LockAlreadyHeld:
+        return None, False, 0
+    elapsed, _, ok = time_call(handle.release)
+    return elapsed, ok, 1
+
+
+def release_expected(lock, keys, batch_size):
+    args = keys.one()
+    try:
+        handle = lock.acquire(args)
+    except LockAlreadyHeld:
+        return None, False, 0
+    elapsed, _, ok = time_call(lock.release_expected, args, handle.id)
+    return elapsed, ok, 1
+
+
+def mrelease_expected(lock, keys, batch_size):
+    locked, _ = lock.macquire(keys.many(batch_size))
+    if not locked:
+        return None, False, 0
+    expected = dict((args, handle.id) for args, handle in locked.items())
+    elapsed, _, ok = time_call(lock.mrelease_expected, expected)
+    return elapsed, ok, len(expected)
+
+
+def is_held(lock, keys, batch_size):
+    elapsed, _, ok = time_call(lock.is_held, keys.one())
+    return elapsed, ok, 1
+
+
+def get_lease_handle(lock, keys, batch_size):
+    args = keys.one()
+    try:
+        handle = lock.acquire(args)
+    except LockAlreadyHeld:
+        return None, False, 0
+    elapsed, _, ok = time_call(lock.get_lease_handle, args, handle.id)
+    handle.release(ignore_failure=True)
+    return elapsed, ok, 1
+
+
+OPERATIONS = {
+    'acquire': acquire,
+    'macquire': macquire,
+    'release': release,
+    'release_expected': release_expected,
+    'mrelease_expected': mrelease_expected,
+    'is_held': is_held,
+    'get_lease_handle': get_lease_handle,
+}
+
+
+def run_thread(operation, lock, keys, batch_size, deadline, samples):
+    fn = OPERATIONS[operation]
+    latencies = []
+    skipped = failed = key_count = 0
+    while monotonic() < deadline:
+        elapsed, ok, call_keys = fn(lock, keys, batch_size)
+        if elapsed is None:
+            skipped += 1
+            continue
+        latencies.append(elapsed)
+        key_count += call_keys
+        if not ok:
+            failed += 1
+    samples.append((latencies, failed, skipped, key_count))
+
+
+def run_process(job):
+    """
+    runs `threads` threads of one operation for `duration` seconds in
+    this process, and returns their latencies and counts.
+    """
+    redis_conns = [redis.StrictRedis(unix_socket_path=socket) for socket in job['sockets']]
+    lock = BlockingRedisLockFactory(
+        prefix='bench', ttl=30, arity=1, root_prefix='pylocks-bench'
+    ).build(redis_conns[0] if len(redis_conns) == 1 else redis_conns)
+    deadline = monotonic() + job['duration']
+    samples = []
+    threads = []
+    for i in range(job['threads']):
+        worker_name = 'p%i-t%i' % (job['process'], i)
+        keys = KeyChooser(job['contention'], job['keyspace'], worker_name, seed=worker_name)
+        threads.append(threading.Thread(
+            target=run_thread,
+            args=(job['operation'], lock, keys, job['batch_size'], deadline, samples)
+        ))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = []
+    failed = skipped = key_count = 0
+    for thread_latencies, thread_failed, thread_skipped, thread_keys in samples:
+        latencies.extend(thread_latencies)
+        failed += thread_failed
+        skipped += thread_skipped
+        key_count += thread_keys
+    return latencies, failed, skipped, key_count
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(scenario, latencies, failed, skipped, key_count, wall_secs):
+    latencies = sorted(latencies)
+    micros = lambda secs: None if secs is None else round(secs * 1e6, 1)
+    summary = dict(scenario)
+    summary.update({
+        'calls': len(latencies),
+        'failed': failed,
+        'skipped': skipped,
+        'calls_per_sec': round(len(latencies) / wall_secs, 1),
+        'keys_per_sec': round(key_count / wall_secs, 1),
+        'mean_us': micros(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_us': micros(percentile(latencies, 0.50)),
+        'p90_us': micros(percentile(latencies, 0.90)),
+        'p99_us': micros(percentile(latencies, 0.99)),
+        'p999_us': micros(percentile(latencies, 0.999)),
+        'max_us': micros(latencies[-1] if latencies else None),
+    })
+    return summary
+
+
+def scenario_name(scenario):
+    name = scenario['operation']
+    if scenario['operation'] in BATCHED_OPERATIONS:
+        name += '[%i]' % scenario['batch_size']
+    name = '%s/%s/%ip%it' % (
+        name, scenario['contention'], scenario['processes'], scenario['threads']
+    )
+    if scenario['shards'] > 1:
+        name += '/%is' % scenario['shards']
+    return name
+
+
+def scenarios(args):
+    for operation in args.operations:
+        batch_sizes = args.batch_sizes if operation in BATCHED_OPERATIONS else [1]
+        for batch_size in batch_sizes:
+            for contention in args.contention:
+                for processes in args.processes:
+                    for threads in args.threads:
+                        for shards in args.shards:
+                            scenario = {
+                                'operation': operation,
+                                'batch_size': batch_size,
+                                'contention': contention,
+                                'processes': processes,
+                                'threads': threads,
+                                'shards': shards,
+                            }
+                            scenario['name'] = scenario_name(scenario)
+                            yield scenario
+
+
+def run_scenario(servers, pool, scenario, args):
+    servers = servers[:scenario['shards']]
+    for server in servers:
+        server.flushdb()
+    jobs = [
+        dict(
+            scenario, process=i, sockets=[server.socket_file for server in servers],
+            duration=args.duration, keyspace=args.keyspace
+        )
+        for i in range(scenario['processes'])
+    ]
+    started_at = monotonic()
+    if scenario['processes'] == 1:
+        outcomes = [run_process(jobs[0])]
+    else:
+        outcomes = pool.map(run_process, jobs)
+    wall_secs = monotonic() - started_at
+    latencies = []
+    failed = skipped = key_count = 0
+    for process_latencies, process_failed, process_skipped, process_keys in outcomes:
+        latencies.extend(process_latencies)
+        failed += process_failed
+        skipped += process_skipped
+        key_count += process_keys
+    return summarize(scenario, latencies, failed, skipped, key_count, wall_secs)
+
+
+def comma_list(convert):
+    return lambda text: [convert(item) for item in text.split(',') if item]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--operations', type=comma_list(str), default=sorted(OPERATIONS))
+    parser.add_argument('--contention', type=comma_list(str), default=list(CONTENTION_LEVELS))
+    parser.add_argument('--threads', type=comma_list(int), default=[1, 8])
+    parser.add_argument('--processes', type=comma_list(int), default=[1, 4])
+    parser.add_argument('--batch-sizes', type=comma_list(int), default=[1, 10, 100, 1000, 10000])
+    parser.add_argument('--shards', type=comma_list(int), default=[1],
+                        help='numbers of redis servers to spread keys over')
+    parser.add_argument('--duration', type=float, default=1.0,
+                        help='seconds to run each scenario for')
+    parser.add_argument('--keyspace', type=int, default=10000,
+                        help='number of keys the zipf distribution draws from')
+    parser.add_argument('--output', help='file to write the results to, as JSON')
+    args = parser.parse_args(argv)
+    for operation in args.operations:
+        if operation not in OPERATIONS:
+            parser.error('unknown operation: %s' % operation)
+    for contention in args.contention:
+        if contention not in CONTENTION_LEVELS:
+            parser.error('unknown contention level: %s' % contention)
+    return args
+
+
+def main(argv=None):
+    import redislite
+    args = parse_args(argv)
+    servers = [redislite.StrictRedis() for _ in range(max(args.shards))]
+    results = []
+    pool = multiprocessing.Pool(max(args.processes))
+    try:
+        print('%-44s %10s %8s %10s %10s %10s %8s' % (
+            'scenario', 'calls/s', 'keys/s', 'p50 us', 'p99 us', 'p99.9 us', 'failed'
+        ))
+        for scenario in scenarios(args):
+            result = run_scenario(servers, pool, scenario, args)
+            results.append(result)
+            print('%-44s %10.0f %8.0f %10s %10s %10s %8i' % (
+                result['name'], result['calls_per_sec'], result['keys_per_sec'],
+                result['p50_us'], result['p99_us'], result['p999_us'], result['failed']
+            ))
+            sys.stdout.flush()
+    finally:
+        pool.terminate()
+    report = {
+        'meta': {
+            'created_at': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'redis_server': servers[0].info('server').get('redis_version'),
+            'duration': args.duration,
+            'keyspace': args.keyspace,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('wrote %i results to %s' % (len(results), args.output))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import celery
+from pylocks.contrib.celery import LeasedTask
 
-class BaseTask(celery.Task):
+class BaseTask(LeasedTask):
     pass
@@ -1,10 +1,15 @@
+from pylocks.blocking import BlockingRedisLockFactory
 from .conf import app, DEFAULT_QUEUE, lock_redis
 
+echo_lock = BlockingRedisLockFactory(
+    prefix='echo', ttl=60, arity=1, root_prefix='celery_app'
+).build(lock_redis())
+
 @app.task
 def concatenate(x, y):
     return x + y
 
-@app.task
+@app.task(lock=echo_lock)
 def echo(msg):
     return msg
 
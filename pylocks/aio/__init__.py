@@ -0,0 +1,2 @@
+from .async_redis_lock import AsyncRedisLock, AsyncRedisLockFactory
+from .async_lease_handle import AsyncLeaseHandle
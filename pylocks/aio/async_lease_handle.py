@@ -0,0 +1,179 @@
+import contextlib
+from redis.exceptions import WatchError
+from pylocks.core import lease_codecs, operations, scripts
+from pylocks.core.lock_lease_data import LockLeaseData
+from pylocks.errors import LockExpired, LockNotOwned
+
+
+async def release_leases(redis_conn, keys_to_ids):
+    """
+    Releases every key in `keys_to_ids` whose current lease ID
+    matches the expected one, checking all of them in one round trip.
+
+    returns a tuple of:
+        - a list of keys which were released
+        - a list of keys which were not held by the expected lease
+    """
+    keys = list(keys_to_ids.keys())
+    if not keys:
+        return [], []
+    release_script = redis_conn.register_script(scripts.RELEASE)
+    results = await release_script(keys=keys, args=[keys_to_ids[key] for key in keys])
+    checked = []
+    for key, result in zip(keys, results):
+        if result == scripts.UNFRAMED:
+            result = await _release_unframed(redis_conn, key, keys_to_ids[key])
+        checked.append(result)
+    return operations.split_results(keys, checked, scripts.RELEASED)
+
+
+async def extend_leases(redis_conn, leases):
+    """
+    Resets the TTL of every lease in `leases` which is still owned,
+    checking all of them in one round trip.
+
+    `leases` is a list of (key, expected_id, ttl_in_seconds) tuples.
+
+    returns a tuple of:
+        - a list of keys which were extended
+        - a list of keys which were not held by the expected lease
+    """
+    if not leases:
+        return [], []
+    keys, args = operations.extend_args(leases)
+    extend_script = redis_conn.register_script(scripts.EXTEND)
+    results = await extend_script(keys=keys, args=args)
+    return operations.split_results(keys, results, scripts.EXTENDED)
+
+
+async def _release_unframed(redis_conn, key, expected_id):
+    """
+    fallback for values written before lease IDs were framed,
+    which the release script can't read.
+    """
+    async with redis_conn.pipeline() as pipe:
+        while True:
+            try:
+                await pipe.watch(key)
+                current_value = await pipe.get(key)
+                if not current_value or LockLeaseData.read_id(current_value) != expected_id:
+                    return scripts.NOT_OWNED
+                pipe.multi()
+                pipe.delete(key)
+                await pipe.execute()
+                return scripts.RELEASED
+            except WatchError:
+                continue
+            finally:
+                await pipe.reset()
+
+
+class AsyncLeaseHandle(object):
+    """
+    asyncio counterpart of `pylocks.blocking.BlockingRedisLeaseHandle`,
+    for use with a `redis.asyncio` connection.
+    """
+    def __init__(self, handle_data, redis_conn, codec=None):
+        self.handle_data = handle_data
+        self.redis_conn = redis_conn
+        self.codec = lease_codecs.get_codec(codec)
+
+    @property
+    def key(self):
+        return self.handle_data.key
+
+    @property
+    def id(self):
+        return self.handle_data.id
+
+    @property
+    def fence(self):
+        return self.handle_data.fence
+
+    def serialize(self):
+        return self.codec.encode(self.handle_data)
+
+    @classmethod
+    def deserialize(cls, data, redis_conn, key=None):
+        return cls(handle_data=lease_codecs.decode_lease(data, key=key), redis_conn=redis_conn)
+
+    async def do_i_still_have_lock(self):
+        """
+        returns True if:
+            - the lock is held
+            - the lock's current id is equal to this handle's
+        """
+        result = await self.redis_conn.get(self.key)
+        if not result:
+            return False
+        return LockLeaseData.read_id(result) == self.id
+
+    async def check_if_owned(self):
+        """
+        raises LockExpired if this handle no longer owns its key.
+        """
+        if not await self.do_i_still_have_lock():
+            raise LockExpired(self.key, self.id)
+
+    @classmethod
+    async def get_lease_handle(cls, key, expected_id, redis_conn):
+        return await cls.get_existing(key=key, expected_id=expected_id, redis_conn=redis_conn)
+
+    @classmethod
+    async def get_existing(cls, key, expected_id, redis_conn):
+        """
+        instantiates a handle for a given lock, which should
+        already have been acquired.
+
+        if the key is unlocked, or if its ID does not match
+        `expected_id`, raises `LockExpired`
+        """
+        data, fence = await redis_conn.mget([key, scripts.fence_key(key)])
+        if not data:
+            raise LockExpired(key, expected_id)
+        instance = cls.deserialize(redis_conn=redis_conn, data=data, key=key)
+        if instance.id != expected_id:
+            raise LockExpired(key, expected_id)
+        instance.handle_data.fence = operations.read_fence(fence)
+        return instance
+
+    async def release(self, ignore_failure=False):
+        """
+        Releases the held lock, *if* the lock's current
+        ID is equal to this handle's.
+
+        On failure, Raises `LockNotOwned` if `ignore_failure` is not True.
+        """
+        released, _ = await release_leases(self.redis_conn, {self.key: self.id})
+        if not released:
+            if ignore_failure:
+                return False
+            raise LockNotOwned(self.key, self.id)
+        return True
+
+    async def extend(self, ttl=None):
+        """
+        Resets the lease's TTL to `ttl` seconds (default: the TTL it was
+        acquired with), *if* this handle still owns the lock.
+
+        raises `LockExpired` otherwise.
+        """
+        if ttl is None:
+            ttl = self.handle_data.request.initial_ttl
+        extended, _ = await extend_leases(self.redis_conn, [(self.key, self.id, ttl)])
+        if not extended:
+            raise LockExpired(self.key, self.id)
+
+    @contextlib.asynccontextmanager
+    async def releasing(self, ignore_failure=False):
+        """
+        Convenience context manager: makes sure lock is released at end of scope.
+        """
+        try:
+            yield
+        finally:
+            try:
+                await self.release()
+            except LockNotOwned:
+                if not ignore_failure:
+                    raise
@@ -0,0 +1,226 @@
+from pylocks.errors import LockAlreadyHeld, LockNotOwned
+from pylocks.util import monotonic
+from pylocks.conf import DEFAULT_ROOT_PREFIX
+from pylocks.core import lease_codecs, operations, scripts
+from pylocks.core.lock_settings import LockSettings
+from pylocks.blocking.release_waiter import keyspace_channel
+from .async_lease_handle import AsyncLeaseHandle, release_leases
+
+
+class AsyncRedisLock(object):
+    """
+    asyncio counterpart of `pylocks.blocking.BlockingRedisLock`, for use
+    with a `redis.asyncio` connection. It runs the same scripts and
+    stores the same lease values, so both kinds of lock can share keys.
+    """
+    def __init__(self, settings, redis_conn, codec=None):
+        self.settings = settings
+        self.redis_conn = redis_conn
+        self.codec = lease_codecs.get_codec(codec)
+        self._acquire_script = redis_conn.register_script(scripts.ACQUIRE)
+        self._acquire_all_script = redis_conn.register_script(scripts.ACQUIRE_ALL)
+
+    @property
+    def arity(self):
+        return self.settings.arity
+
+    @property
+    def ttl(self):
+        return self.settings.ttl
+
+    @property
+    def prefix(self):
+        return self.settings.prefix
+
+    def make_key(self, args_list):
+        return self.settings.make_key(args_list)
+
+    async def is_held(self, args_list):
+        """
+        returns True if anyone owns the lock for
+        the given args list.
+        """
+        return await self.redis_conn.get(self.make_key(args_list)) is not None
+
+    def _prepare_acquire(self, lock_requests):
+        leases = operations.new_leases(lock_requests)
+        handles = [
+            AsyncLeaseHandle(handle_data=lease, redis_conn=self.redis_conn, codec=self.codec)
+            for lease in leases
+        ]
+        return handles, operations.acquire_args(leases, self.codec)
+
+    async def _try_acquire(self, lock_requests):
+        handles, args = self._prepare_acquire(lock_requests)
+        replies = await self._acquire_script(
+            keys=[request.key for request in lock_requests],
+            args=args
+        )
+        results = operations.record_fences([handle.handle_data for handle in handles], replies)
+        return [
+            (handle if holder_ttl is None else None, operations.remaining_ttl(holder_ttl))
+            for handle, holder_ttl in zip(handles, results)
+        ]
+
+    async def acquire(self, args_list, wait=None):
+        """
+        acquires a lock with key corresponding to `args_list`.
+        returns an `AsyncLeaseHandle` on success.
+
+        if `wait` is given, waits up to that many seconds for a held lock
+        to be released or expire.
+
+        raises an `LockAlreadyHeld` exception on failure.
+        """
+        request = self.settings.make_request(args_list)
+        [(handle, remaining_ttl)] = await self._try_acquire([request])
+        if handle is None and wait:
+            return await self._wait_and_acquire(request, wait)
+        if handle is None:
+            raise LockAlreadyHeld(request.key, remaining_ttl)
+        return handle
+
+    async def _wait_and_acquire(self, request, wait):
+        deadline = monotonic() + wait
+        channels = [
+            scripts.release_channel(request.key),
+            keyspace_channel(self.redis_conn, request.key)
+        ]
+        pubsub = self.redis_conn.pubsub()
+        try:
+            await pubsub.subscribe(*channels)
+            pending = len(channels)
+            while pending:
+                message = await pubsub.get_message(timeout=None)
+                if message is not None and message['type'] == 'subscribe':
+                    pending -= 1
+            while True:
+                [(handle, remaining_ttl)] = await self._try_acquire([request])
+                if handle is not None:
+                    return handle
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    raise LockAlreadyHeld(request.key, remaining_ttl)
+                if remaining_ttl is not None:
+                    timeout = min(timeout, remaining_ttl)
+                await pubsub.get_message(timeout=timeout)
+        finally:
+            await pubsub.aclose()
+
+    async def macquire(self, args_lists, atomic=False):
+        """
+        Attempt to acquire multiple locks simultaneously,
+        as in `BlockingRedisLock.macquire`.
+
+        returns a tuple of:
+            - a dict mapping arg_lists to successful handles
+            - a list containing the args_list members which could not be locked
+        """
+        args_lists = list(args_lists)
+        requests = self.settings.make_requests(args_lists)
+        req_to_args = dict(zip(requests, args_lists))
+        if not requests:
+            return {}, []
+
+        if atomic:
+            handles, args = self._prepare_acquire(requests)
+            replies = await self._acquire_all_script(
+                keys=[request.key for request in requests],
+                args=args
+            )
+            holder_ttls = operations.record_fences([handle.handle_data for handle in handles], replies)
+            if not operations.took_all(holder_ttls):
+                blocking = operations.blocking_requests(requests, holder_ttls)
+                return {}, [req_to_args[req] for req in blocking]
+            outcomes = [(handle, None) for handle in handles]
+        else:
+            outcomes = await self._try_acquire(requests)
+
+        locked_by_args = {}
+        missing_by_args = []
+        for req, (handle, _) in zip(requests, outcomes):
+            if handle is None:
+                missing_by_args.append(req_to_args[req])
+            else:
+                locked_by_args[req_to_args[req]] = handle
+        return locked_by_args, missing_by_args
+
+    async def mrelease_expected(self, args_lists_to_ids):
+        """
+        Attempt to release multiple locks simultaneously, conditional on the given
+        lease IDs. All of the locks are checked and released in one round trip.
+
+        returns a tuple of:
+            - a list containing args_lists which were released
+            - a list containing args_lists which were not released
+        """
+        keys_to_ids = {}
+        key_to_args = {}
+        for arg_list, expected in args_lists_to_ids.items():
+            key = self.make_key(arg_list)
+            keys_to_ids[key] = expected
+            key_to_args[key] = arg_list
+        released, missing = await release_leases(self.redis_conn, keys_to_ids)
+        return (
+            [key_to_args[key] for key in released],
+            [key_to_args[key] for key in missing]
+        )
+
+    async def release_expected(self, args_list, expected_id):
+        """
+        Release the key corresponding to `args_list`,
+        *if* its current ID matches `expected_id`.
+
+        raises `LockNotOwned` otherwise.
+        """
+        key = self.make_key(args_list)
+        released, _ = await release_leases(self.redis_conn, {key: expected_id})
+        if not released:
+            raise LockNotOwned(key, expected_id)
+
+    async def release_hard(self, args_list):
+        """
+        Releases any locks held on the key corresponding to `args_list`,
+        without checking acquisition IDs.
+        """
+        key = self.make_key(args_list)
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.delete(key)
+        pipe.publish(scripts.release_channel(key), '')
+        deleted, _ = await pipe.execute()
+        if not deleted:
+            raise LockNotOwned(key)
+
+    async def get_lease_handle(self, args_list, expected_id):
+        return await AsyncLeaseHandle.get_existing(
+            key=self.make_key(args_list),
+            expected_id=expected_id,
+            redis_conn=self.redis_conn
+        )
+
+
+class AsyncRedisLockFactory(object):
+    lock_class = AsyncRedisLock
+
+    def __init__(self, prefix, ttl, arity, root_prefix=DEFAULT_ROOT_PREFIX, codec=None,
+                 compact_keys=False):
+        self.settings = LockSettings(
+            prefix=prefix, ttl=ttl, arity=arity, root_prefix=root_prefix, compact_keys=compact_keys
+        )
+        self.codec = codec
+
+    def build(self, redis_conn=None):
+        if redis_conn is None:
+            try:
+                redis_conn = self.get_redis_connection()
+            except NotImplementedError:
+                pass
+        if redis_conn is None:
+            raise ValueError('Need a redis connection')
+        return self.lock_class(settings=self.settings, redis_conn=redis_conn, codec=self.codec)
+
+    def get_redis_connection(self):
+        """
+        should return a `redis.asyncio` connection.
+        """
+        raise NotImplementedError
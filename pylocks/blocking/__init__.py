@@ -1,2 +1,12 @@
 from .blocking_redis_lock import BlockingRedisLock, BlockingRedisLockFactory
 from .blocking_redis_lease_handle import BlockingRedisLeaseHandle
+from .lease_set import LeaseSet
+from .heartbeat import LeaseHeartbeat, get_heartbeat
+from .fair_blocking_redis_lock import FairBlockingRedisLock, FairBlockingRedisLockFactory
+from .local_coordinator import LocalLockCoordinator
+from .batcher import LockBatcher
+from .quorum_redis_lock import QuorumRedisLock, QuorumRedisLockFactory, QuorumLeaseHandle
+from .sharded_redis_lock import ShardedBlockingRedisLock
+from .blocking_redis_rw_lock import BlockingRedisRWLock, BlockingRedisRWLockFactory
+from .shared_lease_handle import SharedLeaseHandle
+from .blocking_redis_semaphore import BlockingRedisSemaphore, BlockingRedisSemaphoreFactory
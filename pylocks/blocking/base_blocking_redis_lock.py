@@ -1,69 +1,144 @@
-import time
 from pylocks.errors import LockAlreadyHeld, LockNotOwned
-from pylocks.util import make_id
-from pylocks.core.lock_lease_data import LockLeaseData
-from .blocking_redis_lease_handle import BlockingRedisLeaseHandle
+from pylocks.instrumentation import get_instrumentation, measure
+from pylocks.util import monotonic, to_millis
+from pylocks.core import lease_codecs, operations, scripts
+from pylocks.core.scripts import release_channel
+from .blocking_redis_lease_handle import BlockingRedisLeaseHandle, release_leases
+from .release_waiter import ReleaseWaiter
 
 class BaseBlockingRedisLock(object):
-    def __init__(self, redis_conn):
+    def __init__(self, redis_conn, codec=None, local_check_margin=None, batcher=None,
+                 instrumentation=None, prefix=None):
+        """
+        `local_check_margin` is passed to the handles this lock creates;
+        see `BlockingRedisLeaseHandle`.
+
+        if `batcher` (a `LockBatcher` on `redis_conn`) is given, single-key
+        acquires and releases, including those of the handles this lock
+        creates, are sent through it together with other threads' calls.
+
+        operations are reported to `instrumentation` (see
+        `pylocks.instrumentation`), under the prefix of their requests,
+        or under `prefix` for those which are only given keys.
+        """
         self.redis_conn = redis_conn
+        self.codec = lease_codecs.get_codec(codec)
+        self.local_check_margin = local_check_margin
+        self.batcher = batcher
+        self.instrumentation = get_instrumentation(instrumentation)
+        self.prefix = prefix
+        self._acquire_script = redis_conn.register_script(scripts.ACQUIRE)
+        self._acquire_all_script = redis_conn.register_script(scripts.ACQUIRE_ALL)
 
     def is_held(self, key):
         """
         returns True if anyone owns the lock for
         the given key
         """
-        return self.redis_conn.get(key) is not None
+        with measure(self.instrumentation, self.prefix, 'is_held'):
+            return self.redis_conn.get(key) is not None
+
+    def mis_held(self, keys):
+        """
+        returns a list with True for each of `keys` which anyone owns,
+        and False for the others, reading all of them in one MGET.
+        """
+        with measure(self.instrumentation, self.prefix, 'mis_held'):
+            return [value is not None for value in self.redis_conn.mget(keys)] if keys else []
 
     def _debug_hard_set_handle(self, lock_handle):
         lock_request = lock_handle.handle_data.request
-        temp_key = '%s-%s' % (lock_request.key, lock_handle.id)
-        pipe = self.redis_conn.pipeline()
-        pipe.setex(
-            name=temp_key,
-            time=lock_request.initial_ttl,
-            value=lock_handle.serialize()
+        self.redis_conn.set(
+            lock_request.key,
+            lock_handle.serialize(),
+            px=to_millis(lock_request.initial_ttl)
         )
-        pipe.rename(temp_key, lock_request.key)
-        result = pipe.execute()
-        got_lock = result[1]
-        assert got_lock
         return lock_handle
 
-    def acquire(self, lock_request):
+    def _prepare_acquire(self, lock_requests):
         """
-        attempt to satisfy a `pylocks.core.lock_request.LockRequest`.
+        returns a tuple of:
+            - a list of candidate handles, one per request
+            - the script arguments (value, ttl in ms) for those handles
+        """
+        leases = operations.new_leases(lock_requests)
+        started_at = monotonic()
+        handles = []
+        for lease in leases:
+            handle = BlockingRedisLeaseHandle(
+                handle_data=lease,
+                redis_conn=self.redis_conn,
+                codec=self.codec,
+                local_check_margin=self.local_check_margin,
+                batcher=self.batcher,
+                instrumentation=self.instrumentation
+            )
+            handle._ttl_was_set(started_at, lease.request.initial_ttl)
+            handles.append(handle)
+        return handles, operations.acquire_args(leases, self.codec)
 
-        if successful, returns a `BlockingRedisLeaseHandle` containing
-        the unique lease id and time of acquisition
+    def _try_acquire(self, lock_requests):
+        """
+        runs the acquire script for `lock_requests` in one round trip.
 
-        raises a `LockAlreadyHeld` exception on failure.
+        returns a list with one `(handle, remaining_ttl)` pair per request.
+        `handle` is None if the lock was already held, in which case
+        `remaining_ttl` is the holder's remaining TTL in seconds
+        (or None if the holder's key never expires).
         """
-        new_id = make_id()
-        now = time.time()
-        possible_handle = BlockingRedisLeaseHandle(
-            redis_conn=self.redis_conn,
-            handle_data=LockLeaseData(
-                request=lock_request,
-                id=new_id,
-                acquired_at=now
+        handles, args = self._prepare_acquire(lock_requests)
+        if self.batcher is not None and len(lock_requests) == 1:
+            replies = [self.batcher.try_acquire(lock_requests[0].key, *args)]
+        else:
+            replies = self._acquire_script(
+                keys=[request.key for request in lock_requests],
+                args=args
             )
-        )
-        temp_key = '%s-%s' % (lock_request.key, new_id)
-        pipe = self.redis_conn.pipeline()
-        pipe.setex(
-            name=temp_key,
-            time=lock_request.initial_ttl,
-            value=possible_handle.serialize()
-        )
-        pipe.renamenx(temp_key, lock_request.key)
-        result = pipe.execute()
-        got_lock = result[1]
-        if got_lock:
-            return possible_handle
-        raise LockAlreadyHeld(lock_request.key)
+        results = operations.record_fences([handle.handle_data for handle in handles], replies)
+        return [
+            (handle if holder_ttl is None else None, operations.remaining_ttl(holder_ttl))
+            for handle, holder_ttl in zip(handles, results)
+        ]
+
+    def acquire(self, lock_request, wait=None):
+        """
+        attempt to satisfy a `pylocks.core.lock_request.LockRequest`.
+
+        if successful, returns a `BlockingRedisLeaseHandle` containing
+        the unique lease id, time of acquisition and fencing token
+
+        if `wait` is given and the lock is held, waits up to `wait` seconds
+        for the holder to release it or for its lease to expire.
 
-    def macquire(self, lock_requests):
+        raises a `LockAlreadyHeld` exception on failure; its `remaining_ttl`
+        is the current holder's remaining TTL in seconds.
+        """
+        with measure(self.instrumentation, lock_request.lock_prefix, 'acquire') as call:
+            [(handle, remaining_ttl)] = self._try_acquire([lock_request])
+            if handle is None and wait:
+                return self._wait_and_acquire(lock_request, wait, call)
+            if handle is None:
+                raise LockAlreadyHeld(lock_request.key, remaining_ttl)
+            return handle
+
+    def _wait_and_acquire(self, lock_request, wait, call):
+        deadline = monotonic() + wait
+        with ReleaseWaiter(self.redis_conn, lock_request.key) as waiter:
+            while True:
+                # retrying right after subscribing covers a release
+                # which happened before the subscription took effect.
+                call.round_trips += 1
+                [(handle, remaining_ttl)] = self._try_acquire([lock_request])
+                if handle is not None:
+                    return handle
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    raise LockAlreadyHeld(lock_request.key, remaining_ttl)
+                if remaining_ttl is not None:
+                    timeout = min(timeout, remaining_ttl)
+                waiter.wait(timeout)
+
+    def macquire(self, lock_requests, atomic=False):
         """
         Attempt to acquire multiple locks simultaneously.
 
@@ -73,71 +148,103 @@ class BaseBlockingRedisLock(object):
             - a dict mapping lock requests to successfully obtained leases
             - a list containing the requests which could not be met
 
+        if `atomic` is True, either every lock is acquired or none are.
+        on failure the dict is empty and the list contains only the
+        requests whose locks were already held.
         """
-        now = time.time()
-        to_set = []
-        for request in lock_requests:
-            possible_handle = BlockingRedisLeaseHandle(
-                redis_conn=self.redis_conn,
-                handle_data=LockLeaseData(
-                    id=make_id(),
-                    acquired_at=now,
-                    request=request
-                )
-            )
-            to_set.append((request, possible_handle))
-
-        pipe = self.redis_conn.pipeline()
-        for request, handle in to_set:
-            temp_key = '%s-%s' % (handle.key, handle.id)
-            pipe.setex(name=temp_key, time=request.initial_ttl, value=handle.serialize())
-            pipe.renamenx(temp_key, handle.key)
-        results = list(pipe.execute())
-        acquired = {}
-        missing = []
-        for i, (arg_list, handle) in enumerate(to_set):
-            result_offset = 2 * i
-            obtained = results[result_offset+1]
-            if obtained:
-                acquired[arg_list] = handle
+        lock_requests = list(lock_requests)
+        if not lock_requests:
+            return {}, []
+        prefix = lock_requests[0].lock_prefix
+        with measure(self.instrumentation, prefix, 'macquire'):
+            if atomic:
+                acquired, missing = self._macquire_all(lock_requests)
             else:
-                missing.append(arg_list)
+                acquired = {}
+                missing = []
+                outcomes = self._try_acquire(lock_requests)
+                for request, (handle, _) in zip(lock_requests, outcomes):
+                    if handle is None:
+                        missing.append(request)
+                    else:
+                        acquired[request] = handle
+        if missing:
+            self.instrumentation.count(prefix, 'macquire_missing', len(missing))
         return acquired, missing
 
+    def _macquire_all(self, lock_requests):
+        handles, args = self._prepare_acquire(lock_requests)
+        replies = self._acquire_all_script(
+            keys=[request.key for request in lock_requests],
+            args=args
+        )
+        holder_ttls = operations.record_fences([handle.handle_data for handle in handles], replies)
+        if operations.took_all(holder_ttls):
+            return dict(zip(lock_requests, handles)), []
+        return {}, operations.blocking_requests(lock_requests, holder_ttls)
+
     def mrelease_expected(self, keys_to_ids):
-        released = []
-        missing = []
-        for key, expected_id in keys_to_ids.items():
-            try:
-                self.release_expected(key, expected_id)
-                released.append(key)
-            except LockNotOwned:
-                missing.append(key)
-        return released, missing
+        """
+        Release multiple locks, each conditional on its expected lease ID.
+
+        All of the checks and deletes happen in one server-side call.
+
+        returns a tuple of:
+            - a list containing keys which were released
+            - a list containing keys which were not released
+        """
+        with measure(self.instrumentation, self.prefix, 'mrelease_expected'):
+            return release_leases(self.redis_conn, keys_to_ids, batcher=self.batcher)
 
     def release_expected(self, key, expected_id):
         """
         Release the lock on `key` *if* the current lease ID
         matches `expected_id`.
+
+        raises `LockNotOwned` otherwise.
         """
-        possible_handle = self.LockHandle.get_lease_handle(
-            key=key, id=expected_id, redis_conn=self.redis_conn
-        )
-        possible_handle.release()
+        with measure(self.instrumentation, self.prefix, 'release_expected'):
+            released, _ = release_leases(self.redis_conn, {key: expected_id}, batcher=self.batcher)
+            if not released:
+                raise LockNotOwned(key, expected_id)
 
     def release_hard(self, key):
         """
         Releases any locks held on `key`,
         without checking lease IDs.
         """
-        result = self.redis_conn.delete(key)
-        if not result:
-            raise LockNotOwned(key)
+        with measure(self.instrumentation, self.prefix, 'release_hard'):
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.delete(key)
+            pipe.publish(release_channel(key), '')
+            deleted, _ = pipe.execute()
+            if not deleted:
+                raise LockNotOwned(key)
+
+    def handle_from_token(self, token, secret=None):
+        """
+        rebuilds a handle from a lease token, without a round trip;
+        see `BlockingRedisLeaseHandle.from_token`.
+        """
+        return BlockingRedisLeaseHandle.from_token(
+            token, self.redis_conn, secret=secret,
+            codec=self.codec,
+            local_check_margin=self.local_check_margin,
+            batcher=self.batcher,
+            instrumentation=self.instrumentation
+        )
+
+    def attach(self, handle):
+        """
+        gives an unpickled handle this lock's connection. returns the handle.
+        """
+        return handle.attach(self.redis_conn, batcher=self.batcher, instrumentation=self.instrumentation)
 
     def get_lease_handle(self, key, expected_id):
         return BlockingRedisLeaseHandle.get_existing(
             key=key,
             expected_id=expected_id,
-            redis_conn=self.redis_conn
+            redis_conn=self.redis_conn,
+            instrumentation=self.instrumentation
         )
 
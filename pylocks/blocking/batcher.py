@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from redis.exceptions import NoScriptError
+from pylocks.core import scripts
+from pylocks.util import monotonic
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _Acquire(object):
+    def __init__(self, key, value, ttl_ms):
+        self.key = key
+        self.value = value
+        self.ttl_ms = ttl_ms
+        self.future = Future()
+
+
+class _Release(object):
+    def __init__(self, key, expected_id):
+        self.key = key
+        self.expected_id = expected_id
+        self.future = Future()
+
+
+class LockBatcher(object):
+    """
+    Sends the acquires and releases of many threads to redis together.
+
+    Calls made within `window` seconds of each other (up to `max_batch`
+    of them) are sent from one daemon thread as a single pipeline: one
+    call to the acquire script for all of the acquires, and one call to
+    the release script for all of the releases. Releases go first, so an
+    acquire batched with the release of the same key can take it.
+
+    Each caller blocks on a future for its own result.
+    """
+    def __init__(self, redis_conn, window=0.001, max_batch=256):
+        self.redis_conn = redis_conn
+        self.window = window
+        self.max_batch = max_batch
+        self.round_trips = 0
+        self._acquire_script = redis_conn.register_script(scripts.ACQUIRE)
+        self._release_script = redis_conn.register_script(scripts.RELEASE)
+        self._scripts_loaded = False
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def try_acquire(self, key, value, ttl_ms):
+        """
+        runs the acquire script for one key as part of the next batch.
+        returns the script's reply for the key: a list holding the lock's
+        fencing token if it was acquired, the holder's PTTL otherwise.
+        """
+        return self._submit(_Acquire(key, value, ttl_ms)).result()
+
+    def release(self, key, expected_id):
+        """
+        runs the release script for one key as part of the next batch.
+        returns its status, one of the statuses in `pylocks.core.scripts`.
+        """
+        return self._submit(_Release(key, expected_id)).result()
+
+    def stop(self):
+        """
+        sends whatever is queued, then stops the dispatcher thread.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _submit(self, call):
+        with self._lock:
+            self._ensure_running()
+            self._queue.put(call)
+        return call.future
+
+    def _ensure_running(self):
+        # a forked child inherits the queue but not the thread
+        if self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._thread = None
+            self._pid = os.getpid()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, args=(self._queue,), name='pylocks-batcher'
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self, calls):
+        while True:
+            first = calls.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            stopping = False
+            deadline = monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    call = calls.get(timeout=max(deadline - monotonic(), 0))
+                except queue.Empty:
+                    break
+                if call is _STOP:
+                    stopping = True
+                    break
+                batch.append(call)
+            self._send(batch)
+            if stopping:
+                return
+
+    def _send(self, batch):
+        releases = [call for call in batch if isinstance(call, _Release)]
+        acquires = [call for call in batch if isinstance(call, _Acquire)]
+        try:
+            results = self._execute(releases, acquires)
+        except Exception as e:
+            logger.exception('failed to send a batch of %i lock calls', len(batch))
+            for call in batch:
+                call.future.set_exception(e)
+            return
+        replies = []
+        if releases:
+            replies.extend(zip(releases, results.pop(0)))
+        if acquires:
+            replies.extend(zip(acquires, results.pop(0)))
+        for call, reply in replies:
+            call.future.set_result(reply)
+
+    def _execute(self, releases, acquires):
+        commands = []
+        if releases:
+            commands.append((scripts.RELEASE, self._release_script.sha, len(releases),
+                             [call.key for call in releases] + [call.expected_id for call in releases]))
+        if acquires:
+            args = []
+            for call in acquires:
+                args.append(call.value)
+                args.append(call.ttl_ms)
+            commands.append((scripts.ACQUIRE, self._acquire_script.sha, len(acquires),
+                             [call.key for call in acquires] + args))
+        if not self._scripts_loaded:
+            # loaded before the first batch, so that releases run before
+            # the acquires batched with them unless the scripts are flushed
+            self.redis_conn.script_load(scripts.RELEASE)
+            self.redis_conn.script_load(scripts.ACQUIRE)
+            self._scripts_loaded = True
+        results = [None] * len(commands)
+        pending = list(range(len(commands)))
+        for attempt in range(2):
+            pipe = self.redis_conn.pipeline(transaction=False)
+            for i in pending:
+                _, sha, num_keys, args = commands[i]
+                pipe.evalsha(sha, num_keys, *args)
+            self.round_trips += 1
+            # if the scripts were flushed since, a command whose script
+            # was found has run and is never sent again: only the ones
+            # which got NOSCRIPT are retried, after loading their scripts.
+            replies = pipe.execute(raise_on_error=False)
+            missing = []
+            for i, reply in zip(pending, replies):
+                results[i] = reply
+                if isinstance(reply, NoScriptError):
+                    missing.append(i)
+            if not missing or attempt:
+                break
+            for i in missing:
+                self.redis_conn.script_load(commands[i][0])
+            pending = missing
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
@@ -1,13 +1,210 @@
-from __future__ import print_function
+from pylocks.core import lease_codecs, lease_tokens, operations, scripts
 from pylocks.core.lock_lease_data import LockLeaseData
 from pylocks.errors import LockExpired, LockNotOwned
+from pylocks.instrumentation import NOT_OWNED, get_instrumentation, measure
+from pylocks.util import monotonic
 from redis import WatchError
 import contextlib
+import time
+import weakref
+
+
+# redis connection -> {script source: registered script}
+_registered_scripts = weakref.WeakKeyDictionary()
+
+
+def get_script(redis_conn, source):
+    """
+    returns `source` registered on `redis_conn`, registering it on
+    first use, so bulk helpers don't re-hash their scripts per call.
+    """
+    try:
+        return _registered_scripts[redis_conn][source]
+    except KeyError:
+        script = redis_conn.register_script(source)
+        _registered_scripts.setdefault(redis_conn, {})[source] = script
+        return script
+
+
+def release_each(redis_conn, leases):
+    """
+    Releases each lease in `leases`, a list of (key, expected_id)
+    tuples, whose key is still held by it, in one round trip.
+
+    returns a list of booleans, one per lease: whether it was released.
+    leases may share a key.
+    """
+    if not leases:
+        return []
+    keys = [key for key, _ in leases]
+    release_script = get_script(redis_conn, scripts.RELEASE)
+    results = release_script(keys=keys, args=[expected_id for _, expected_id in leases])
+    return [
+        (_release_unframed(redis_conn, key, expected_id) if result == scripts.UNFRAMED else result)
+        == scripts.RELEASED
+        for (key, expected_id), result in zip(leases, results)
+    ]
+
+
+def release_leases(redis_conn, keys_to_ids, batcher=None):
+    """
+    Releases every key in `keys_to_ids` whose current lease ID
+    matches the expected one, checking all of them in one round trip.
+
+    a single key is released through `batcher` (a `LockBatcher`) if given.
+
+    returns a tuple of:
+        - a list of keys which were released
+        - a list of keys which were not held by the expected lease
+    """
+    keys = list(keys_to_ids.keys())
+    if not keys:
+        return [], []
+    if batcher is not None and len(keys) == 1:
+        result = batcher.release(keys[0], keys_to_ids[keys[0]])
+        if result == scripts.UNFRAMED:
+            result = _release_unframed(redis_conn, keys[0], keys_to_ids[keys[0]])
+        results = [result == scripts.RELEASED]
+    else:
+        results = release_each(redis_conn, [(key, keys_to_ids[key]) for key in keys])
+    return operations.split_results(keys, results, True)
+
+
+def extend_each(redis_conn, leases):
+    """
+    Resets the TTL of each lease in `leases` which is still owned,
+    checking all of them in one round trip.
+
+    `leases` is a list of (key, expected_id, ttl_in_seconds) tuples.
+
+    returns a list of booleans, one per lease: whether it was extended.
+    """
+    if not leases:
+        return []
+    keys, args = operations.extend_args(leases)
+    extend_script = get_script(redis_conn, scripts.EXTEND)
+    return [result == scripts.EXTENDED for result in extend_script(keys=keys, args=args)]
+
+
+def extend_leases(redis_conn, leases):
+    """
+    as `extend_each`, returning a tuple of:
+        - a list of keys which were extended
+        - a list of keys which were not held by the expected lease
+    """
+    return operations.split_results(
+        [key for key, _, _ in leases], extend_each(redis_conn, leases), True
+    )
+
+
+def check_each(redis_conn, leases):
+    """
+    Checks whether each lease in `leases`, a list of (key, expected_id)
+    tuples, still holds its key, reading all of them with one MGET.
+
+    returns a list of booleans, one per lease.
+    """
+    if not leases:
+        return []
+    values = redis_conn.mget([key for key, _ in leases])
+    return [
+        bool(value) and LockLeaseData.read_id(value) == expected_id
+        for (_, expected_id), value in zip(leases, values)
+    ]
+
+
+def check_leases(redis_conn, keys_to_ids):
+    """
+    Checks which keys in `keys_to_ids` are still held by the expected
+    lease ID, reading all of them with one MGET.
+
+    returns a tuple of:
+        - a list of keys which are still held by the expected lease
+        - a list of keys which are not
+    """
+    keys = list(keys_to_ids.keys())
+    return operations.split_results(
+        keys, check_each(redis_conn, [(key, keys_to_ids[key]) for key in keys]), True
+    )
+
+
+def _release_unframed(redis_conn, key, expected_id):
+    """
+    fallback for values written before lease IDs were framed,
+    which the release script can't read.
+    """
+    with redis_conn.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                current_value = pipe.get(key)
+                if not current_value or LockLeaseData.read_id(current_value) != expected_id:
+                    return scripts.NOT_OWNED
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+                return scripts.RELEASED
+            except WatchError:
+                continue
+            finally:
+                pipe.reset()
 
 class BlockingRedisLeaseHandle(object):
-    def __init__(self, handle_data, redis_conn):
+    # how `LeaseSet` and `LeaseHeartbeat` check, release and extend many
+    # handles of this class which share a connection, each in one round
+    # trip. they take lists of lease tuples and return one result per lease.
+    check_many = staticmethod(check_each)
+    release_many = staticmethod(release_each)
+    extend_many = staticmethod(extend_each)
+
+    def __init__(self, handle_data, redis_conn, codec=None, local_check_margin=None,
+                 batcher=None, instrumentation=None):
+        """
+        if `local_check_margin` is given, ownership checks are answered
+        without a round trip while the lease is known to have more than
+        that many seconds left, and once this process has released it
+        or seen that it's gone.
+
+        if `batcher` is given, `release` goes through it.
+
+        `instrumentation` defaults to `pylocks.instrumentation`'s default.
+        """
         self.handle_data = handle_data
         self.redis_conn = redis_conn
+        self.batcher = batcher
+        self.instrumentation = get_instrumentation(instrumentation)
+        self.codec = lease_codecs.get_codec(codec)
+        self.local_check_margin = local_check_margin
+        self.local_checks = 0
+        self.remote_checks = 0
+        # monotonic time by which the lease is sure to have expired,
+        # if we know when its TTL was last set.
+        self._valid_until = None
+        self._known_lost = False
+
+    def _ttl_was_set(self, started_at, ttl):
+        """
+        records that the lease's TTL was set to `ttl` seconds by a
+        command sent at monotonic time `started_at`.
+        """
+        self._valid_until = started_at + ttl
+
+    def _was_lost(self):
+        self._valid_until = None
+        self._known_lost = True
+
+    def _check_locally(self):
+        """
+        returns True or False if ownership can be answered without
+        asking redis, or None if it can't.
+        """
+        if self.local_check_margin is None:
+            return None
+        if self._known_lost:
+            return False
+        if self._valid_until is not None and monotonic() < self._valid_until - self.local_check_margin:
+            return True
+        return None
 
     @property
     def key(self):
@@ -17,27 +214,110 @@ class BlockingRedisLeaseHandle(object):
     def id(self):
         return self.handle_data.id
 
+    @property
+    def prefix(self):
+        return self.handle_data.request.lock_prefix
+
+    @property
+    def fence(self):
+        """
+        the lease's fencing token, or None if its lock doesn't issue them.
+
+        it's greater than the token of every earlier lease on the key, so
+        a store which records the highest token it has accepted can turn
+        away writes from a holder whose lease has since expired, without
+        the holder checking ownership before each write.
+        """
+        return self.handle_data.fence
+
+    def _report_release(self):
+        self.instrumentation.hold_time(self.prefix, time.time() - self.handle_data.acquired_at)
+        self._report_headroom()
+
+    def _report_headroom(self):
+        if self._valid_until is not None:
+            self.instrumentation.ttl_headroom(self.prefix, self._valid_until - monotonic())
+
     def serialize(self):
-        return self.handle_data.serialize()
+        return self.codec.encode(self.handle_data)
+
+    def to_token(self, secret=None):
+        """
+        returns a lease token for this handle, from which `from_token`
+        rebuilds it, e.g. in another process, without a round trip.
+        see `pylocks.core.lease_tokens`.
+        """
+        return lease_tokens.encode_token(self.handle_data, secret=secret)
 
     @classmethod
-    def deserialize(cls, data, redis_conn):
-        return cls(handle_data=LockLeaseData.deserialize(data), redis_conn=redis_conn)
+    def from_token(cls, token, redis_conn, secret=None, **kwargs):
+        """
+        rebuilds a handle from a token made by `to_token`, without
+        checking that its lease is still held; `do_i_still_have_lock`
+        does that when it's wanted. other arguments are as for `__init__`.
+
+        raises `InvalidLeaseToken` if `token` isn't one, or if it
+        isn't signed with `secret`.
+        """
+        return cls(handle_data=lease_tokens.decode_token(token, secret=secret),
+                   redis_conn=redis_conn, **kwargs)
+
+    def attach(self, redis_conn, batcher=None, instrumentation=None):
+        """
+        gives an unpickled handle a connection to use. returns the handle.
+        """
+        self.redis_conn = redis_conn
+        self.batcher = batcher
+        self.instrumentation = get_instrumentation(instrumentation)
+        return self
+
+    def __getstate__(self):
+        # the connection, batcher and instrumentation belong to this
+        # process, as does the monotonic clock `_valid_until` is on;
+        # an unpickled handle needs `attach` before it talks to redis.
+        state = self.__dict__.copy()
+        state.update(redis_conn=None, batcher=None, instrumentation=None, _valid_until=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.instrumentation = get_instrumentation(None)
+
+    @classmethod
+    def deserialize(cls, data, redis_conn, key=None, instrumentation=None):
+        return cls(
+            handle_data=lease_codecs.decode_lease(data, key=key),
+            redis_conn=redis_conn,
+            instrumentation=instrumentation
+        )
 
     def _check_if_same_id(self, raw_response):
-        result = LockLeaseData.deserialize(raw_response)
-        return result.id == self.id
+        return LockLeaseData.read_id(raw_response) == self.id
 
     def do_i_still_have_lock(self):
         """
         returns True if:
             - the lock is held
             - the lock's current id is equal to this handle's
+
+        with a `local_check_margin`, this may be answered locally;
+        see `local_checks` and `remote_checks` for how often.
         """
+        with measure(self.instrumentation, self.prefix, 'check') as call:
+            owned = self._check_locally()
+            if owned is not None:
+                self.local_checks += 1
+                call.round_trips = 0
+                return owned
+            self.remote_checks += 1
+            if not self._check_remotely():
+                self._was_lost()
+                return False
+            return True
+
+    def _check_remotely(self):
         result = self.redis_conn.get(self.key)
-        if not result:
-            return False
-        return self._check_if_same_id(result)
+        return bool(result) and self._check_if_same_id(result)
 
     def check_if_owned(self):
         """
@@ -47,47 +327,84 @@ class BlockingRedisLeaseHandle(object):
             raise LockExpired(self.key, self.id)
 
     @classmethod
-    def get_existing(cls, key, expected_id, redis_conn):
+    def get_lease_handle(cls, key, expected_id, redis_conn, instrumentation=None):
+        return cls.get_existing(
+            key=key, expected_id=expected_id, redis_conn=redis_conn,
+            instrumentation=instrumentation
+        )
+
+    @classmethod
+    def get_existing(cls, key, expected_id, redis_conn, instrumentation=None):
         """
         instantiates a handle for a given lock, which should
         already have been acquired.
 
         if the key is unlocked, or if its ID does not match
         `expected_id`, raises `LockExpired`
+
+        the lease's fencing token is read along with it. the raw value
+        read is reported as a `lease_value` trace event.
         """
-        data = redis_conn.get(key)
-        print(data)
-        if not data:
-            raise LockExpired(key, expected_id)
-        instance = cls.deserialize(redis_conn=redis_conn, data=data)
-        if instance.id != expected_id:
-            raise LockExpired(key, expected_id)
-        return instance
+        instrumentation = get_instrumentation(instrumentation)
+        with measure(instrumentation, None, 'get_lease_handle') as call:
+            data, fence = redis_conn.mget([key, scripts.fence_key(key)])
+            instrumentation.trace('lease_value', key=key, value=data)
+            if not data:
+                raise LockExpired(key, expected_id)
+            instance = cls.deserialize(
+                redis_conn=redis_conn, data=data, key=key, instrumentation=instrumentation
+            )
+            call.prefix = instance.prefix
+            if instance.id != expected_id:
+                raise LockExpired(key, expected_id)
+            instance.handle_data.fence = operations.read_fence(fence)
+            return instance
 
     def release(self, ignore_failure=False):
         """
         Releases the held lock, *if* the lock's current
         ID is equal to this handle's.
 
+        The ID check and the delete happen in one server-side step.
+
         On failure, Raises `LockNotOwned` if `ignore_failure` is not True.
         """
-        with self.redis_conn.pipeline() as pipe:
-            while True:
-                try:
-                    pipe.watch(self.key)
-                    current_value = pipe.get(self.key)
-                    if not current_value or not self._check_if_same_id(current_value):
-                        if ignore_failure:
-                            return False
-                        raise LockNotOwned(self.key, self.id)
-                    pipe.multi()
-                    pipe.delete(self.key)
-                    pipe.execute()
-                    break
-                except WatchError:
-                    continue
-                finally:
-                    pipe.reset()
+        with measure(self.instrumentation, self.prefix, 'release') as call:
+            released = self._release_remotely()
+            if released:
+                self._report_release()
+            self._was_lost()
+            if not released:
+                if ignore_failure:
+                    call.outcome = NOT_OWNED
+                    return False
+                raise LockNotOwned(self.key, self.id)
+            return True
+
+    def extend(self, ttl=None):
+        """
+        Resets the lease's TTL to `ttl` seconds (default: the TTL it was
+        acquired with), *if* this handle still owns the lock.
+
+        raises `LockExpired` otherwise.
+        """
+        if ttl is None:
+            ttl = self.handle_data.request.initial_ttl
+        with measure(self.instrumentation, self.prefix, 'extend'):
+            self._report_headroom()
+            started_at = monotonic()
+            if not self._extend_remotely(ttl):
+                self._was_lost()
+                raise LockExpired(self.key, self.id)
+            self._ttl_was_set(started_at, ttl)
+
+    def _release_remotely(self):
+        released, _ = release_leases(self.redis_conn, {self.key: self.id}, batcher=self.batcher)
+        return bool(released)
+
+    def _extend_remotely(self, ttl):
+        extended, _ = extend_leases(self.redis_conn, [(self.key, self.id, ttl)])
+        return bool(extended)
 
     @contextlib.contextmanager
     def releasing(self, ignore_failure=False):
@@ -1,15 +1,27 @@
-import time
-from pylocks.errors import LockNotOwned
+import threading
 from pylocks.core.lock_settings import LockSettings
 from pylocks.conf import DEFAULT_ROOT_PREFIX
 from .base_blocking_redis_lock import BaseBlockingRedisLock
+from .batcher import LockBatcher
+from .inventory import reap_temp_keys, scan_leases
+from .local_coordinator import LocalLockCoordinator
+from .sharded_redis_lock import ShardedBlockingRedisLock, shard_name
 
 
 class BlockingRedisLock(object):
-    def __init__(self, settings, redis_conn):
+    def __init__(self, settings, redis_conn, codec=None, local_check_margin=None,
+                 coordinator=None, batcher=None, instrumentation=None):
         self.settings = settings
         self.redis_conn = redis_conn
-        self.base_lock = BaseBlockingRedisLock(redis_conn=redis_conn)
+        self.coordinator = coordinator
+        self.base_lock = BaseBlockingRedisLock(
+            redis_conn=redis_conn, codec=codec, local_check_margin=local_check_margin,
+            batcher=batcher, instrumentation=instrumentation, prefix=settings.prefix
+        )
+
+    @property
+    def instrumentation(self):
+        return self.base_lock.instrumentation
 
     @property
     def arity(self):
@@ -24,7 +36,7 @@ class BlockingRedisLock(object):
         return self.settings.prefix
 
     def make_key(self, args_list):
-        return self.settings.make_request(args_list).key
+        return self.settings.make_key(args_list)
 
     def is_held(self, args_list):
         """
@@ -33,17 +45,46 @@ class BlockingRedisLock(object):
         """
         return self.base_lock.is_held(self.make_key(args_list))
 
-    def acquire(self, args_list):
+    def mis_held(self, args_lists):
+        """
+        `is_held` for each of `args_lists`, in one round trip.
+        returns a list of booleans in the same order.
+        """
+        return self.base_lock.mis_held(self.settings.make_keys(args_lists))
+
+    def acquire(self, args_list, wait=None):
         """
         acquires a lock with key corresponding to `args_list`.
         returns a `LockHandle` on success with the ID and time of
         acquisition.
+
+        if `wait` is given, waits up to that many seconds for a held lock
+        to be released or expire. waiting is driven by release notifications,
+        so idle waiters don't poll redis.
+
+        with a `coordinator`, threads of this process acquiring the same
+        key go through it; see `LocalLockCoordinator`.
+
         raises an `LockAlreadyHeld` exception on failure.
         """
         request = self.settings.make_request(args_list)
-        return self.base_lock.acquire(request)
+        if self.coordinator is None:
+            return self._acquire(request, wait)
+        attempted = []
+
+        def attempt(remaining):
+            attempted.append(True)
+            return self._acquire(request, remaining)
+        try:
+            return self.coordinator.acquire(request.key, attempt, wait=wait)
+        finally:
+            if not attempted:
+                self.instrumentation.count(self.prefix, 'acquire_coordinated_locally')
+
+    def _acquire(self, request, wait):
+        return self.base_lock.acquire(request, wait=wait)
 
-    def macquire(self, args_lists):
+    def macquire(self, args_lists, atomic=False):
         """
         Attempt to acquire multiple locks simultaneously.
 
@@ -58,16 +99,16 @@ class BlockingRedisLock(object):
             - a dict mapping arg_lists to successful handles
             - a list containins the args_list members which could not be locked
 
+        if `atomic` is True, all of the locks are taken in one server-side
+        step or none of them are. on failure the dict is empty and the list
+        contains only the args_lists whose locks were already held.
+
         """
-        now = time.time()
-        requests = []
-        req_to_args = {}
-        for one_args_list in args_lists:
-            req = self.settings.make_request(args_list=one_args_list, now=now)
-            requests.append(req)
-            req_to_args[req] = one_args_list
+        args_lists = list(args_lists)
+        requests = self.settings.make_requests(args_lists)
+        req_to_args = dict(zip(requests, args_lists))
 
-        locked, missing = self.base_lock.macquire(requests)
+        locked, missing = self.base_lock.macquire(requests, atomic=atomic)
         locked_by_args = {}
         for req, handle in locked.items():
             locked_by_args[req_to_args[req]] = handle
@@ -77,7 +118,7 @@ class BlockingRedisLock(object):
     def mrelease_expected(self, args_lists_to_ids):
         """
         Attempt to release multiple locks simultaneously, conditional on the given
-        lease IDs.
+        lease IDs. All of the locks are checked and released in one round trip.
 
         `args_lists_to_ids` should be a dict mapping tuples of length `arity`
         to expected lease IDs.
@@ -87,24 +128,24 @@ class BlockingRedisLock(object):
             - a list containing args_lists which were not released
 
         """
-        released = []
-        missing = []
+        keys_to_ids = {}
+        key_to_args = {}
         for arg_list, expected in args_lists_to_ids.items():
-            req = self.settings.make_request(arg_list)
-            try:
-                self.base_lock.release_expected(req.key, expected)
-                released.append(arg_list)
-            except LockNotOwned:
-                missing.append(arg_list)
-        return released, missing
+            key = self.make_key(arg_list)
+            keys_to_ids[key] = expected
+            key_to_args[key] = arg_list
+        released, missing = self.base_lock.mrelease_expected(keys_to_ids)
+        return (
+            [key_to_args[key] for key in released],
+            [key_to_args[key] for key in missing]
+        )
 
     def release_expected(self, args_list, expected_id):
         """
         Release the key corresponding to `args_list`,
         *if* its current ID matches `expected_id`.
         """
-        req = self.settings.make_request(args_list)
-        return self.base_lock.release_expected(req.key, expected_id)
+        return self.base_lock.release_expected(self.make_key(args_list), expected_id)
 
     def release_hard(self, args_list):
         """
@@ -113,14 +154,48 @@ class BlockingRedisLock(object):
 
         `release_expected` is a better idea in many situations, but not all of them.
         """
-        key = self.settings.make_request(args_list).key
-        result = self.redis_conn.delete(key)
-        if not result:
-            raise LockNotOwned(key)
+        self.base_lock.release_hard(self.make_key(args_list))
+
+    def scan_leases(self, batch_size=500):
+        """
+        yields a `(LockLeaseData, remaining_ttl)` pair for each lease
+        currently held on this lock, reading them with SCAN in batches of
+        about `batch_size` keys, so memory use stays bounded.
+        """
+        return scan_leases(self.redis_conn, self.settings, batch_size=batch_size)
+
+    def reap_temp_keys(self, batch_size=100, max_per_second=1000):
+        """
+        deletes the temporary keys older versions of pylocks left behind
+        under this lock's prefix; see `pylocks.blocking.inventory`.
+        returns the number of keys deleted.
+        """
+        return reap_temp_keys(
+            self.redis_conn, self.settings, batch_size=batch_size, max_per_second=max_per_second
+        )
+
+    def handle_from_token(self, token, secret=None):
+        """
+        rebuilds a handle on this lock from a token made by its
+        `to_token`, without a round trip and without checking that the
+        lease is still held. see `pylocks.core.lease_tokens`.
+
+        raises `InvalidLeaseToken` if `token` isn't a token of this
+        lock's, or isn't signed with `secret`.
+        """
+        handle = self.base_lock.handle_from_token(token, secret=secret)
+        self.settings.check_token_key(handle.key)
+        return handle
 
+    def attach(self, handle):
+        """
+        gives a handle which was pickled, e.g. to pass it to a
+        `multiprocessing` pool, this lock's connection. returns it.
+        """
+        return self.base_lock.attach(handle)
 
     def get_lease_handle(self, args_list, expected_id):
-        key = self.settings.make_request(args_list).key
+        key = self.make_key(args_list)
         return self.base_lock.get_lease_handle(
             key=key,
             expected_id=expected_id
@@ -128,10 +203,55 @@ class BlockingRedisLock(object):
 
 
 class BlockingRedisLockFactory(object):
-    def __init__(self, prefix, ttl, arity, root_prefix=DEFAULT_ROOT_PREFIX):
-        self.settings = LockSettings(prefix=prefix, ttl=ttl, arity=arity, root_prefix=root_prefix)
+    lock_class = BlockingRedisLock
+
+    def __init__(self, prefix, ttl, arity, root_prefix=DEFAULT_ROOT_PREFIX, codec=None,
+                 local_check_margin=None, coordinate_locally=False, batch_window=None,
+                 max_batch=256, instrumentation=None, compact_keys=False):
+        """
+        `codec` names the `pylocks.core.lease_codecs` codec used to encode
+        lease values (default: `pylocks.conf.DEFAULT_LEASE_CODEC`). values
+        written by any registered codec can be read regardless.
+
+        `local_check_margin` opts handles into answering ownership checks
+        locally while their lease has more than that many seconds left.
+        it should cover the clock drift between this host and redis. leases
+        deleted by anyone else (e.g. `release_hard`) go unnoticed until then.
+
+        with `coordinate_locally`, every lock built by this factory shares
+        a `LocalLockCoordinator`, so threads of this process contending
+        for a key don't all send their own attempts to redis.
+
+        with a `batch_window` (in seconds), the single-key acquires and
+        releases of locks built by this factory are sent through one
+        `LockBatcher` per redis connection, so calls from many threads
+        within the window share a round trip.
+
+        `instrumentation` receives measurements of the locks' operations;
+        see `pylocks.instrumentation`.
+
+        with `compact_keys`, keys carry a short hash of `prefix` instead of
+        the prefix itself; see `pylocks.core.key_formatter.KeyFormatter`.
+        """
+        self.settings = LockSettings(
+            prefix=prefix, ttl=ttl, arity=arity, root_prefix=root_prefix, compact_keys=compact_keys
+        )
+        self.codec = codec
+        self.local_check_margin = local_check_margin
+        self.coordinator = LocalLockCoordinator() if coordinate_locally else None
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.instrumentation = instrumentation
+        self._batchers = {}
+        self._batchers_lock = threading.Lock()
 
     def build(self, redis_conn=None):
+        """
+        `redis_conn` may also be a list of connections to independent
+        redis servers, or a dict mapping shard names to them, to spread
+        the lock's keys over them; see `ShardedBlockingRedisLock`.
+        shards of a list are named after their servers' addresses.
+        """
         if redis_conn is None:
             try:
                 redis_conn = self.get_redis_connection()
@@ -139,7 +259,37 @@ class BlockingRedisLockFactory(object):
                 pass
         if redis_conn is None:
             raise ValueError('Need a redis connection')
-        return BlockingRedisLock(settings=self.settings, redis_conn=redis_conn)
+        if isinstance(redis_conn, (list, tuple)):
+            redis_conn = dict((shard_name(conn), conn) for conn in redis_conn)
+        if isinstance(redis_conn, dict):
+            return ShardedBlockingRedisLock(
+                settings=self.settings,
+                shard_locks=dict((name, self.build(conn)) for name, conn in redis_conn.items())
+            )
+        return self.lock_class(
+            settings=self.settings,
+            redis_conn=redis_conn,
+            codec=self.codec,
+            local_check_margin=self.local_check_margin,
+            coordinator=self.coordinator,
+            batcher=self.get_batcher(redis_conn),
+            instrumentation=self.instrumentation
+        )
+
+    def get_batcher(self, redis_conn):
+        """
+        returns the `LockBatcher` for `redis_conn`, or None
+        if this factory doesn't batch.
+        """
+        if self.batch_window is None:
+            return None
+        with self._batchers_lock:
+            # the batcher keeps the connection alive, so its id isn't reused
+            batcher = self._batchers.get(id(redis_conn))
+            if batcher is None:
+                batcher = LockBatcher(redis_conn, window=self.batch_window, max_batch=self.max_batch)
+                self._batchers[id(redis_conn)] = batcher
+            return batcher
 
     def get_redis_connection(self):
         raise NotImplementedError
@@ -0,0 +1,291 @@
+from pylocks.errors import LockAlreadyHeld, LockNotOwned
+from pylocks.instrumentation import measure
+from pylocks.util import monotonic, to_millis
+from pylocks.core import operations, scripts
+from .blocking_redis_lock import BlockingRedisLock, BlockingRedisLockFactory
+from .release_waiter import ReleaseWaiter
+from .shared_lease_handle import SharedLeaseHandle, prepare_shared_leases, release_shared_leases
+
+
+class BlockingRedisRWLock(BlockingRedisLock):
+    """
+    A lock which is held either exclusively, by one writer, or shared,
+    by any number of readers at once.
+
+    `acquire`, `macquire` and the other methods of `BlockingRedisLock`
+    deal in exclusive leases, which can only be taken while there are
+    no shared ones. `acquire_shared` and `macquire_shared` take shared
+    leases, which can be taken while there is no exclusive one. Each
+    shared lease has its own ID and TTL, and expires on its own, so a
+    reader which dies doesn't keep writers out for longer than its TTL.
+
+    A writer which waits with `priority=True` keeps new readers out
+    while it waits, so a steady stream of them can't starve it. Its
+    claim is renewed every `priority_ttl` seconds while it waits.
+
+    Exclusive leases are stored as `BlockingRedisLock` stores them;
+    shared ones as members of the key's `scripts.holder_keys`.
+    """
+    priority_ttl = 5
+
+    def __init__(self, settings, redis_conn, codec=None, local_check_margin=None,
+                 coordinator=None, batcher=None, instrumentation=None):
+        if coordinator is not None:
+            raise ValueError('read/write locks are not coordinated locally')
+        # the batcher's acquires would ignore shared leases,
+        # but its releases are still fine for exclusive ones
+        super(BlockingRedisRWLock, self).__init__(
+            settings=settings,
+            redis_conn=redis_conn,
+            codec=codec,
+            local_check_margin=local_check_margin,
+            batcher=batcher,
+            instrumentation=instrumentation
+        )
+        self._acquire_script = redis_conn.register_script(scripts.RW_ACQUIRE)
+        self._acquire_shared_script = redis_conn.register_script(scripts.RW_ACQUIRE_SHARED)
+        self._holder_count_script = redis_conn.register_script(scripts.HOLDER_COUNT)
+
+    @property
+    def codec(self):
+        return self.base_lock.codec
+
+    def is_held(self, args_list):
+        """
+        returns True if anyone holds the lock for `args_list`,
+        exclusively or shared.
+        """
+        with measure(self.instrumentation, self.prefix, 'is_held'):
+            [count] = self._holder_count_script(keys=[self.make_key(args_list)])
+            return count > 0
+
+    def mis_held(self, args_lists):
+        """
+        `is_held` for each of `args_lists`, in one round trip.
+        """
+        keys = self.settings.make_keys(args_lists)
+        if not keys:
+            return []
+        with measure(self.instrumentation, self.prefix, 'mis_held'):
+            return [count > 0 for count in self._holder_count_script(keys=keys)]
+
+    def _try_acquire(self, lock_requests, atomic=False, priority=False):
+        """
+        runs the exclusive acquire script for `lock_requests`.
+
+        returns a tuple of (a candidate handle per request, each request's
+        holder PTTL or None, as `operations.holder_ttls` reads them).
+        """
+        handles, args = self.base_lock._prepare_acquire(lock_requests)
+        priority_ms = to_millis(self.priority_ttl) if priority else 0
+        replies = self._acquire_script(
+            keys=[request.key for request in lock_requests],
+            args=['1' if atomic else '0', priority_ms] + args
+        )
+        return handles, operations.record_fences([handle.handle_data for handle in handles], replies)
+
+    def _try_acquire_shared(self, lock_requests, atomic=False):
+        handles, args = prepare_shared_leases(
+            lock_requests, self.redis_conn, self.codec,
+            local_check_margin=self.base_lock.local_check_margin,
+            instrumentation=self.instrumentation
+        )
+        results = self._acquire_shared_script(
+            keys=[request.key for request in lock_requests],
+            args=['1' if atomic else '0'] + args
+        )
+        return handles, results
+
+    @staticmethod
+    def _one(try_acquire, request, **kwargs):
+        """
+        returns `(handle or None, remaining_ttl)` for a single request.
+        """
+        [handle], [holder_ttl] = try_acquire([request], **kwargs)
+        if holder_ttl is not None:
+            handle = None
+        return handle, operations.remaining_ttl(holder_ttl)
+
+    def acquire(self, args_list, wait=None, priority=False):
+        """
+        acquires the exclusive lease for `args_list`, as
+        `BlockingRedisLock.acquire` does.
+
+        if `wait` is given and `priority` is True, keeps new shared
+        leases from being taken while waiting.
+
+        raises an `LockAlreadyHeld` exception on failure.
+        """
+        return self._acquire(self.settings.make_request(args_list), wait, priority)
+
+    def _acquire(self, request, wait, priority=False):
+        with measure(self.instrumentation, self.prefix, 'acquire') as call:
+            handle, remaining_ttl = self._one(
+                self._try_acquire, request, priority=priority and bool(wait)
+            )
+            if handle is not None:
+                return handle
+            if not wait:
+                raise LockAlreadyHeld(request.key, remaining_ttl)
+            return self._wait(
+                request, wait, call,
+                lambda: self._one(self._try_acquire, request, priority=priority),
+                poll_every=self.priority_ttl / 2.0 if priority else None
+            )
+
+    def acquire_shared(self, args_list, wait=None):
+        """
+        acquires a shared lease for `args_list`. returns a
+        `SharedLeaseHandle` with the lease's own ID.
+
+        if `wait` is given, waits up to that many seconds for the
+        exclusive holder, or a writer with priority, to be done.
+
+        raises an `LockAlreadyHeld` exception on failure.
+        """
+        request = self.settings.make_request(args_list)
+        with measure(self.instrumentation, self.prefix, 'acquire_shared') as call:
+            handle, remaining_ttl = self._one(self._try_acquire_shared, request)
+            if handle is not None:
+                return handle
+            if not wait:
+                raise LockAlreadyHeld(request.key, remaining_ttl)
+            return self._wait(
+                request, wait, call, lambda: self._one(self._try_acquire_shared, request)
+            )
+
+    def _wait(self, request, wait, call, attempt, poll_every=None):
+        """
+        retries `attempt` whenever a lease on the request's key is
+        released or expires, or at least every `poll_every` seconds.
+        """
+        deadline = monotonic() + wait
+        with ReleaseWaiter(self.redis_conn, request.key) as waiter:
+            while True:
+                call.round_trips += 1
+                handle, remaining_ttl = attempt()
+                if handle is not None:
+                    return handle
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    raise LockAlreadyHeld(request.key, remaining_ttl)
+                if remaining_ttl is not None:
+                    timeout = min(timeout, remaining_ttl)
+                if poll_every is not None:
+                    timeout = min(timeout, poll_every)
+                waiter.wait(timeout)
+
+    def _macquire(self, name, try_acquire, args_lists, atomic):
+        args_lists = list(args_lists)
+        req_to_args = {}
+        for req, one_args_list in zip(self.settings.make_requests(args_lists), args_lists):
+            req_to_args.setdefault(req, one_args_list)
+        requests = list(req_to_args)
+        if not requests:
+            return {}, []
+        with measure(self.instrumentation, self.prefix, name):
+            handles, results = try_acquire(requests, atomic=atomic)
+        locked = {}
+        missing = []
+        if atomic and not operations.took_all(results):
+            missing = [req_to_args[req] for req in operations.blocking_requests(requests, results)]
+        else:
+            for req, handle, holder_ttl in zip(requests, handles, results or [None] * len(requests)):
+                if holder_ttl is None:
+                    locked[req_to_args[req]] = handle
+                else:
+                    missing.append(req_to_args[req])
+        if missing:
+            self.instrumentation.count(self.prefix, '%s_missing' % name, len(missing))
+        return locked, missing
+
+    def macquire(self, args_lists, atomic=False):
+        """
+        acquires exclusive leases on multiple locks in one round trip,
+        as `BlockingRedisLock.macquire` does.
+        """
+        return self._macquire('macquire', self._try_acquire, args_lists, atomic)
+
+    def macquire_shared(self, args_lists, atomic=False):
+        """
+        acquires shared leases on multiple locks in one round trip.
+
+        returns a tuple of:
+            - a dict mapping args_lists to `SharedLeaseHandle`s
+            - a list containing the args_lists which could not be locked
+
+        if `atomic` is True, every lease is taken in one server-side step
+        or none are; on failure the list contains only the args_lists
+        which were held exclusively or awaited by a writer with priority.
+        """
+        return self._macquire('macquire_shared', self._try_acquire_shared, args_lists, atomic)
+
+    def mrelease_shared(self, args_lists_to_ids):
+        """
+        releases multiple shared leases in one round trip, as
+        `mrelease_expected` does for exclusive ones.
+        """
+        keys_to_ids = {}
+        key_to_args = {}
+        for arg_list, expected in args_lists_to_ids.items():
+            key = self.make_key(arg_list)
+            keys_to_ids[key] = expected
+            key_to_args[key] = arg_list
+        with measure(self.instrumentation, self.prefix, 'mrelease_shared'):
+            released, missing = release_shared_leases(self.redis_conn, keys_to_ids)
+        return (
+            [key_to_args[key] for key in released],
+            [key_to_args[key] for key in missing]
+        )
+
+    def release_shared(self, args_list, expected_id):
+        """
+        releases the shared lease `expected_id` on `args_list`'s key.
+
+        raises `LockNotOwned` if it's no longer held.
+        """
+        key = self.make_key(args_list)
+        with measure(self.instrumentation, self.prefix, 'release_shared'):
+            released, _ = release_shared_leases(self.redis_conn, {key: expected_id})
+            if not released:
+                raise LockNotOwned(key, expected_id)
+
+    def release_hard(self, args_list):
+        """
+        Releases every lease held on the key corresponding to
+        `args_list`, exclusive or shared, without checking IDs.
+        """
+        key = self.make_key(args_list)
+        with measure(self.instrumentation, self.prefix, 'release_hard'):
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.delete(key, *scripts.holder_keys(key))
+            pipe.publish(scripts.release_channel(key), '')
+            deleted, _ = pipe.execute()
+            if not deleted:
+                raise LockNotOwned(key)
+
+    def get_shared_lease_handle(self, args_list, expected_id):
+        return SharedLeaseHandle.get_existing(
+            key=self.make_key(args_list),
+            expected_id=expected_id,
+            redis_conn=self.redis_conn,
+            instrumentation=self.instrumentation
+        )
+
+    def shared_handle_from_token(self, token, secret=None):
+        """
+        rebuilds a `SharedLeaseHandle` from the `to_token` of a handle
+        `acquire_shared` returned, as `handle_from_token` does for
+        exclusive ones. a token doesn't say which kind its lease is.
+        """
+        handle = SharedLeaseHandle.from_token(
+            token, self.redis_conn, secret=secret, codec=self.codec,
+            local_check_margin=self.base_lock.local_check_margin,
+            instrumentation=self.instrumentation
+        )
+        self.settings.check_token_key(handle.key)
+        return handle
+
+
+class BlockingRedisRWLockFactory(BlockingRedisLockFactory):
+    lock_class = BlockingRedisRWLock
@@ -0,0 +1,262 @@
+from pylocks.conf import DEFAULT_ROOT_PREFIX
+from pylocks.core import lease_codecs, operations, scripts
+from pylocks.core.lock_settings import LockSettings
+from pylocks.errors import LockAlreadyHeld, LockNotOwned
+from pylocks.instrumentation import get_instrumentation, measure
+from pylocks.util import monotonic
+from .release_waiter import ReleaseWaiter
+from .shared_lease_handle import SharedLeaseHandle, prepare_shared_leases, release_shared_leases
+
+
+class BlockingRedisSemaphore(object):
+    """
+    Grants up to `limit` leases on each key at once, e.g. to cap how
+    many workers call a partner API concurrently.
+
+    Each lease has its own `SharedLeaseHandle`, which can be checked,
+    extended and released like a `BlockingRedisLeaseHandle`. leases
+    which run out are dropped by the acquire script itself, so holders
+    which die give their slot back after their TTL without anyone
+    sweeping up after them. An acquire is one round trip however full
+    the semaphore is.
+    """
+    def __init__(self, settings, redis_conn, limit, codec=None, local_check_margin=None,
+                 instrumentation=None):
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        self.settings = settings
+        self.redis_conn = redis_conn
+        self.limit = limit
+        self.codec = lease_codecs.get_codec(codec)
+        self.local_check_margin = local_check_margin
+        self.instrumentation = get_instrumentation(instrumentation)
+        self._acquire_script = redis_conn.register_script(scripts.SEMAPHORE_ACQUIRE)
+        self._holder_count_script = redis_conn.register_script(scripts.HOLDER_COUNT)
+
+    @property
+    def arity(self):
+        return self.settings.arity
+
+    @property
+    def ttl(self):
+        return self.settings.ttl
+
+    @property
+    def prefix(self):
+        return self.settings.prefix
+
+    def make_key(self, args_list):
+        return self.settings.make_key(args_list)
+
+    def count(self, args_list):
+        """
+        returns how many leases are held on `args_list`'s key.
+        """
+        with measure(self.instrumentation, self.prefix, 'count'):
+            [count] = self._holder_count_script(keys=[self.make_key(args_list)])
+            return count
+
+    def is_held(self, args_list):
+        """
+        returns True if anyone holds a lease on `args_list`'s key.
+        """
+        return self.count(args_list) > 0
+
+    def mis_held(self, args_lists):
+        """
+        `is_held` for each of `args_lists`, in one round trip.
+        """
+        keys = self.settings.make_keys(args_lists)
+        if not keys:
+            return []
+        with measure(self.instrumentation, self.prefix, 'mis_held'):
+            return [count > 0 for count in self._holder_count_script(keys=keys)]
+
+    def _try_acquire(self, lock_requests):
+        """
+        returns a list with one `(handle, remaining_ttl)` pair per request;
+        `handle` is None if the key was full, and `remaining_ttl` is then
+        the time until its first lease runs out.
+        """
+        handles, args = prepare_shared_leases(
+            lock_requests, self.redis_conn, self.codec,
+            local_check_margin=self.local_check_margin,
+            instrumentation=self.instrumentation
+        )
+        results = self._acquire_script(
+            keys=[request.key for request in lock_requests],
+            args=[self.limit] + args
+        )
+        return [
+            (handle if holder_ttl is None else None, operations.remaining_ttl(holder_ttl))
+            for handle, holder_ttl in zip(handles, results)
+        ]
+
+    def acquire(self, args_list, wait=None):
+        """
+        takes one of the leases on the key corresponding to `args_list`.
+        returns a `SharedLeaseHandle`.
+
+        if `wait` is given, waits up to that many seconds for a lease to
+        be released or to expire.
+
+        raises an `LockAlreadyHeld` exception if all `limit` are held.
+        """
+        request = self.settings.make_request(args_list)
+        with measure(self.instrumentation, self.prefix, 'acquire') as call:
+            [(handle, remaining_ttl)] = self._try_acquire([request])
+            if handle is not None:
+                return handle
+            if not wait:
+                raise LockAlreadyHeld(request.key, remaining_ttl)
+            return self._wait_and_acquire(request, wait, call)
+
+    def _wait_and_acquire(self, request, wait, call):
+        deadline = monotonic() + wait
+        with ReleaseWaiter(self.redis_conn, request.key) as waiter:
+            while True:
+                call.round_trips += 1
+                [(handle, remaining_ttl)] = self._try_acquire([request])
+                if handle is not None:
+                    return handle
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    raise LockAlreadyHeld(request.key, remaining_ttl)
+                if remaining_ttl is not None:
+                    timeout = min(timeout, remaining_ttl)
+                waiter.wait(timeout)
+
+    def macquire(self, args_lists):
+        """
+        takes one lease on each of several keys, in one round trip.
+
+        returns a tuple of:
+            - a dict mapping args_lists to `SharedLeaseHandle`s
+            - a list containing the args_lists whose keys were full
+        """
+        args_lists = list(args_lists)
+        req_to_args = {}
+        for req, one_args_list in zip(self.settings.make_requests(args_lists), args_lists):
+            req_to_args.setdefault(req, one_args_list)
+        requests = list(req_to_args)
+        if not requests:
+            return {}, []
+        with measure(self.instrumentation, self.prefix, 'macquire'):
+            outcomes = self._try_acquire(requests)
+        locked = {}
+        missing = []
+        for req, (handle, _) in zip(requests, outcomes):
+            if handle is None:
+                missing.append(req_to_args[req])
+            else:
+                locked[req_to_args[req]] = handle
+        if missing:
+            self.instrumentation.count(self.prefix, 'macquire_missing', len(missing))
+        return locked, missing
+
+    def mrelease_expected(self, args_lists_to_ids):
+        """
+        releases multiple leases in one round trip.
+
+        returns a tuple of:
+            - a list containing args_lists whose lease was released
+            - a list containing args_lists whose lease was no longer held
+        """
+        keys_to_ids = {}
+        key_to_args = {}
+        for arg_list, expected in args_lists_to_ids.items():
+            key = self.make_key(arg_list)
+            keys_to_ids[key] = expected
+            key_to_args[key] = arg_list
+        with measure(self.instrumentation, self.prefix, 'mrelease_expected'):
+            released, missing = release_shared_leases(self.redis_conn, keys_to_ids)
+        return (
+            [key_to_args[key] for key in released],
+            [key_to_args[key] for key in missing]
+        )
+
+    def release_expected(self, args_list, expected_id):
+        """
+        releases the lease `expected_id` on `args_list`'s key.
+
+        raises `LockNotOwned` if it's no longer held.
+        """
+        key = self.make_key(args_list)
+        with measure(self.instrumentation, self.prefix, 'release_expected'):
+            released, _ = release_shared_leases(self.redis_conn, {key: expected_id})
+            if not released:
+                raise LockNotOwned(key, expected_id)
+
+    def release_hard(self, args_list):
+        """
+        releases every lease on `args_list`'s key, without checking IDs.
+        """
+        key = self.make_key(args_list)
+        with measure(self.instrumentation, self.prefix, 'release_hard'):
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.delete(*scripts.holder_keys(key))
+            pipe.publish(scripts.release_channel(key), '')
+            deleted, _ = pipe.execute()
+            if not deleted:
+                raise LockNotOwned(key)
+
+    def handle_from_token(self, token, secret=None):
+        """
+        rebuilds a `SharedLeaseHandle` from its `to_token`, as
+        `BlockingRedisLock.handle_from_token` does.
+        """
+        handle = SharedLeaseHandle.from_token(
+            token, self.redis_conn, secret=secret, codec=self.codec,
+            local_check_margin=self.local_check_margin, instrumentation=self.instrumentation
+        )
+        self.settings.check_token_key(handle.key)
+        return handle
+
+    def attach(self, handle):
+        return handle.attach(self.redis_conn, instrumentation=self.instrumentation)
+
+    def get_lease_handle(self, args_list, expected_id):
+        return SharedLeaseHandle.get_existing(
+            key=self.make_key(args_list),
+            expected_id=expected_id,
+            redis_conn=self.redis_conn,
+            instrumentation=self.instrumentation
+        )
+
+
+class BlockingRedisSemaphoreFactory(object):
+    semaphore_class = BlockingRedisSemaphore
+
+    def __init__(self, prefix, ttl, arity, limit, root_prefix=DEFAULT_ROOT_PREFIX, codec=None,
+                 local_check_margin=None, instrumentation=None, compact_keys=False):
+        """
+        as `BlockingRedisLockFactory`; `limit` is how many
+        leases each key grants at once.
+        """
+        self.settings = LockSettings(
+            prefix=prefix, ttl=ttl, arity=arity, root_prefix=root_prefix, compact_keys=compact_keys
+        )
+        self.limit = limit
+        self.codec = codec
+        self.local_check_margin = local_check_margin
+        self.instrumentation = instrumentation
+
+    def build(self, redis_conn=None):
+        if redis_conn is None:
+            try:
+                redis_conn = self.get_redis_connection()
+            except NotImplementedError:
+                pass
+        if redis_conn is None:
+            raise ValueError('Need a redis connection')
+        return self.semaphore_class(
+            settings=self.settings,
+            redis_conn=redis_conn,
+            limit=self.limit,
+            codec=self.codec,
+            local_check_margin=self.local_check_margin,
+            instrumentation=self.instrumentation
+        )
+
+    def get_redis_connection(self):
+        raise NotImplementedError
@@ -0,0 +1,100 @@
+from pylocks.errors import LockAlreadyHeld
+from pylocks.instrumentation import measure
+from pylocks.util import make_id, monotonic, to_millis
+from pylocks.core import operations, scripts
+from .blocking_redis_lock import BlockingRedisLock, BlockingRedisLockFactory
+from .release_waiter import ReleaseWaiter
+
+
+class FairBlockingRedisLock(BlockingRedisLock):
+    """
+    A `BlockingRedisLock` which grants a held lock to its waiters
+    in arrival order.
+
+    Waiting callers take a ticket in a per-key queue, and a release
+    only wakes the waiter at the head of it. A new caller can't take a
+    free lock while others are queued for it.
+
+    Each waiter's place is kept for `queue_ttl` seconds at a time and
+    refreshed while it keeps waiting, so waiters which time out or die
+    drop out of the queue on their own.
+
+    Only `acquire` queues; everything else behaves as in `BlockingRedisLock`.
+    """
+    queue_ttl = 5
+
+    def __init__(self, settings, redis_conn, codec=None, local_check_margin=None,
+                 coordinator=None, batcher=None, instrumentation=None):
+        super(FairBlockingRedisLock, self).__init__(
+            settings=settings,
+            redis_conn=redis_conn,
+            codec=codec,
+            local_check_margin=local_check_margin,
+            coordinator=coordinator,
+            batcher=batcher,
+            instrumentation=instrumentation
+        )
+        self._fair_acquire_script = redis_conn.register_script(scripts.FAIR_ACQUIRE)
+
+    def acquire(self, args_list, wait=None):
+        """
+        acquires a lock with key corresponding to `args_list`, as in
+        `BlockingRedisLock.acquire`.
+
+        if `wait` is given, queues for up to that many seconds behind
+        any earlier waiters.
+
+        raises an `LockAlreadyHeld` exception on failure.
+        """
+        return super(FairBlockingRedisLock, self).acquire(args_list, wait=wait)
+
+    def _acquire(self, request, wait):
+        with measure(self.instrumentation, self.prefix, 'acquire') as call:
+            waiter_id = make_id()
+            handle, remaining_ttl, _ = self._try_acquire_queued(request, waiter_id, 0)
+            if handle is not None:
+                return handle
+            if not wait:
+                raise LockAlreadyHeld(request.key, remaining_ttl)
+            return self._wait_in_queue(request, waiter_id, wait, call)
+
+    def _try_acquire_queued(self, request, waiter_id, queue_for):
+        """
+        returns a tuple of (handle or None, remaining TTL, queue position).
+        """
+        [handle], [value, ttl_ms] = self.base_lock._prepare_acquire([request])
+        acquired, holder_ttl, position = self._fair_acquire_script(
+            keys=(request.key,) + scripts.queue_keys(request.key),
+            args=[value, ttl_ms, waiter_id, to_millis(queue_for)]
+        )
+        if acquired:
+            # the script replies with the fencing token in place of a TTL
+            handle.handle_data.fence = holder_ttl
+            return handle, None, 0
+        return None, operations.remaining_ttl(holder_ttl), position
+
+    def _wait_in_queue(self, request, waiter_id, wait, call):
+        deadline = monotonic() + wait
+        channel = scripts.waiter_channel(request.key, waiter_id)
+        remaining_ttl = None
+        with ReleaseWaiter(self.redis_conn, request.key, channels=[channel]) as waiter:
+            while True:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise LockAlreadyHeld(request.key, remaining_ttl)
+                call.round_trips += 1
+                handle, remaining_ttl, position = self._try_acquire_queued(
+                    request, waiter_id, min(remaining, self.queue_ttl)
+                )
+                if handle is not None:
+                    return handle
+                # wake up in time to refresh our place in the queue, or,
+                # at the head of it, when the holder's lease runs out.
+                timeout = min(deadline - monotonic(), self.queue_ttl / 2.0)
+                if position == 0 and remaining_ttl is not None:
+                    timeout = min(timeout, remaining_ttl)
+                waiter.wait(timeout)
+
+
+class FairBlockingRedisLockFactory(BlockingRedisLockFactory):
+    lock_class = FairBlockingRedisLock
@@ -0,0 +1,20 @@
+from concurrent.futures import TimeoutError, wait as wait_for
+
+
+def fan_out(executor, fn, items, timeout=None):
+    """
+    calls `fn(item)` for every item in parallel, and returns a list with
+    what each call returned or raised. calls which haven't finished
+    within `timeout` seconds count as having raised `TimeoutError`.
+    """
+    futures = [executor.submit(fn, item) for item in items]
+    done, _ = wait_for(futures, timeout=timeout)
+    results = []
+    for future in futures:
+        if future not in done:
+            results.append(TimeoutError())
+        elif future.exception() is not None:
+            results.append(future.exception())
+        else:
+            results.append(future.result())
+    return results
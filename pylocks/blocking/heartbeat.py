@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+from pylocks.util import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseHeartbeat(object):
+    """
+    Keeps registered lease handles alive from a single daemon thread.
+
+    On every tick, all of the leases sharing a redis connection and a
+    handle class are renewed with one scripted call, through the class's
+    `extend_many`, so exclusive and shared leases can both be registered.
+    Leases which turn out to be no longer owned are unregistered, added
+    to `failed`, and passed to `on_failure` if one was given.
+    """
+    def __init__(self, interval=None, on_failure=None):
+        """
+        `interval` is the number of seconds between ticks. by default
+        it's a third of the shortest TTL among the registered leases.
+        """
+        self.interval = interval
+        self.on_failure = on_failure
+        self.failed = set()
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def register(self, handle, ttl=None):
+        """
+        starts renewing `handle`, resetting its TTL to `ttl` seconds
+        (default: the TTL it was acquired with) on every tick.
+
+        raises `TypeError` for handles the heartbeat can't renew: those
+        without a redis connection or an `extend_many`, such as quorum
+        handles and unpickled handles which haven't been attached.
+        """
+        if getattr(handle, 'redis_conn', None) is None or not hasattr(type(handle), 'extend_many'):
+            raise TypeError('%r can\'t be renewed by a heartbeat' % (handle,))
+        if ttl is None:
+            ttl = handle.handle_data.request.initial_ttl
+        with self._lock:
+            self._leases[handle] = ttl
+            self.failed.discard(handle)
+            self._ensure_running()
+        self._wakeup.set()
+
+    def unregister(self, handle):
+        with self._lock:
+            self._leases.pop(handle, None)
+
+    def has_failed(self, handle):
+        return handle in self.failed
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+
+    def _ensure_running(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='pylocks-heartbeat')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _next_wait(self):
+        with self._lock:
+            if self.interval is not None:
+                return self.interval
+            if not self._leases:
+                return None
+            return min(self._leases.values()) / 3.0
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._next_wait())
+            self._wakeup.clear()
+            with self._lock:
+                if self._stopping:
+                    return
+            self.tick()
+
+    def tick(self):
+        """
+        renews every registered lease: one call per handle class
+        and redis connection.
+        """
+        with self._lock:
+            groups = {}
+            for handle, ttl in self._leases.items():
+                group = (type(handle), id(handle.redis_conn))
+                groups.setdefault(group, []).append((handle, ttl))
+        for leases in groups.values():
+            first = leases[0][0]
+            started_at = monotonic()
+            try:
+                results = type(first).extend_many(
+                    first.redis_conn, [(handle.key, handle.id, ttl) for handle, ttl in leases]
+                )
+            except Exception:
+                logger.exception('failed to renew %i leases', len(leases))
+                continue
+            for (handle, ttl), extended in zip(leases, results):
+                if extended:
+                    handle._ttl_was_set(started_at, ttl)
+                else:
+                    handle._was_lost()
+                    self._mark_failed(handle)
+
+    def _mark_failed(self, handle):
+        with self._lock:
+            if self._leases.pop(handle, None) is None:
+                return
+            self.failed.add(handle)
+        if self.on_failure is not None:
+            self.on_failure(handle)
+
+
+_default_heartbeat = None
+_default_heartbeat_pid = None
+_default_heartbeat_lock = threading.Lock()
+
+def get_heartbeat():
+    """
+    returns the process-wide `LeaseHeartbeat`, creating a fresh one
+    after a fork since the parent's thread doesn't survive it.
+    """
+    global _default_heartbeat, _default_heartbeat_pid
+    with _default_heartbeat_lock:
+        if _default_heartbeat is None or _default_heartbeat_pid != os.getpid():
+            _default_heartbeat = LeaseHeartbeat()
+            _default_heartbeat_pid = os.getpid()
+        return _default_heartbeat
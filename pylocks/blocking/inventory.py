@@ -0,0 +1,184 @@
+"""
+Walking the keys of a lock without blocking redis.
+
+Both functions use SCAN, so redis serves other clients between batches,
+and hold at most one batch in memory.
+"""
+import re
+import time
+from redis import WatchError
+from pylocks.core import lease_codecs, operations
+
+# the temporary keys older versions of `BaseBlockingRedisLock.acquire`
+# wrote each lease to before renaming it to the lock key:
+# '<key>-<lease id>'. they're left behind when the rename fails. a lock
+# key whose last arg ends in a UUID looks the same, so a key is only
+# taken for a temp key if it holds the lease its suffix names.
+_TEMP_KEY_SUFFIX = re.compile(r'-([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})$')
+_TEMP_KEY_GLOB = '-' + '-'.join('?' * n for n in (8, 4, 4, 4, 12))
+
+
+def glob_escape(text):
+    """
+    escapes `text` for use in a SCAN MATCH pattern.
+    """
+    return re.sub(r'([\\*?\[\]])', r'\\\1', text)
+
+
+def split_temp_key(key):
+    """
+    returns the (lock key, lease id) a key would have been made from
+    if it's a temp key, or None if it can't be one.
+    """
+    match = _TEMP_KEY_SUFFIX.search(key)
+    if match is None:
+        return None
+    return key[:match.start()], match.group(1)
+
+
+def is_temp_lease(key, lease):
+    """
+    returns True if `key`, whose value decoded to `lease`, is a temp
+    key rather than a lock key: its suffix is the lease's own ID.
+    """
+    parts = split_temp_key(key)
+    return parts is not None and lease.id == parts[1]
+
+
+def scan_keys(redis_conn, pattern, batch_size):
+    """
+    yields the keys matching `pattern`, one SCAN batch at a time.
+    """
+    cursor = 0
+    while True:
+        cursor, keys = redis_conn.scan(cursor=cursor, match=pattern, count=batch_size)
+        if keys:
+            yield [key.decode('utf-8') if isinstance(key, bytes) else key for key in keys]
+        if not int(cursor):
+            return
+
+
+def scan_leases(redis_conn, settings, batch_size=500):
+    """
+    yields a `(LockLeaseData, remaining_ttl)` pair for each lease held
+    under `settings`' prefix. `remaining_ttl` is in seconds, or None if
+    the key doesn't expire.
+
+    values and TTLs are read with one pipeline per SCAN batch. keys
+    which don't hold leases, such as waiter queues, are skipped, and
+    leases which change while being read may be missed or repeated,
+    as with any SCAN.
+    """
+    pattern = glob_escape(settings.key_head) + '*'
+    for keys in scan_keys(redis_conn, pattern, batch_size):
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+            pipe.pttl(key)
+        replies = pipe.execute(raise_on_error=False)
+        for i, key in enumerate(keys):
+            value, holder_ttl = replies[2 * i], replies[2 * i + 1]
+            if not value or isinstance(value, Exception):
+                continue
+            try:
+                lease = lease_codecs.decode_lease(value, key=key)
+            except Exception:
+                # not a lease, e.g. a fair lock's ticket counter
+                continue
+            if is_temp_lease(key, lease):
+                continue
+            yield lease, operations.remaining_ttl(holder_ttl)
+
+
+class _Pacer(object):
+    """
+    spaces out work to at most `rate` units per second.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.started_at = time.time()
+        self.done = 0
+
+    def wait(self, units):
+        self.done += units
+        if self.rate:
+            ahead = self.done / float(self.rate) - (time.time() - self.started_at)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def _holds_own_lease(settings, key, value):
+    """
+    returns True if `key` is a temp key of `settings`' lock: its value
+    is the lease its suffix names, requested for the key without the
+    suffix by a lock with `settings`' prefixes and arity.
+
+    the key itself isn't parsed, since the formatters which wrote temp
+    keys made keys of multi-arg locks that today's can't parse.
+    """
+    if not value:
+        return False
+    lock_key, lease_id = split_temp_key(key)
+    try:
+        lease = lease_codecs.decode_lease(value, key=lock_key)
+    except Exception:
+        return False
+    request = lease.request
+    return (
+        lease.id == lease_id and request.key == lock_key and
+        request.lock_arity == settings.arity and request.lock_prefix == settings.prefix and
+        request.root_prefix == settings.root_prefix
+    )
+
+
+def _reap_batch(redis_conn, settings, keys):
+    """
+    deletes the temp keys among `keys`, as one transaction which is
+    retried if any of them changes while their values are checked.
+    """
+    with redis_conn.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(*keys)
+                values = pipe.mget(keys)
+                temp_keys = [
+                    key for key, value in zip(keys, values)
+                    if _holds_own_lease(settings, key, value)
+                ]
+                if not temp_keys:
+                    return 0
+                pipe.multi()
+                pipe.delete(*temp_keys)
+                return pipe.execute()[0]
+            except WatchError:
+                continue
+            finally:
+                pipe.reset()
+
+
+def reap_temp_keys(redis_conn, settings, batch_size=100, max_per_second=1000):
+    """
+    deletes the '<key>-<lease id>' temporary keys which versions of
+    pylocks before scripted acquires left under `settings`' prefix when
+    an acquire failed. they expire with their lease's TTL anyway; this
+    is for reclaiming the memory of long ones sooner.
+
+    a key is only deleted if its value is a lease of this lock whose ID
+    is the key's suffix, requested for the rest of the key, so lock keys
+    whose last arg ends in a UUID are left alone.
+
+    examines at most `max_per_second` keys a second (None for no
+    limit), checking and deleting each batch's temp keys in one
+    transaction.
+
+    returns the number of keys deleted.
+    """
+    pattern = glob_escape(settings.key_head) + '*' + _TEMP_KEY_GLOB
+    pacer = _Pacer(max_per_second)
+    deleted = 0
+    for keys in scan_keys(redis_conn, pattern, batch_size):
+        candidates = [key for key in keys if split_temp_key(key) is not None]
+        if candidates:
+            deleted += _reap_batch(redis_conn, settings, candidates)
+        pacer.wait(len(keys))
+    return deleted
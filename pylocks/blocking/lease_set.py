@@ -0,0 +1,152 @@
+from collections.abc import Mapping
+from pylocks.instrumentation import measure
+from pylocks.util import monotonic
+
+
+class LeaseSet(Mapping):
+    """
+    The handles a `macquire` returned, as the dict mapping args lists
+    to handles it returns, with operations on all of them at once.
+
+        locked, missing = lock.macquire(args_lists)
+        with LeaseSet(locked) as leases:
+            for args_list in leases:
+                ...
+            owned, lost = leases.check_all()
+
+    each operation makes one round trip per redis connection among the
+    handles, however many there are, so the handles of a sharded lock
+    cost one per shard. leases found to be lost are dropped from the set,
+    and leaving the `with` block releases the ones that are left.
+
+    handles may be `BlockingRedisLeaseHandle`s or `SharedLeaseHandle`s,
+    from any lock on a single server each.
+    """
+    def __init__(self, handles=None):
+        self._handles = dict(handles or {})
+
+    def __getitem__(self, args_list):
+        return self._handles[args_list]
+
+    def __iter__(self):
+        return iter(self._handles)
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __repr__(self):
+        return '<LeaseSet of %i />' % len(self._handles)
+
+    def _groups(self, args_lists):
+        """
+        splits `args_lists` into lists of (args_list, handle) pairs which
+        can be sent together: same handle class, same connection.
+        """
+        groups = {}
+        for args_list in args_lists:
+            handle = self._handles[args_list]
+            group = (type(handle), id(handle.redis_conn))
+            groups.setdefault(group, []).append((args_list, handle))
+        return list(groups.values())
+
+    def _run(self, name, args_lists, call):
+        """
+        runs `call(handle class, redis_conn, pairs)` for each group of
+        `args_lists`. it returns one boolean per pair, whether that
+        handle's operation succeeded; returns a tuple of the args_lists
+        which succeeded and those which failed.
+        """
+        succeeded, failed = [], []
+        for pairs in self._groups(args_lists):
+            first = pairs[0][1]
+            with measure(first.instrumentation, first.prefix, name):
+                results = call(type(first), first.redis_conn, pairs)
+            for (args_list, handle), ok in zip(pairs, results):
+                if ok:
+                    succeeded.append(args_list)
+                else:
+                    handle._was_lost()
+                    failed.append(args_list)
+        for args_list in failed:
+            self._handles.pop(args_list, None)
+        return succeeded, failed
+
+    def check_all(self):
+        """
+        checks which leases are still owned: by their handles' local
+        checks where those can answer (see `local_check_margin`), and
+        otherwise by reading every key in one call per connection.
+
+        returns a tuple of:
+            - a list of args_lists whose lease is still owned
+            - a list of args_lists whose lease was lost
+        """
+        owned, lost, remote = [], [], []
+        for args_list, handle in self._handles.items():
+            local = handle._check_locally()
+            if local is None:
+                remote.append(args_list)
+                continue
+            handle.local_checks += 1
+            (owned if local else lost).append(args_list)
+        for args_list in lost:
+            del self._handles[args_list]
+
+        def check(handle_class, redis_conn, pairs):
+            for _, handle in pairs:
+                handle.remote_checks += 1
+            return handle_class.check_many(
+                redis_conn, [(handle.key, handle.id) for _, handle in pairs]
+            )
+        remote_owned, remote_lost = self._run('check_all', remote, check)
+        return owned + remote_owned, lost + remote_lost
+
+    def extend_all(self, ttl=None):
+        """
+        resets the TTL of every lease to `ttl` seconds (default: the
+        TTL each was acquired with), if it's still owned.
+
+        returns a tuple of:
+            - a list of args_lists whose lease was extended
+            - a list of args_lists whose lease was lost
+        """
+        started_at = monotonic()
+        ttls = {}
+
+        def extend(handle_class, redis_conn, pairs):
+            leases = []
+            for _, handle in pairs:
+                ttls[handle] = ttl if ttl is not None else handle.handle_data.request.initial_ttl
+                leases.append((handle.key, handle.id, ttls[handle]))
+            return handle_class.extend_many(redis_conn, leases)
+        extended, lost = self._run('extend_all', list(self._handles), extend)
+        for args_list in extended:
+            handle = self._handles[args_list]
+            handle._ttl_was_set(started_at, ttls[handle])
+        return extended, lost
+
+    def release_all(self):
+        """
+        releases every lease which is still owned, and empties the set.
+
+        returns a tuple of:
+            - a list of args_lists whose lease was released
+            - a list of args_lists whose lease was already lost
+        """
+        def release(handle_class, redis_conn, pairs):
+            return handle_class.release_many(
+                redis_conn, [(handle.key, handle.id) for _, handle in pairs]
+            )
+        released, lost = self._run('release_all', list(self._handles), release)
+        for args_list in released:
+            handle = self._handles.pop(args_list)
+            handle._report_release()
+            handle._was_lost()
+        return released, lost
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release_all()
+        return False
@@ -0,0 +1,216 @@
+import collections
+import threading
+from pylocks.errors import LockAlreadyHeld
+from pylocks.util import monotonic
+from .blocking_redis_lease_handle import BlockingRedisLeaseHandle
+
+
+class CoordinatedLeaseHandle(BlockingRedisLeaseHandle):
+    """
+    A lease handle whose `release` first offers the lease to other
+    threads of this process waiting on the same key.
+    """
+    def __init__(self, handle, coordinator):
+        super(CoordinatedLeaseHandle, self).__init__(
+            handle_data=handle.handle_data,
+            redis_conn=handle.redis_conn,
+            codec=handle.codec,
+            local_check_margin=handle.local_check_margin,
+            batcher=handle.batcher,
+            instrumentation=handle.instrumentation
+        )
+        self._valid_until = handle._valid_until
+        self._coordinator = coordinator
+        self._handed_over = False
+
+    def do_i_still_have_lock(self):
+        """
+        as in `BlockingRedisLeaseHandle`, except that a handle whose lease
+        was handed over to another thread doesn't own it anymore, though
+        the lease ID in redis is unchanged.
+        """
+        if self._handed_over:
+            return False
+        return super(CoordinatedLeaseHandle, self).do_i_still_have_lock()
+
+    def release(self, ignore_failure=False):
+        """
+        Hands the lease over to a waiting thread of this process if
+        there is one, keeping the lease (and its remaining TTL) in redis.
+        Otherwise releases it as `BlockingRedisLeaseHandle.release` does.
+
+        once the lease has been handed over, this handle no longer owns
+        it, and releasing it again fails without touching redis.
+        """
+        if (not self._handed_over and self._coordinator is not None and
+                self._coordinator._hand_over(self)):
+            self._handed_over = True
+            self._was_lost()
+            return True
+        return super(CoordinatedLeaseHandle, self).release(ignore_failure=ignore_failure)
+
+    def __getstate__(self):
+        # the coordinator belongs to this process, whose threads are the
+        # only ones it hands over to; an unpickled handle releases in redis.
+        state = super(CoordinatedLeaseHandle, self).__getstate__()
+        state['_coordinator'] = None
+        return state
+
+    # the lease ID stays the same across a handover, so once this handle
+    # has handed its lease over, redis can't tell it from the new holder.
+
+    def _release_remotely(self):
+        if self._handed_over:
+            return False
+        return super(CoordinatedLeaseHandle, self)._release_remotely()
+
+    def _extend_remotely(self, ttl):
+        if self._handed_over:
+            return False
+        return super(CoordinatedLeaseHandle, self)._extend_remotely(ttl)
+
+
+class _Waiter(object):
+    def __init__(self):
+        self.handle = None
+
+
+class _KeyState(object):
+    def __init__(self):
+        # handle held by a thread of this process
+        self.holder = None
+        # True while one thread is trying to acquire the key in redis
+        self.attempting = False
+        # bumped when an attempt ends, along with its outcome
+        self.generation = 0
+        self.last_error = None
+        # threads with a `wait` queued for a handover, in arrival order
+        self.waiters = collections.deque()
+
+    def holder_remaining(self):
+        if self.holder is None or self.holder._valid_until is None:
+            return None
+        return max(self.holder._valid_until - monotonic(), 0)
+
+    def drop_stale_holder(self):
+        """
+        forgets a holder whose lease has surely expired, or which
+        found out that it was lost, without being released.
+        """
+        if self.holder is None:
+            return
+        if self.holder._known_lost or self.holder_remaining() == 0:
+            self.holder = None
+
+    @property
+    def idle(self):
+        return self.holder is None and not self.attempting and not self.waiters
+
+
+class LocalLockCoordinator(object):
+    """
+    Coordinates the threads of one process acquiring the same keys.
+
+    Only one thread at a time tries a key in redis. Threads calling
+    without a `wait` while that attempt is in flight get its outcome
+    instead of sending their own, and are refused without a round trip
+    while another thread of the process holds the key. Threads calling
+    with a `wait` queue up, and are handed the lease directly when the
+    local holder releases it.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._states = {}
+
+    def acquire(self, key, attempt, wait=None):
+        """
+        `attempt(wait)` should try to acquire `key` in redis, returning
+        a handle or raising `LockAlreadyHeld`.
+
+        returns a `CoordinatedLeaseHandle`.
+        """
+        deadline = monotonic() + wait if wait else None
+        waiter = None
+        with self._cond:
+            state = self._states.setdefault(key, _KeyState())
+            while True:
+                state.drop_stale_holder()
+                if waiter is not None and waiter.handle is not None:
+                    return waiter.handle
+                if state.holder is None and not state.attempting:
+                    state.attempting = True
+                    break
+                if deadline is None:
+                    self._share_outcome(key, state)
+                    continue
+                if waiter is None:
+                    waiter = _Waiter()
+                    state.waiters.append(waiter)
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    self._leave(key, state, waiter)
+                    raise LockAlreadyHeld(key, state.holder_remaining())
+                holder_remaining = state.holder_remaining()
+                if holder_remaining is not None:
+                    timeout = min(timeout, holder_remaining)
+                self._cond.wait(timeout)
+
+        try:
+            handle = attempt(None if deadline is None else max(deadline - monotonic(), 0))
+        except BaseException as err:
+            with self._cond:
+                state.attempting = False
+                state.generation += 1
+                state.last_error = err
+                self._leave(key, state, waiter)
+            raise
+        with self._cond:
+            state.attempting = False
+            state.generation += 1
+            state.last_error = None
+            state.holder = CoordinatedLeaseHandle(handle, self)
+            self._leave(key, state, waiter)
+            return state.holder
+
+    def _share_outcome(self, key, state):
+        """
+        called without a `wait` while the key is held or being tried:
+        refuses the caller as the holder or the attempt in flight dictates.
+
+        returns only if the attempt failed for some other reason,
+        in which case the caller should try for itself.
+        """
+        if state.holder is None:
+            generation = state.generation
+            while state.attempting and state.generation == generation:
+                self._cond.wait()
+            state.drop_stale_holder()
+        if state.holder is not None:
+            raise LockAlreadyHeld(key, state.holder_remaining())
+        if isinstance(state.last_error, LockAlreadyHeld):
+            raise LockAlreadyHeld(key, state.last_error.remaining_ttl)
+
+    def _leave(self, key, state, waiter):
+        if waiter is not None and waiter in state.waiters:
+            state.waiters.remove(waiter)
+        if state.idle and self._states.get(key) is state:
+            del self._states[key]
+        self._cond.notify_all()
+
+    def _hand_over(self, handle):
+        """
+        passes `handle`'s lease to the first queued waiter, if any.
+        returns False if the lease should be released in redis instead.
+        """
+        with self._cond:
+            state = self._states.get(handle.key)
+            if state is None or state.holder is not handle:
+                return False
+            if not state.waiters or handle._known_lost:
+                state.holder = None
+                self._leave(handle.key, state, None)
+                return False
+            waiter = state.waiters.popleft()
+            waiter.handle = state.holder = CoordinatedLeaseHandle(handle, self)
+            self._cond.notify_all()
+            return True
@@ -0,0 +1,422 @@
+import contextlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pylocks.conf import DEFAULT_ROOT_PREFIX
+from pylocks.core import lease_codecs, operations, scripts
+from pylocks.core.lock_settings import LockSettings
+from pylocks.errors import LockExpired, LockNotOwned, QuorumNotReached
+from pylocks.util import monotonic
+from .blocking_redis_lease_handle import BlockingRedisLeaseHandle, release_leases
+from .fan_out import fan_out
+
+# leeway for the clock drift between this host and the nodes,
+# as a fraction of the TTL plus a constant, in seconds
+DEFAULT_DRIFT_FACTOR = 0.01
+_DRIFT_CONSTANT = 0.002
+
+
+def _succeeded(result):
+    return not isinstance(result, Exception)
+
+
+class QuorumLeaseHandle(object):
+    """
+    A lease held on a majority of the nodes of a `QuorumRedisLock`.
+
+    It has the same methods as `BlockingRedisLeaseHandle`. Each one runs on
+    every node in parallel, and succeeds if it succeeds on a majority.
+    """
+    def __init__(self, handle_data, node_handles, quorum, executor, node_timeout=None,
+                 drift_factor=DEFAULT_DRIFT_FACTOR):
+        self.handle_data = handle_data
+        self.node_handles = node_handles
+        self.quorum = quorum
+        self.executor = executor
+        self.node_timeout = node_timeout
+        self.drift_factor = drift_factor
+        # monotonic time by which the lease may have expired on a majority
+        self.valid_until = None
+
+    @property
+    def key(self):
+        return self.handle_data.key
+
+    @property
+    def id(self):
+        return self.handle_data.id
+
+    @property
+    def fence(self):
+        # see `QuorumRedisLock`
+        return None
+
+    @property
+    def validity(self):
+        """
+        seconds for which the lease is sure to be held, or
+        None if that isn't known.
+        """
+        if self.valid_until is None:
+            return None
+        return max(self.valid_until - monotonic(), 0)
+
+    def _fan_out(self, fn):
+        return fan_out(self.executor, fn, self.node_handles, timeout=self.node_timeout)
+
+    def do_i_still_have_lock(self):
+        """
+        returns True if a majority of the nodes still hold this lease.
+        """
+        results = self._fan_out(lambda handle: handle.do_i_still_have_lock())
+        return len([result for result in results if result is True]) >= self.quorum
+
+    def check_if_owned(self):
+        if not self.do_i_still_have_lock():
+            raise LockExpired(self.key, self.id)
+
+    def release(self, ignore_failure=False):
+        """
+        releases the lease on every node it's still held on.
+
+        raises `LockNotOwned` unless it was held on a majority of them,
+        or returns False if `ignore_failure` is True.
+        """
+        results = self._fan_out(lambda handle: handle.release(ignore_failure=True))
+        self.valid_until = None
+        if len([result for result in results if result is True]) < self.quorum:
+            if ignore_failure:
+                return False
+            raise LockNotOwned(self.key, self.id)
+        return True
+
+    def extend(self, ttl=None):
+        """
+        resets the lease's TTL on every node still holding it.
+
+        raises `LockExpired` unless a majority of them were extended
+        before the new TTL (less the allowed clock drift) ran out.
+        """
+        if ttl is None:
+            ttl = self.handle_data.request.initial_ttl
+        started_at = monotonic()
+        results = self._fan_out(lambda handle: handle.extend(ttl))
+        extended = len([result for result in results if _succeeded(result)])
+        valid_until = started_at + ttl - (ttl * self.drift_factor + _DRIFT_CONSTANT)
+        if extended < self.quorum or monotonic() >= valid_until:
+            self.valid_until = None
+            raise LockExpired(self.key, self.id)
+        self.valid_until = valid_until
+
+    @contextlib.contextmanager
+    def releasing(self, ignore_failure=False):
+        """
+        Convenience context manager: makes sure lock is released at end of scope.
+        """
+        try:
+            yield
+        finally:
+            self.release(ignore_failure=ignore_failure)
+
+
+class QuorumRedisLock(object):
+    """
+    A lock held on a majority of several independent redis nodes, so that
+    it survives the loss of any minority of them.
+
+    Every operation runs on all of the nodes in parallel. An acquire
+    succeeds only if a majority of the nodes took the lease before its TTL,
+    less `drift_factor` of it for clock drift, ran out; otherwise it's
+    rolled back on every node. `node_timeout` bounds how long to wait
+    for any one node. the connections' own socket timeouts should be
+    set to about as much.
+
+    Its leases have no fencing token: each node counts its own, and
+    no count is shared by a majority that could order every lease.
+    """
+    def __init__(self, settings, redis_conns, codec=None, drift_factor=DEFAULT_DRIFT_FACTOR,
+                 node_timeout=None, executor=None):
+        if not redis_conns:
+            raise ValueError('Need at least one redis connection')
+        self.settings = settings
+        self.redis_conns = list(redis_conns)
+        self.codec = lease_codecs.get_codec(codec)
+        self.drift_factor = drift_factor
+        self.node_timeout = node_timeout
+        # calls to an unresponsive node keep their threads busy after
+        # `node_timeout`, so leave room for the other nodes' calls
+        self.executor = executor or ThreadPoolExecutor(max_workers=4 * len(self.redis_conns))
+        self.quorum = len(self.redis_conns) // 2 + 1
+        self._acquire_scripts = dict(
+            (id(conn), conn.register_script(scripts.UNFENCED_ACQUIRE)) for conn in self.redis_conns
+        )
+        self._acquire_all_scripts = dict(
+            (id(conn), conn.register_script(scripts.UNFENCED_ACQUIRE_ALL)) for conn in self.redis_conns
+        )
+
+    @property
+    def prefix(self):
+        return self.settings.prefix
+
+    def make_key(self, args_list):
+        return self.settings.make_key(args_list)
+
+    def _fan_out(self, fn):
+        return fan_out(self.executor, fn, self.redis_conns, timeout=self.node_timeout)
+
+    def _drift(self, ttl):
+        return ttl * self.drift_factor + _DRIFT_CONSTANT
+
+    def _make_handle(self, lease, valid_until):
+        handle = QuorumLeaseHandle(
+            handle_data=lease,
+            node_handles=[
+                BlockingRedisLeaseHandle(handle_data=lease, redis_conn=conn, codec=self.codec)
+                for conn in self.redis_conns
+            ],
+            quorum=self.quorum,
+            executor=self.executor,
+            node_timeout=self.node_timeout,
+            drift_factor=self.drift_factor
+        )
+        handle.valid_until = valid_until
+        return handle
+
+    def _roll_back(self, leases):
+        keys_to_ids = dict((lease.key, lease.id) for lease in leases)
+        if keys_to_ids:
+            self._fan_out(lambda conn: release_leases(conn, keys_to_ids))
+
+    def _try_acquire(self, lock_requests):
+        """
+        runs the acquire script for `lock_requests` on every node.
+
+        returns a tuple of:
+            - a list with a handle (or None) per request
+            - a list with each request's shortest remaining holder TTL
+              reported by a node, in seconds, or None
+        """
+        leases = operations.new_leases(lock_requests)
+        args = operations.acquire_args(leases, self.codec)
+        keys = [request.key for request in lock_requests]
+        started_at = monotonic()
+        results = self._fan_out(
+            lambda conn: self._acquire_scripts[id(conn)](keys=keys, args=args)
+        )
+        handles = []
+        holder_ttls = []
+        failed = []
+        for index, lease in enumerate(leases):
+            replies = operations.holder_ttls(
+                [result[index] for result in results if _succeeded(result)]
+            )
+            acquired = len([reply for reply in replies if reply is None])
+            ttl = lease.request.initial_ttl
+            valid_until = started_at + ttl - self._drift(ttl)
+            if acquired >= self.quorum and monotonic() < valid_until:
+                handles.append(self._make_handle(lease, valid_until))
+                holder_ttls.append(None)
+                continue
+            # nodes which failed or timed out may have taken it anyway
+            if acquired or len(replies) < len(results):
+                failed.append(lease)
+            handles.append(None)
+            ttls = [
+                operations.remaining_ttl(reply) for reply in replies if reply is not None
+            ]
+            ttls = [ttl for ttl in ttls if ttl is not None]
+            holder_ttls.append(min(ttls) if ttls else None)
+        self._roll_back(failed)
+        return handles, holder_ttls
+
+    def acquire(self, args_list, wait=None):
+        """
+        acquires a lock with key corresponding to `args_list` on a
+        majority of the nodes, returning a `QuorumLeaseHandle`.
+
+        if `wait` is given, retries for up to that many seconds, after
+        short random pauses.
+
+        raises `QuorumNotReached` (a `LockAlreadyHeld`) on failure.
+        """
+        request = self.settings.make_request(args_list)
+        deadline = monotonic() + (wait or 0)
+        while True:
+            [handle], [remaining_ttl] = self._try_acquire([request])
+            if handle is not None:
+                return handle
+            pause = deadline - monotonic()
+            if pause <= 0:
+                raise QuorumNotReached(request.key, remaining_ttl)
+            # random pauses keep competing clients from splitting the
+            # nodes between them on every retry
+            pause = min(pause, random.uniform(0.005, 0.05))
+            if remaining_ttl is not None:
+                pause = min(pause, remaining_ttl)
+            time.sleep(pause)
+
+    def macquire(self, args_lists, atomic=False):
+        """
+        Attempt to acquire multiple locks simultaneously, as in
+        `BlockingRedisLock.macquire`. Every node is sent one call.
+
+        returns a tuple of:
+            - a dict mapping arg_lists to successful handles
+            - a list containing the args_list members which could not be locked
+        """
+        args_lists = list(args_lists)
+        requests = self.settings.make_requests(args_lists)
+        req_to_args = dict(zip(requests, args_lists))
+        if not requests:
+            return {}, []
+        if atomic:
+            return self._macquire_all(requests, req_to_args)
+        handles, _ = self._try_acquire(requests)
+        locked = {}
+        missing = []
+        for request, handle in zip(requests, handles):
+            if handle is None:
+                missing.append(req_to_args[request])
+            else:
+                locked[req_to_args[request]] = handle
+        return locked, missing
+
+    def _macquire_all(self, requests, req_to_args):
+        leases = operations.new_leases(requests)
+        args = operations.acquire_args(leases, self.codec)
+        keys = [request.key for request in requests]
+        started_at = monotonic()
+        results = self._fan_out(
+            lambda conn: self._acquire_all_scripts[id(conn)](keys=keys, args=args)
+        )
+        results = [
+            operations.holder_ttls(result) if _succeeded(result) else result for result in results
+        ]
+        acquired = len([
+            result for result in results if _succeeded(result) and operations.took_all(result)
+        ])
+        ttl = min(request.initial_ttl for request in requests)
+        valid_until = started_at + ttl - self._drift(ttl)
+        if acquired >= self.quorum and monotonic() < valid_until:
+            return dict(
+                (req_to_args[lease.request], self._make_handle(lease, valid_until))
+                for lease in leases
+            ), []
+        if acquired or len(list(filter(_succeeded, results))) < len(results):
+            self._roll_back(leases)
+        blocking = set()
+        for result in results:
+            if _succeeded(result) and not operations.took_all(result):
+                blocking.update(operations.blocking_requests(requests, result))
+        return {}, [req_to_args[request] for request in requests if request in blocking]
+
+    def mrelease_expected(self, args_lists_to_ids):
+        """
+        Release multiple locks, each conditional on its expected lease ID,
+        on every node.
+
+        returns a tuple of:
+            - a list containing args_lists which were released on a majority
+            - a list containing args_lists which were not
+        """
+        keys_to_ids = {}
+        key_to_args = {}
+        for args_list, expected_id in args_lists_to_ids.items():
+            key = self.make_key(args_list)
+            keys_to_ids[key] = expected_id
+            key_to_args[key] = args_list
+        if not keys_to_ids:
+            return [], []
+        results = self._fan_out(lambda conn: release_leases(conn, keys_to_ids))
+        counts = dict((key, 0) for key in keys_to_ids)
+        for result in results:
+            if _succeeded(result):
+                for key in result[0]:
+                    counts[key] += 1
+        released = [key_to_args[key] for key, count in counts.items() if count >= self.quorum]
+        missing = [key_to_args[key] for key, count in counts.items() if count < self.quorum]
+        return released, missing
+
+    def release_expected(self, args_list, expected_id):
+        """
+        Release the key corresponding to `args_list` on every node,
+        *if* its current ID matches `expected_id`.
+
+        raises `LockNotOwned` unless it did on a majority of them.
+        """
+        released, _ = self.mrelease_expected({args_list: expected_id})
+        if not released:
+            raise LockNotOwned(self.make_key(args_list), expected_id)
+
+    def release_hard(self, args_list):
+        """
+        Deletes the key corresponding to `args_list` on every node,
+        without checking lease IDs.
+        """
+        key = self.make_key(args_list)
+        self._fan_out(lambda conn: conn.delete(key))
+
+    def is_held(self, args_list):
+        """
+        returns True if a majority of the nodes hold the lock for
+        the given args list.
+        """
+        key = self.make_key(args_list)
+        results = self._fan_out(lambda conn: conn.get(key))
+        return len([
+            result for result in results if _succeeded(result) and result is not None
+        ]) >= self.quorum
+
+    def get_lease_handle(self, args_list, expected_id):
+        """
+        returns a handle for a lease held on a majority of the nodes.
+        raises `LockExpired` if there's no such lease.
+        """
+        key = self.make_key(args_list)
+        results = self._fan_out(lambda conn: BlockingRedisLeaseHandle.get_existing(
+            key=key, expected_id=expected_id, redis_conn=conn
+        ))
+        handles = [result for result in results if _succeeded(result)]
+        if len(handles) < self.quorum:
+            raise LockExpired(key, expected_id)
+        return self._make_handle(handles[0].handle_data, valid_until=None)
+
+
+class QuorumRedisLockFactory(object):
+    lock_class = QuorumRedisLock
+
+    def __init__(self, prefix, ttl, arity, root_prefix=DEFAULT_ROOT_PREFIX, codec=None,
+                 drift_factor=DEFAULT_DRIFT_FACTOR, node_timeout=None, compact_keys=False):
+        """
+        as `BlockingRedisLockFactory`; see `QuorumRedisLock` for
+        `drift_factor` and `node_timeout`.
+        """
+        self.settings = LockSettings(
+            prefix=prefix, ttl=ttl, arity=arity, root_prefix=root_prefix, compact_keys=compact_keys
+        )
+        self.codec = codec
+        self.drift_factor = drift_factor
+        self.node_timeout = node_timeout
+
+    def build(self, redis_conns=None):
+        """
+        `redis_conns` is a list of connections to independent redis
+        servers; use an odd number of them.
+        """
+        if redis_conns is None:
+            try:
+                redis_conns = self.get_redis_connections()
+            except NotImplementedError:
+                pass
+        if not redis_conns:
+            raise ValueError('Need redis connections')
+        return self.lock_class(
+            settings=self.settings,
+            redis_conns=redis_conns,
+            codec=self.codec,
+            drift_factor=self.drift_factor,
+            node_timeout=self.node_timeout
+        )
+
+    def get_redis_connections(self):
+        raise NotImplementedError
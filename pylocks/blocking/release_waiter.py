@@ -0,0 +1,53 @@
+from pylocks.core.scripts import release_channel
+
+
+def keyspace_channel(redis_conn, key):
+    """
+    the keyspace notification channel for `key`. redis only publishes
+    to it if `notify-keyspace-events` is enabled on the server.
+    """
+    db = redis_conn.connection_pool.connection_kwargs.get('db', 0)
+    return '__keyspace@%i__:%s' % (db, key)
+
+
+class ReleaseWaiter(object):
+    """
+    Context manager which subscribes to release notifications for a lock key.
+
+    Wakes on the release script's notification and, when the server has
+    keyspace notifications enabled, on the key being deleted or expiring.
+    Without those, callers should bound each `wait` by the holder's
+    remaining TTL so that expiry is noticed anyway.
+    """
+    def __init__(self, redis_conn, key, channels=None):
+        self.redis_conn = redis_conn
+        self.key = key
+        if channels is None:
+            channels = [release_channel(key), keyspace_channel(redis_conn, key)]
+        self.channels = channels
+        self._pubsub = None
+
+    def __enter__(self):
+        self._pubsub = self.redis_conn.pubsub()
+        self._pubsub.subscribe(*self.channels)
+        # wait for the confirmations, so that any release after this
+        # point is guaranteed to be delivered to us.
+        pending = len(self.channels)
+        while pending:
+            message = self._pubsub.get_message(timeout=None)
+            if message is not None and message['type'] == 'subscribe':
+                pending -= 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._pubsub.close()
+        self._pubsub = None
+
+    def wait(self, timeout):
+        """
+        blocks for up to `timeout` seconds. returns True if a
+        notification arrived, False on timeout.
+        """
+        if timeout <= 0:
+            return False
+        return self._pubsub.get_message(timeout=timeout) is not None
@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+from pylocks.core import lease_tokens
+from pylocks.core.hash_ring import HashRing
+from .fan_out import fan_out
+
+
+def shard_name(redis_conn):
+    """
+    names a connection's server by its address, so every process
+    sharding over the same servers puts them at the same ring points.
+    """
+    kwargs = redis_conn.connection_pool.connection_kwargs
+    if kwargs.get('path'):
+        return 'unix://%s/%s' % (kwargs['path'], kwargs.get('db', 0))
+    return '%s:%s/%s' % (kwargs.get('host', 'localhost'), kwargs.get('port', 6379), kwargs.get('db', 0))
+
+
+class ShardedBlockingRedisLock(object):
+    """
+    Spreads the keys of one lock over independent redis servers.
+
+    `shard_locks` maps shard names to locks built for each server, and
+    each key is routed to one of them by consistent hashing of its name;
+    see `pylocks.core.hash_ring`. single-key calls go to the key's shard.
+    multi-key calls are split by shard, and the shards' parts are sent
+    in parallel, each in one round trip as usual.
+
+    with `atomic=True`, `macquire` takes each shard's part in one step,
+    and releases the parts it took if any other shard's part failed.
+    that's still all-or-nothing, but not a single step: another caller
+    can see some of the locks held for a moment. keys with the same
+    `{hash tag}` always share a shard, if that matters.
+    """
+    def __init__(self, settings, shard_locks, ring=None, executor=None):
+        if not shard_locks:
+            raise ValueError('Need at least one shard')
+        self.settings = settings
+        self.shard_locks = dict(shard_locks)
+        self.ring = ring or HashRing(sorted(self.shard_locks))
+        self.executor = executor or ThreadPoolExecutor(max_workers=len(self.shard_locks))
+
+    @property
+    def instrumentation(self):
+        return next(iter(self.shard_locks.values())).instrumentation
+
+    @property
+    def arity(self):
+        return self.settings.arity
+
+    @property
+    def ttl(self):
+        return self.settings.ttl
+
+    @property
+    def prefix(self):
+        return self.settings.prefix
+
+    def make_key(self, args_list):
+        return self.settings.make_key(args_list)
+
+    def shard_for(self, args_list):
+        """
+        returns the lock for the shard holding `args_list`'s key.
+        """
+        return self.shard_locks[self.ring.shard_for(self.make_key(args_list))]
+
+    def _split(self, args_lists, key=None):
+        """
+        groups `args_lists` by shard; with `key`, groups items from
+        which `key(item)` gets the args list.
+        """
+        by_shard = {}
+        for item in args_lists:
+            args_list = key(item) if key is not None else item
+            shard = self.ring.shard_for(self.make_key(args_list))
+            by_shard.setdefault(shard, []).append(item)
+        return by_shard
+
+    def _per_shard(self, fn, by_shard):
+        """
+        calls `fn(shard_lock, part)` for each shard's part of a multi-key
+        call, in parallel if there's more than one, and returns what each
+        call returned or raised.
+        """
+        parts = [(self.shard_locks[shard], part) for shard, part in by_shard.items()]
+        if len(parts) == 1:
+            try:
+                return [fn(*parts[0])]
+            except Exception as e:
+                return [e]
+        return fan_out(self.executor, lambda shard_part: fn(*shard_part), parts)
+
+    def is_held(self, args_list):
+        return self.shard_for(args_list).is_held(args_list)
+
+    def mis_held(self, args_lists):
+        """
+        as `BlockingRedisLock.mis_held`, with one round trip per shard.
+        """
+        args_lists = list(args_lists)
+        by_shard = self._split(range(len(args_lists)), key=lambda i: args_lists[i])
+        results = self._per_shard(
+            lambda lock, part: lock.mis_held([args_lists[i] for i in part]), by_shard
+        )
+        held = [None] * len(args_lists)
+        for part, result in zip(by_shard.values(), results):
+            if isinstance(result, Exception):
+                raise result
+            for i, one_held in zip(part, result):
+                held[i] = one_held
+        return held
+
+    def acquire(self, args_list, wait=None):
+        return self.shard_for(args_list).acquire(args_list, wait=wait)
+
+    def macquire(self, args_lists, atomic=False):
+        """
+        as `BlockingRedisLock.macquire`, with the caveat about `atomic`
+        described above.
+        """
+        by_shard = self._split(args_lists)
+        if not by_shard:
+            return {}, []
+        results = self._per_shard(
+            lambda lock, part: lock.macquire(part, atomic=atomic), by_shard
+        )
+        locked = {}
+        missing = []
+        errors = []
+        for result in results:
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            part_locked, part_missing = result
+            locked.update(part_locked)
+            missing.extend(part_missing)
+        if locked and (errors or (atomic and missing)):
+            # don't leave the other shards' parts held until they expire
+            self.mrelease_expected(
+                dict((args_list, handle.id) for args_list, handle in locked.items())
+            )
+            locked = {}
+        if errors:
+            raise errors[0]
+        return locked, missing
+
+    def mrelease_expected(self, args_lists_to_ids):
+        by_shard = self._split(args_lists_to_ids)
+        if not by_shard:
+            return [], []
+        results = self._per_shard(
+            lambda lock, part: lock.mrelease_expected(
+                dict((args_list, args_lists_to_ids[args_list]) for args_list in part)
+            ),
+            by_shard
+        )
+        released = []
+        missing = []
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+            part_released, part_missing = result
+            released.extend(part_released)
+            missing.extend(part_missing)
+        return released, missing
+
+    def release_expected(self, args_list, expected_id):
+        return self.shard_for(args_list).release_expected(args_list, expected_id)
+
+    def release_hard(self, args_list):
+        self.shard_for(args_list).release_hard(args_list)
+
+    def handle_from_token(self, token, secret=None):
+        key = lease_tokens.decode_token(token, secret=secret).key
+        return self.shard_locks[self.ring.shard_for(key)].handle_from_token(token, secret=secret)
+
+    def attach(self, handle):
+        return self.shard_locks[self.ring.shard_for(handle.key)].attach(handle)
+
+    def get_lease_handle(self, args_list, expected_id):
+        return self.shard_for(args_list).get_lease_handle(args_list, expected_id)
+
+    def scan_leases(self, batch_size=500):
+        """
+        scans each shard in turn.
+        """
+        for name in sorted(self.shard_locks):
+            for pair in self.shard_locks[name].scan_leases(batch_size=batch_size):
+                yield pair
+
+    def reap_temp_keys(self, batch_size=100, max_per_second=1000):
+        """
+        reaps each shard in turn; `max_per_second` applies per shard.
+        """
+        return sum(
+            self.shard_locks[name].reap_temp_keys(batch_size=batch_size, max_per_second=max_per_second)
+            for name in sorted(self.shard_locks)
+        )
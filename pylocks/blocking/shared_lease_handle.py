@@ -0,0 +1,146 @@
+from pylocks.core import lease_codecs, operations, scripts
+from pylocks.errors import LockExpired
+from pylocks.instrumentation import get_instrumentation, measure
+from pylocks.util import monotonic
+from .blocking_redis_lease_handle import BlockingRedisLeaseHandle, get_script
+
+
+def prepare_shared_leases(lock_requests, redis_conn, codec, local_check_margin=None,
+                          instrumentation=None):
+    """
+    returns a tuple of:
+        - a list of candidate `SharedLeaseHandle`s, one per request
+        - the script arguments (id, value, ttl in ms) for those handles
+    """
+    codec = lease_codecs.get_codec(codec)
+    leases = operations.new_leases(lock_requests)
+    started_at = monotonic()
+    handles = []
+    for lease in leases:
+        handle = SharedLeaseHandle(
+            handle_data=lease,
+            redis_conn=redis_conn,
+            codec=codec,
+            local_check_margin=local_check_margin,
+            instrumentation=instrumentation
+        )
+        handle._ttl_was_set(started_at, lease.request.initial_ttl)
+        handles.append(handle)
+    return handles, operations.shared_acquire_args(leases, codec)
+
+
+def release_shared_each(redis_conn, leases):
+    """
+    as `release_each`, for shared leases.
+    """
+    if not leases:
+        return []
+    release_script = get_script(redis_conn, scripts.MEMBER_RELEASE)
+    results = release_script(
+        keys=[key for key, _ in leases], args=[expected_id for _, expected_id in leases]
+    )
+    return [result == scripts.RELEASED for result in results]
+
+
+def release_shared_leases(redis_conn, keys_to_ids):
+    """
+    Releases every shared lease in `keys_to_ids` which is still
+    held, checking all of them in one round trip.
+
+    returns a tuple of:
+        - a list of keys whose lease was released
+        - a list of keys whose lease was no longer held
+    """
+    keys = list(keys_to_ids.keys())
+    return operations.split_results(
+        keys, release_shared_each(redis_conn, [(key, keys_to_ids[key]) for key in keys]), True
+    )
+
+
+def extend_shared_each(redis_conn, leases):
+    """
+    as `extend_each`, for shared leases.
+    """
+    if not leases:
+        return []
+    keys, args = operations.extend_args(leases)
+    extend_script = get_script(redis_conn, scripts.MEMBER_EXTEND)
+    return [result == scripts.EXTENDED for result in extend_script(keys=keys, args=args)]
+
+
+def extend_shared_leases(redis_conn, leases):
+    """
+    as `extend_leases`, for shared leases.
+    """
+    return operations.split_results(
+        [key for key, _, _ in leases], extend_shared_each(redis_conn, leases), True
+    )
+
+
+def check_shared_each(redis_conn, leases):
+    """
+    as `check_each`, for shared leases.
+    """
+    if not leases:
+        return []
+    member_get_script = get_script(redis_conn, scripts.MEMBER_GET)
+    values = member_get_script(
+        keys=[key for key, _ in leases], args=[expected_id for _, expected_id in leases]
+    )
+    return [value is not None for value in values]
+
+
+def check_shared_leases(redis_conn, keys_to_ids):
+    """
+    as `check_leases`, for shared leases.
+    """
+    keys = list(keys_to_ids.keys())
+    return operations.split_results(
+        keys, check_shared_each(redis_conn, [(key, keys_to_ids[key]) for key in keys]), True
+    )
+
+
+class SharedLeaseHandle(BlockingRedisLeaseHandle):
+    """
+    A handle on one of several leases held on a key at once, such as the
+    shared leases of a `BlockingRedisRWLock`. each expires on its own.
+
+    Behaves as `BlockingRedisLeaseHandle` otherwise.
+    """
+    check_many = staticmethod(check_shared_each)
+    release_many = staticmethod(release_shared_each)
+    extend_many = staticmethod(extend_shared_each)
+
+    def _check_remotely(self):
+        member_get_script = get_script(self.redis_conn, scripts.MEMBER_GET)
+        [value] = member_get_script(keys=[self.key], args=[self.id])
+        return value is not None
+
+    def _release_remotely(self):
+        released, _ = release_shared_leases(self.redis_conn, {self.key: self.id})
+        return bool(released)
+
+    def _extend_remotely(self, ttl):
+        extended, _ = extend_shared_leases(self.redis_conn, [(self.key, self.id, ttl)])
+        return bool(extended)
+
+    @classmethod
+    def get_existing(cls, key, expected_id, redis_conn, instrumentation=None):
+        """
+        instantiates a handle for a shared lease on `key`, which
+        should already have been acquired.
+
+        raises `LockExpired` if that lease is no longer held.
+        """
+        instrumentation = get_instrumentation(instrumentation)
+        with measure(instrumentation, None, 'get_lease_handle') as call:
+            member_get_script = get_script(redis_conn, scripts.MEMBER_GET)
+            [data] = member_get_script(keys=[key], args=[expected_id])
+            instrumentation.trace('lease_value', key=key, value=data)
+            if not data:
+                raise LockExpired(key, expected_id)
+            instance = cls.deserialize(
+                redis_conn=redis_conn, data=data, key=key, instrumentation=instrumentation
+            )
+            call.prefix = instance.prefix
+            return instance
@@ -0,0 +1,22 @@
+"""
+The `pylocks` command.
+
+    pylocks top --help
+"""
+import argparse
+from pylocks import top
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pylocks')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    top_parser = commands.add_parser('top', help='show live lock activity')
+    top.add_arguments(top_parser)
+    top_parser.set_defaults(run=top.main)
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
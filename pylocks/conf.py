@@ -1,2 +1,7 @@
 
 DEFAULT_ROOT_PREFIX = 'pylocks'
+
+# see `pylocks.core.lease_codecs`. every codec writes framed values, which
+# clients older than framed values can't read; see "lease values" in the
+# README for the order to upgrade in.
+DEFAULT_LEASE_CODEC = 'compact'
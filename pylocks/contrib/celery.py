@@ -0,0 +1,201 @@
+"""
+Celery tasks which take their lock when they're enqueued.
+
+This is the lease-based pattern from the README, packaged: enqueueing
+a `LeasedTask` acquires its lock first and sends the lease ID along in
+a message header, so a duplicate enqueue is dropped before anything is
+sent to the broker. the worker checks the lease once, when the task
+starts, and releases it when the task ends, whether it succeeded or not.
+
+    from pylocks.contrib.celery import leased_task
+
+    person_lock = BlockingRedisLockFactory(prefix='person', ttl=60, arity=1).build(redis_conn)
+
+    @leased_task(app, person_lock, lock_args=lambda person_id, amount: person_id)
+    def add_to_person(person_id, amount):
+        ...
+
+    add_to_person.delay('1234', 5)          # None if '1234' is already locked
+    add_to_person.leased_group([('1', 5), ('2', 5)]).apply_async()
+
+the lease's TTL has to cover the time the task spends in the queue.
+a task which retries hands its lease on to the retried message.
+
+requires celery; install pylocks with the `celery` extra.
+"""
+import logging
+import celery
+from celery._state import get_current_worker_task
+from celery.exceptions import Retry
+from pylocks.errors import LockAlreadyHeld
+
+logger = logging.getLogger(__name__)
+
+# message header holding the ID of a task's lease
+LEASE_HEADER = 'pylocks_lease'
+
+# message header of `leased_chunks` parts, mapping each of their
+# items' lock keys to its lease ID
+LEASES_HEADER = 'pylocks_leases'
+
+
+def _header(request, name):
+    value = getattr(request, name, None)
+    if value is None and request.headers:
+        value = request.headers.get(name)
+    return value
+
+
+class LeasedTask(celery.Task):
+    """
+    A task whose messages each carry a lease on `lock`.
+
+    `lock` is any of the blocking locks (`BlockingRedisLock` and those
+    like it). `lock_args` is a static method which takes the task's
+    arguments and returns the args list to lock; by default, the
+    task's first `lock.arity` positional arguments are.
+
+    Without a `lock`, the task behaves as a plain celery task, so this
+    can serve as an app's `task_cls`. calling the task directly runs it
+    without a lease, as calling a celery task directly always does.
+    """
+    lock = None
+    lock_args = None
+
+    def get_lock_args(self, args, kwargs):
+        if self.lock_args is not None:
+            return self.lock_args(*args, **kwargs)
+        if self.lock.arity == 1:
+            return args[0]
+        return tuple(args[:self.lock.arity])
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        """
+        acquires the lease for `args` and `kwargs`, then enqueues the
+        task as celery does, with the lease ID in its headers.
+
+        returns None, without enqueueing anything, if the lock is held.
+        """
+        headers = dict(options.pop('headers', None) or {})
+        if self.lock is None or LEASE_HEADER in headers:
+            # e.g. a retry, which keeps the lease it already has
+            return super(LeasedTask, self).apply_async(args, kwargs, headers=headers, **options)
+        args_list = self.get_lock_args(args or (), kwargs or {})
+        try:
+            handle = self.lock.acquire(args_list)
+        except LockAlreadyHeld:
+            logger.info('%s is already enqueued for %r; skipping it', self.name, args_list)
+            return None
+        headers[LEASE_HEADER] = handle.id
+        try:
+            return super(LeasedTask, self).apply_async(args, kwargs, headers=headers, **options)
+        except Exception:
+            handle.release(ignore_failure=True)
+            raise
+
+    def _acquire_many(self, arg_tuples):
+        """
+        acquires the leases of many calls in one round trip. returns a
+        list of (args, handle) for the calls which got their lease; the
+        others are logged and dropped.
+        """
+        calls = []
+        args_lists = []
+        for args in arg_tuples:
+            args = tuple(args)
+            calls.append((args, self.get_lock_args(args, {})))
+            args_lists.append(calls[-1][1])
+        locked, missing = self.lock.macquire(args_lists)
+        if missing:
+            logger.info('%s is already enqueued for %i of %i calls; skipping them',
+                        self.name, len(missing), len(calls))
+        acquired = []
+        for args, args_list in calls:
+            handle = locked.pop(args_list, None)
+            if handle is not None:
+                acquired.append((args, handle))
+        return acquired
+
+    def leased_group(self, arg_tuples, **options):
+        """
+        returns a `celery.group` calling this task once per tuple of
+        positional arguments in `arg_tuples`, with all of their leases
+        acquired in one `macquire`. calls whose lock is held are left out.
+        """
+        signatures = []
+        for args, handle in self._acquire_many(arg_tuples):
+            headers = dict(options.get('headers') or {})
+            headers[LEASE_HEADER] = handle.id
+            signatures.append(self.signature(args, options=dict(options, headers=headers)))
+        return celery.group(signatures)
+
+    def leased_chunks(self, arg_tuples, n, **options):
+        """
+        as `leased_group`, but calls this task for `n` tuples at a time
+        in each message, as `Task.chunks` does.
+        """
+        acquired = self._acquire_many(arg_tuples)
+        parts = []
+        for start in range(0, len(acquired), n):
+            part = acquired[start:start + n]
+            headers = dict(options.get('headers') or {})
+            headers[LEASES_HEADER] = dict(
+                (self.lock.make_key(self.get_lock_args(args, {})), handle.id) for args, handle in part
+            )
+            parts.append(self.starmap([args for args, _ in part]).set(headers=headers, **options))
+        return celery.group(parts)
+
+    def _lease_id(self, args_list):
+        """
+        returns the lease ID this call was enqueued with, or None.
+        """
+        if not self.request.called_directly:
+            return _header(self.request, LEASE_HEADER)
+        # an item of a `leased_chunks` part, which celery calls directly
+        parent = get_current_worker_task()
+        if parent is not None and parent is not self:
+            leases = _header(parent.request, LEASES_HEADER)
+            if leases:
+                return leases.get(self.lock.make_key(args_list))
+        return None
+
+    def __call__(self, *args, **kwargs):
+        if self.lock is None:
+            return super(LeasedTask, self).__call__(*args, **kwargs)
+        args_list = self.get_lock_args(args, kwargs)
+        lease_id = self._lease_id(args_list)
+        if lease_id is not None:
+            # raises LockExpired if the lease ran out in the queue
+            handle = self.lock.get_lease_handle(args_list, lease_id)
+        elif not self.request.called_directly:
+            # enqueued without a lease, e.g. with `send_task`
+            handle = self.lock.acquire(args_list)
+        else:
+            return super(LeasedTask, self).__call__(*args, **kwargs)
+        try:
+            result = super(LeasedTask, self).__call__(*args, **kwargs)
+        except Retry:
+            # the retried message carries the same lease
+            handle.extend()
+            raise
+        except BaseException:
+            handle.release(ignore_failure=True)
+            raise
+        handle.release(ignore_failure=True)
+        return result
+
+
+def leased_task(app, lock, lock_args=None, **options):
+    """
+    decorator which makes a `LeasedTask` of a function, as
+    `app.task(**options)` would make a task of it.
+
+    `lock_args` takes the task's arguments and returns the args list
+    to lock; by default, the first `lock.arity` positional arguments.
+    """
+    return app.task(
+        base=options.pop('base', LeasedTask),
+        lock=lock,
+        lock_args=staticmethod(lock_args) if lock_args is not None else None,
+        **options
+    )
@@ -0,0 +1,80 @@
+"""
+Consistent hashing of lock keys onto named shards.
+
+Each shard is placed at `replicas` points on a ring of 64-bit hashes,
+and a key belongs to the shard at the first point at or after the key's
+own hash. Adding a shard only moves the keys which now fall just before
+its points, about 1/N of them, and removing one only moves its own keys.
+
+As in redis cluster, if a key contains a `{...}` hash tag, only the tag
+is hashed, so keys sharing a tag always share a shard.
+"""
+import bisect
+import hashlib
+import struct
+
+DEFAULT_REPLICAS = 160
+
+
+def _hash(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return struct.unpack_from('>Q', hashlib.md5(text).digest())[0]
+
+
+def hash_tag(key):
+    """
+    returns the part of `key` which decides its shard.
+    """
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class HashRing(object):
+    def __init__(self, shards=(), replicas=DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self._points = []
+        self._owners = []
+        self.shards = []
+        for shard in shards:
+            self.add(shard)
+
+    def add(self, shard):
+        if shard in self.shards:
+            raise ValueError('shard %r is already on the ring' % (shard,))
+        self.shards.append(shard)
+        for replica in range(self.replicas):
+            point = _hash('%s#%i' % (shard, replica))
+            index = bisect.bisect_left(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, shard)
+
+    def remove(self, shard):
+        self.shards.remove(shard)
+        kept = [
+            (point, owner) for point, owner in zip(self._points, self._owners)
+            if owner != shard
+        ]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def shard_for(self, key):
+        if not self._points:
+            raise ValueError('the ring has no shards')
+        index = bisect.bisect_left(self._points, _hash(hash_tag(key)))
+        if index == len(self._points):
+            index = 0
+        return self._owners[index]
+
+    def split(self, keys):
+        """
+        returns a dict mapping each shard to its keys, in their given order.
+        """
+        by_shard = {}
+        for key in keys:
+            by_shard.setdefault(self.shard_for(key), []).append(key)
+        return by_shard
@@ -1,17 +1,38 @@
+import base64
+import hashlib
 from pylocks.errors import ArityError
 from pylocks.conf import DEFAULT_ROOT_PREFIX
 
+# length of the hashed prefix in compact keys
+COMPACT_PREFIX_LENGTH = 8
+
+
+def compact_prefix(prefix):
+    """
+    a fixed-width stand-in for `prefix` in compact keys.
+    """
+    digest = hashlib.sha1(prefix.encode('utf-8')).digest()
+    return base64.urlsafe_b64encode(digest)[:COMPACT_PREFIX_LENGTH].decode('ascii')
+
+
 class KeyFormatter(object):
-    def __init__(self, prefix, arity=1, root_prefix=DEFAULT_ROOT_PREFIX):
+    """
+    Turns args lists into lock keys, `<root_prefix>:<prefix>:<arg>:<arg>...`,
+    and back.
+
+    with `compact=True`, the prefix is replaced by a short hash of it, which
+    saves memory when there are millions of keys. the root prefix is kept,
+    so keys can still be found by it.
+    """
+    def __init__(self, prefix, arity=1, root_prefix=DEFAULT_ROOT_PREFIX, compact=False):
         self.prefix = prefix
-        self.arity = 1
+        self.arity = arity
         self.root_prefix = root_prefix
+        self.compact = compact
+        self.head = '%s:%s:' % (root_prefix, compact_prefix(prefix) if compact else prefix)
 
     def _make_key(self, args):
-        if not isinstance(args, (list, tuple)) and self.arity == 1:
-            args = [args]
-        key_part = ':'.join(list(map(str, list(args))))
-        return '%s:%s:%s' % (self.root_prefix, self.prefix, key_part)
+        return self.head + ':'.join(map(str, args))
 
     def _check_arity(self, args):
         if len(args) != self.arity:
@@ -21,3 +42,85 @@ class KeyFormatter(object):
         self._check_arity(args)
         return self._make_key(args)
 
+    def format_args(self, args_list):
+        """
+        formats an args list as the locks accept them: a list or tuple
+        of `arity` args, or, for locks of arity 1, a single arg.
+        """
+        if not isinstance(args_list, (list, tuple)):
+            args_list = (args_list,)
+        self._check_arity(args_list)
+        return self._make_key(args_list)
+
+    def format_many(self, args_lists):
+        """
+        `format_args` for each of `args_lists`, without the per-call overhead.
+        """
+        head = self.head
+        arity = self.arity
+        keys = []
+        for args_list in args_lists:
+            if isinstance(args_list, (list, tuple)):
+                if len(args_list) != arity:
+                    self._check_arity(args_list)
+                keys.append(head + ':'.join(map(str, args_list)))
+            else:
+                if arity != 1:
+                    self._check_arity((args_list,))
+                keys.append(head + str(args_list))
+        return keys
+
+    def parse(self, key):
+        """
+        returns the args a key was formatted from, as a tuple of strings.
+        the last arg gets any colons which were in the args.
+
+        raises `ValueError` if `key` wasn't made by this formatter.
+        """
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        if not key.startswith(self.head):
+            raise ValueError('%r is not a key of %s' % (key, self.head))
+        args = key[len(self.head):].split(':', self.arity - 1)
+        self._check_arity(args)
+        return tuple(args)
+
+
+class KeyPrefixes(object):
+    """
+    Tells which lock prefix each of many keys was formatted with, for
+    tools which look at the keys of every lock under a root prefix.
+
+    keys are matched against the heads `KeyFormatter` gives the known
+    `prefixes`, plain and compact. a key matching none of them is
+    taken to have the prefix up to its next colon, which for compact
+    keys is the prefix's hash; `add` the prefix to recognise it.
+    """
+    def __init__(self, prefixes=(), root_prefix=DEFAULT_ROOT_PREFIX):
+        self.root_prefix = root_prefix
+        self.root_head = root_prefix + ':'
+        self._heads = {}
+        self._prefixes = set()
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        if prefix in self._prefixes:
+            return
+        self._prefixes.add(prefix)
+        for compact in (False, True):
+            head = KeyFormatter(prefix, root_prefix=self.root_prefix, compact=compact).head
+            self._heads[head] = prefix
+
+    def prefix_of(self, key):
+        """
+        returns the prefix of `key`, or None if it isn't under the root prefix.
+        """
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        if not key.startswith(self.root_head):
+            return None
+        matches = [head for head in self._heads if key.startswith(head)]
+        if matches:
+            return self._heads[max(matches, key=len)]
+        return key[len(self.root_head):].split(':', 1)[0]
@@ -0,0 +1,144 @@
+"""
+Encodings for the lease values stored under lock keys.
+
+Every codec writes the header from `pylocks.serialization.frame`, so
+the lease ID always sits at a known offset and server-side scripts
+can compare it regardless of which codec wrote the value.
+
+`decode_lease` picks the codec from the version byte, and also accepts
+the plain pickles written before values were framed.
+"""
+import struct
+from pylocks import serialization
+from pylocks.conf import DEFAULT_LEASE_CODEC
+from pylocks.errors import SerializationError
+from .lock_lease_data import LockLeaseData
+from .lock_request import LockRequest
+
+
+class PickleLeaseCodec(object):
+    """
+    the full `LockLeaseData` object, pickled behind the lease header.
+    """
+    name = 'pickle'
+    version = serialization.FRAMED_PICKLE_VERSION
+
+    def encode(self, lease_data):
+        return lease_data.serialize()
+
+    def decode(self, data, key=None):
+        return LockLeaseData.deserialize(data)
+
+
+class CompactLeaseCodec(object):
+    """
+    fixed layout following the lease header:
+
+        acquired_at   double
+        ttl           uint32, milliseconds
+        arity         uint8
+        prefix        uint8 length, then utf-8 bytes
+        root prefix   uint8 length, then utf-8 bytes
+
+    the key itself isn't stored, since it's the redis key the value lives
+    under; `decode` needs it passed in. the request time isn't stored
+    either, and decodes as the acquisition time.
+    """
+    name = 'compact'
+    version = 2
+
+    _BODY = struct.Struct('>dIBBB')
+
+    def encode(self, lease_data):
+        request = lease_data.request
+        prefix = serialization.to_bytes(request.lock_prefix)
+        root_prefix = serialization.to_bytes(request.root_prefix)
+        if len(prefix) > 255 or len(root_prefix) > 255:
+            raise SerializationError('lock prefix is too long: %r' % request.key)
+        body = self._BODY.pack(
+            lease_data.acquired_at,
+            int(round(request.initial_ttl * 1000)),
+            request.lock_arity,
+            len(prefix),
+            len(root_prefix)
+        )
+        return serialization.frame(
+            lease_data.id, body + prefix + root_prefix, version=self.version
+        )
+
+    def decode(self, data, key=None):
+        if key is None:
+            raise SerializationError('compact lease values need their key to decode')
+        version, lease_id, body = serialization.read_frame(data)
+        if version != self.version:
+            raise SerializationError(data)
+        try:
+            acquired_at, ttl_ms, arity, prefix_length, root_length = self._BODY.unpack_from(body)
+        except struct.error:
+            raise SerializationError(data)
+        offset = self._BODY.size
+        prefix = body[offset:offset + prefix_length].decode('utf-8')
+        offset += prefix_length
+        root_prefix = body[offset:offset + root_length].decode('utf-8')
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        return LockLeaseData(
+            request=LockRequest(
+                key=key,
+                request_time=acquired_at,
+                initial_ttl=ttl_ms / 1000.0,
+                lock_arity=arity,
+                lock_prefix=prefix,
+                root_prefix=root_prefix
+            ),
+            id=lease_id,
+            acquired_at=acquired_at
+        )
+
+
+_codecs_by_name = {}
+_codecs_by_version = {}
+
+def register_codec(codec):
+    """
+    makes `codec` available to `get_codec` by name, and to
+    `decode_lease` by version byte.
+    """
+    existing = _codecs_by_version.get(codec.version)
+    if existing is not None and existing.name != codec.name:
+        raise ValueError('version %i is already used by %r' % (codec.version, existing.name))
+    _codecs_by_name[codec.name] = codec
+    _codecs_by_version[codec.version] = codec
+    return codec
+
+def get_codec(codec=None):
+    """
+    accepts a registered codec name, a codec instance, or None
+    for the default codec.
+    """
+    if codec is None:
+        codec = DEFAULT_LEASE_CODEC
+    if not isinstance(codec, str):
+        return codec
+    try:
+        return _codecs_by_name[codec]
+    except KeyError:
+        raise ValueError('unknown lease codec: %r' % codec)
+
+def decode_lease(data, key=None):
+    """
+    decodes a lease value written by any registered codec, or by
+    versions of pylocks which stored plain pickles.
+    """
+    if not serialization.is_framed(data):
+        return LockLeaseData.deserialize(data)
+    version, _, _ = serialization.read_frame(data)
+    try:
+        codec = _codecs_by_version[version]
+    except KeyError:
+        raise SerializationError('unknown lease value version: %i' % version)
+    return codec.decode(data, key=key)
+
+
+register_codec(PickleLeaseCodec())
+register_codec(CompactLeaseCodec())
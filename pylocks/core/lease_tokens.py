@@ -0,0 +1,90 @@
+"""
+Lease tokens: a lease packed into a short string, to hand it to another
+process, e.g. in a task's arguments, which can rebuild its handle
+without asking redis.
+
+A token holds the key, the lease's `compact` encoding (its ID,
+acquisition time, TTL, prefix and arity) and its fencing token, in
+URL-safe base64:
+
+    version   uint8
+    fence     uint64, 0 if there's none
+    key       uint16 length, then utf-8 bytes
+    lease     the rest, as `CompactLeaseCodec` encodes it
+
+with a `secret`, a truncated HMAC-SHA256 of that is appended after a
+'.', so that a token can't be forged or altered by whoever carries it.
+A token says nothing about whether its lease is still held.
+"""
+import base64
+import hashlib
+import hmac
+import struct
+from pylocks import serialization
+from pylocks.errors import InvalidLeaseToken
+from .lease_codecs import CompactLeaseCodec
+
+TOKEN_VERSION = 1
+
+# bytes of the HMAC kept in signed tokens
+SIGNATURE_LENGTH = 16
+
+_HEADER = struct.Struct('>BQH')
+_codec = CompactLeaseCodec()
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload, secret):
+    digest = hmac.new(serialization.to_bytes(secret), payload, hashlib.sha256).digest()
+    return digest[:SIGNATURE_LENGTH]
+
+
+def encode_token(lease_data, secret=None):
+    """
+    returns a token string for `lease_data`, signed if `secret` is given.
+    """
+    key = serialization.to_bytes(lease_data.key)
+    payload = _HEADER.pack(TOKEN_VERSION, lease_data.fence or 0, len(key)) + key
+    payload += _codec.encode(lease_data)
+    token = _b64encode(payload)
+    if secret is not None:
+        token += '.' + _b64encode(_sign(payload, secret))
+    return token
+
+
+def decode_token(token, secret=None):
+    """
+    returns the `LockLeaseData` packed in `token`.
+
+    with a `secret`, the token must be signed with it. raises
+    `InvalidLeaseToken` if it isn't, or if it isn't a token at all.
+    """
+    if isinstance(token, bytes):
+        token = token.decode('ascii')
+    encoded, _, signature = token.partition('.')
+    try:
+        payload = _b64decode(encoded)
+        if secret is not None:
+            if not signature or not hmac.compare_digest(
+                _b64decode(signature), _sign(payload, secret)
+            ):
+                raise InvalidLeaseToken('bad lease token signature')
+        version, fence, key_length = _HEADER.unpack_from(payload)
+        if version != TOKEN_VERSION:
+            raise InvalidLeaseToken('unknown lease token version: %i' % version)
+        offset = _HEADER.size + key_length
+        lease_data = _codec.decode(payload[offset:], key=payload[_HEADER.size:offset])
+    except InvalidLeaseToken:
+        raise
+    except (ValueError, TypeError, struct.error) as e:
+        # includes binascii.Error, UnicodeDecodeError and SerializationError
+        raise InvalidLeaseToken('not a lease token: %s' % e)
+    lease_data.fence = fence or None
+    return lease_data
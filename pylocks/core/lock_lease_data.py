@@ -1,10 +1,17 @@
 from pylocks import serialization
 
-class LockLeaseData(serialization.Serializable):
-    def __init__(self, request, id, acquired_at):
+class LockLeaseData(serialization.FramedSerializable):
+    # the lease's fencing token, if its lock issued one: a number which
+    # increases with every lease taken on the key, so a store can refuse
+    # writes from holders older than the last one it saw. see
+    # `pylocks.core.scripts.fence_key`.
+    fence = None
+
+    def __init__(self, request, id, acquired_at, fence=None):
         self.request = request
         self.id = id
         self.acquired_at = acquired_at
+        self.fence = fence
 
     @property
     def key(self):
@@ -17,5 +24,5 @@ class LockLeaseData(serialization.Serializable):
         return hash((self.key, self.id))
 
     def __repr__(self):
-        return '<LockLeaseData key=%r id=%r />' % (self.key, self.id)
+        return '<LockLeaseData key=%r id=%r fence=%r />' % (self.key, self.id, self.fence)
 
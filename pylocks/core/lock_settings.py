@@ -1,21 +1,49 @@
 import time
+from pylocks.errors import InvalidLeaseToken
 from .key_formatter import KeyFormatter
 from .lock_request import LockRequest
 
 class LockSettings(object):
-    def __init__(self, prefix, ttl, arity, root_prefix='pylocks'):
+    def __init__(self, prefix, ttl, arity, root_prefix='pylocks', compact_keys=False):
         self.prefix = prefix
         self.ttl = ttl
         self.arity = arity
         self.root_prefix = root_prefix
+        self.compact_keys = compact_keys
+        self._formatter = KeyFormatter(
+            prefix=prefix, arity=arity, root_prefix=root_prefix, compact=compact_keys
+        )
 
     @property
-    def _formatter(self):
-        return KeyFormatter(prefix=self.prefix, arity=self.arity, root_prefix=self.root_prefix)
+    def key_head(self):
+        """
+        the start shared by all of this lock's keys.
+        """
+        return self._formatter.head
 
-    def make_request(self, args_list, now=None):
-        key = self._formatter.format(args_list)
-        now = now or time.time()
+    def make_key(self, args_list):
+        return self._formatter.format_args(args_list)
+
+    def check_token_key(self, key):
+        """
+        raises `InvalidLeaseToken` unless `key`, read from a
+        lease token, is one of this lock's keys.
+        """
+        try:
+            self.parse_key(key)
+        except ValueError:
+            raise InvalidLeaseToken('%r is not a key of %s' % (key, self.key_head))
+
+    def make_keys(self, args_lists):
+        return self._formatter.format_many(args_lists)
+
+    def parse_key(self, key):
+        """
+        returns the args list `key` was made from, as a tuple of strings.
+        """
+        return self._formatter.parse(key)
+
+    def _request(self, key, now):
         return LockRequest(
             key=key,
             request_time=now,
@@ -25,4 +53,16 @@ class LockSettings(object):
             root_prefix=self.root_prefix
         )
 
+    def make_request(self, args_list, now=None):
+        return self._request(self.make_key(args_list), now or time.time())
 
+    def make_requests(self, args_lists, now=None):
+        """
+        returns a list of requests, one per args list, made at the same time.
+        """
+        now = now or time.time()
+        ttl, arity, prefix, root_prefix = self.ttl, self.arity, self.prefix, self.root_prefix
+        return [
+            LockRequest(key, now, ttl, arity, prefix, root_prefix)
+            for key in self._formatter.format_many(args_lists)
+        ]
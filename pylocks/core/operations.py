@@ -0,0 +1,119 @@
+"""
+Helpers for building the arguments of the lock scripts in
+`pylocks.core.scripts` and reading their replies.
+
+These don't talk to redis, so the blocking and asyncio
+implementations share them.
+"""
+import time
+from pylocks.util import make_id, to_millis
+from .lock_lease_data import LockLeaseData
+from .scripts import NOT_HELD
+
+
+def new_leases(lock_requests, now=None):
+    """
+    returns a `LockLeaseData` with a fresh lease id for each request.
+    """
+    now = now or time.time()
+    return [
+        LockLeaseData(request=request, id=make_id(), acquired_at=now)
+        for request in lock_requests
+    ]
+
+def acquire_args(leases, codec):
+    """
+    the ARGV of `ACQUIRE` and `ACQUIRE_ALL`: each lease's encoded
+    value, followed by its TTL in milliseconds.
+    """
+    args = []
+    for lease in leases:
+        args.append(codec.encode(lease))
+        args.append(to_millis(lease.request.initial_ttl))
+    return args
+
+def shared_acquire_args(leases, codec):
+    """
+    the ARGV of `RW_ACQUIRE_SHARED` after its first argument: each
+    lease's id and encoded value, followed by its TTL in milliseconds.
+    """
+    args = []
+    for lease in leases:
+        args.append(lease.id)
+        args.append(codec.encode(lease))
+        args.append(to_millis(lease.request.initial_ttl))
+    return args
+
+def remaining_ttl(holder_ttl):
+    """
+    converts a PTTL reply to seconds; None if the key
+    doesn't exist or never expires.
+    """
+    if holder_ttl is None or holder_ttl < 0:
+        return None
+    return holder_ttl / 1000.0
+
+def holder_ttls(replies):
+    """
+    reads the per-key replies of the exclusive acquire scripts: the
+    holder's PTTL for each lock which was held, None for each lock
+    which was taken (whose reply is a list holding its fencing token).
+    """
+    return [None if isinstance(reply, list) else reply for reply in replies]
+
+def record_fences(leases, replies):
+    """
+    sets the fencing token of each lease whose lock the exclusive
+    acquire scripts took. returns `holder_ttls(replies)`.
+    """
+    for lease, reply in zip(leases, replies):
+        if isinstance(reply, list):
+            lease.fence = reply[0]
+    return holder_ttls(replies)
+
+def read_fence(value):
+    """
+    converts the value of a `fence_key` to a fencing token.
+    """
+    return int(value) if value is not None else None
+
+def took_all(holder_ttls):
+    """
+    whether an `ACQUIRE_ALL` took every lock.
+    """
+    return all(holder_ttl is None for holder_ttl in holder_ttls)
+
+def blocking_requests(lock_requests, holder_ttls):
+    """
+    the requests whose locks made a failed `ACQUIRE_ALL` give up.
+    """
+    return [
+        request for request, holder_ttl in zip(lock_requests, holder_ttls)
+        if holder_ttl != NOT_HELD
+    ]
+
+def extend_args(leases):
+    """
+    returns the (KEYS, ARGV) of `EXTEND` for a list of
+    (key, expected_id, ttl_in_seconds) tuples.
+    """
+    keys = []
+    args = []
+    for key, expected_id, ttl in leases:
+        keys.append(key)
+        args.append(expected_id)
+        args.append(to_millis(ttl))
+    return keys, args
+
+def split_results(keys, results, success):
+    """
+    returns a tuple of (keys whose result was `success`, all other keys).
+    """
+    succeeded = []
+    failed = []
+    for key, result in zip(keys, results):
+        if result == success:
+            succeeded.append(key)
+        else:
+            failed.append(key)
+    return succeeded, failed
@@ -0,0 +1,512 @@
+"""
+Lua sources for the server-side lock operations.
+
+Each script accepts any number of keys, so single and bulk
+operations share a code path and cost one round trip.
+"""
+
+# prepended to a lock key to name its fencing token counter. lock keys
+# are utf-8 text, which never contains this byte, so the counters can't
+# collide with them or with the keys derived from them below.
+FENCE_KEY_PREFIX = b'\xfffence:'
+
+# helpers for issuing fencing tokens. a key's counter expires with the
+# lease it last issued a token to; a missing counter is seeded with the
+# server's clock in microseconds, so tokens keep increasing across the
+# counter's expiry as long as that clock doesn't step back.
+_FENCE_HELPERS = """
+local function next_fence(key, ttl_ms)
+    local fence = '\\255fence:' .. key
+    if redis.call('exists', fence) == 0 then
+        local t = redis.call('time')
+        redis.call('set', fence, t[1] .. string.format('%06d', tonumber(t[2])))
+    end
+    local token = redis.call('incr', fence)
+    redis.call('pexpire', fence, ttl_ms)
+    return token
+end
+"""
+
+# for locks which don't issue fencing tokens
+_NO_FENCE_HELPERS = """
+local function next_fence(key, ttl_ms)
+    return 0
+end
+"""
+
+# KEYS: lock keys
+# ARGV: value_1, ttl_ms_1, value_2, ttl_ms_2, ...
+#
+# returns one entry per key: if the lock was taken, a list holding its
+# fencing token, the next value of the key's `fence_key` counter;
+# otherwise the current holder's remaining TTL in milliseconds (-1 if
+# it has no expiry). the token is taken before the lease is written, so
+# an error can't leave a lease no one was told about.
+_ACQUIRE = """
+local result = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('exists', key) == 0 then
+        local token = next_fence(key, ARGV[2 * i])
+        redis.call('set', key, ARGV[2 * i - 1], 'PX', ARGV[2 * i])
+        result[i] = {token}
+    else
+        result[i] = redis.call('pttl', key)
+    end
+end
+return result
+"""
+
+ACQUIRE = _FENCE_HELPERS + _ACQUIRE
+
+# as `ACQUIRE`, with 0 for every fencing token and no counters; for
+# quorum locks, whose leases have no single counter to order them.
+UNFENCED_ACQUIRE = _NO_FENCE_HELPERS + _ACQUIRE
+
+# PTTL's reply for a key which doesn't exist
+NOT_HELD = -2
+
+# KEYS: lock keys
+# ARGV: value_1, ttl_ms_1, value_2, ttl_ms_2, ...
+#
+# takes every lock, or none of them if any is already held.
+# returns each key's fencing token as `ACQUIRE` does on success,
+# otherwise each key's PTTL (NOT_HELD for the keys which were free).
+_ACQUIRE_ALL = """
+local ttls = {}
+local blocked = false
+for i, key in ipairs(KEYS) do
+    ttls[i] = redis.call('pttl', key)
+    if ttls[i] ~= -2 then
+        blocked = true
+    end
+end
+if blocked then
+    return ttls
+end
+local result = {}
+for i, key in ipairs(KEYS) do
+    local token = next_fence(key, ARGV[2 * i])
+    redis.call('set', key, ARGV[2 * i - 1], 'PX', ARGV[2 * i])
+    result[i] = {token}
+end
+return result
+"""
+
+ACQUIRE_ALL = _FENCE_HELPERS + _ACQUIRE_ALL
+
+UNFENCED_ACQUIRE_ALL = _NO_FENCE_HELPERS + _ACQUIRE_ALL
+
+# helpers for reading the header written by `pylocks.serialization.frame`
+_LEASE_HELPERS = """
+local function is_framed(value)
+    return string.byte(value, 1) < 128
+end
+
+local function lease_id(value)
+    return string.sub(value, 3, 2 + string.byte(value, 2))
+end
+"""
+
+RELEASED = 1
+NOT_OWNED = 0
+UNFRAMED = -1
+
+# the names below must match the ones built inside the scripts.
+
+def release_channel(key):
+    """
+    the pub/sub channel the release script notifies when `key` is released.
+    """
+    return '%s:released' % key
+
+def fence_key(key):
+    """
+    the counter the acquire scripts increment each time they take the
+    lock on `key`, whose value is the holder's fencing token.
+    """
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return FENCE_KEY_PREFIX + key
+
+def queue_keys(key):
+    """
+    the keys backing the waiter queue of a fair lock on `key`:
+    the queue itself (waiter ids scored by ticket), each waiter's
+    deadline (scored in server milliseconds), and the ticket counter.
+    """
+    return '%s:queue' % key, '%s:queue:deadlines' % key, '%s:queue:ticket' % key
+
+def waiter_channel(key, waiter_id):
+    """
+    the pub/sub channel used to wake `waiter_id` once it
+    reaches the head of `key`'s queue.
+    """
+    return '%s:released:%s' % (key, waiter_id)
+
+# the server's clock, in milliseconds
+_TIME_HELPERS = """
+local function now_ms()
+    local t = redis.call('time')
+    return t[1] * 1000 + math.floor(t[2] / 1000)
+end
+"""
+
+# helpers for the waiter queues of fair locks
+_QUEUE_HELPERS = _TIME_HELPERS + """
+local function purge_waiters(queue, deadlines, now)
+    local expired = redis.call('zrangebyscore', deadlines, '-inf', now)
+    for _, waiter in ipairs(expired) do
+        redis.call('zrem', queue, waiter)
+    end
+    if #expired > 0 then
+        redis.call('zremrangebyscore', deadlines, '-inf', now)
+    end
+end
+
+local function wake_queue_head(key)
+    local queue = key .. ':queue'
+    if redis.call('exists', queue) == 0 then
+        return
+    end
+    purge_waiters(queue, key .. ':queue:deadlines', now_ms())
+    local head = redis.call('zrange', queue, 0, 0)[1]
+    if head then
+        redis.call('publish', key .. ':released:' .. head, '')
+    end
+end
+"""
+
+# KEYS: lock keys
+# ARGV: expected lease IDs, one per key
+#
+# deletes each key whose lease ID matches, publishes to the key's
+# `release_channel`, and wakes the head of its waiter queue if it has one.
+# returns one entry per key: RELEASED, NOT_OWNED, or UNFRAMED if the value
+# predates framed lease values and has to be checked client-side.
+RELEASE = _LEASE_HELPERS + _QUEUE_HELPERS + """
+local result = {}
+for i, key in ipairs(KEYS) do
+    local value = redis.call('get', key)
+    if not value then
+        result[i] = 0
+    elseif not is_framed(value) then
+        result[i] = -1
+    elseif lease_id(value) == ARGV[i] then
+        redis.call('del', key)
+        redis.call('publish', key .. ':released', ARGV[i])
+        wake_queue_head(key)
+        result[i] = 1
+    else
+        result[i] = 0
+    end
+end
+return result
+"""
+
+EXTENDED = 1
+
+# KEYS: lock keys
+# ARGV: id_1, ttl_ms_1, id_2, ttl_ms_2, ...
+#
+# resets the TTL of each key whose lease ID matches, and of its fencing
+# token counter, so `get_lease_handle` can still read the token. returns
+# one entry per key: EXTENDED if it was extended, otherwise 0. unframed
+# values are never extended, since they can only have been written by
+# older clients.
+EXTEND = _LEASE_HELPERS + """
+local result = {}
+for i, key in ipairs(KEYS) do
+    local value = redis.call('get', key)
+    if value and is_framed(value) and lease_id(value) == ARGV[2 * i - 1] then
+        redis.call('pexpire', key, ARGV[2 * i])
+        redis.call('pexpire', '\\255fence:' .. key, ARGV[2 * i])
+        result[i] = 1
+    else
+        result[i] = 0
+    end
+end
+return result
+"""
+
+# KEYS: lock key, then its `queue_keys`
+# ARGV: value, ttl_ms, waiter id, queue_ms
+#
+# takes the lock if it's free and no one else is queued ahead of the
+# waiter. otherwise, if queue_ms > 0, queues the waiter (keeping its
+# place if it's already queued) and pushes its deadline to queue_ms
+# from now; waiters whose deadlines have passed are dropped.
+#
+# returns {1, the fencing token, 0} if the lock was taken, otherwise {0,
+# the lock's PTTL, the waiter's position in the queue or -1 if it isn't
+# queued}. tokens are issued as `ACQUIRE` issues them.
+FAIR_ACQUIRE = _QUEUE_HELPERS + _FENCE_HELPERS + """
+local lock_key, queue, deadlines, ticket = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local waiter = ARGV[3]
+local queue_ms = tonumber(ARGV[4])
+local now = now_ms()
+purge_waiters(queue, deadlines, now)
+local head = redis.call('zrange', queue, 0, 0)[1]
+if (not head or head == waiter) and redis.call('exists', lock_key) == 0 then
+    local token = next_fence(lock_key, ARGV[2])
+    redis.call('set', lock_key, ARGV[1], 'PX', ARGV[2])
+    if head then
+        redis.call('zrem', queue, waiter)
+        redis.call('zrem', deadlines, waiter)
+    end
+    return {1, token, 0}
+end
+local position = -1
+if queue_ms > 0 then
+    if not redis.call('zscore', queue, waiter) then
+        redis.call('zadd', queue, redis.call('incr', ticket), waiter)
+    end
+    redis.call('zadd', deadlines, now + queue_ms, waiter)
+    local last = redis.call('zrange', deadlines, -1, -1, 'withscores')[2]
+    for _, key in ipairs({queue, deadlines, ticket}) do
+        redis.call('pexpire', key, last - now + 1000)
+    end
+    position = redis.call('zrank', queue, waiter)
+end
+return {0, redis.call('pttl', lock_key), position}
+"""
+
+def holder_keys(key):
+    """
+    the keys backing the shared leases on `key`: the holders' lease
+    ids (scored by expiry, in server milliseconds) and their values.
+    """
+    return '%s:holders' % key, '%s:holders:leases' % key
+
+def writer_key(key):
+    """
+    the key set while a writer with priority waits for `key`.
+    """
+    return '%s:writer' % key
+
+# helpers for shared leases, which are members of a key's
+# `holder_keys` which each expire on their own
+_HOLDER_HELPERS = _TIME_HELPERS + """
+local function purge_holders(key, now)
+    local holders, leases = key .. ':holders', key .. ':holders:leases'
+    local expired = redis.call('zrangebyscore', holders, '-inf', now)
+    if #expired > 0 then
+        redis.call('zremrangebyscore', holders, '-inf', now)
+        for _, id in ipairs(expired) do
+            redis.call('hdel', leases, id)
+        end
+    end
+end
+
+-- milliseconds until the last holder's lease runs out, or -2 if
+-- there are no holders.
+local function holders_pttl(key, now)
+    local last = redis.call('zrange', key .. ':holders', -1, -1, 'withscores')[2]
+    if last then
+        return last - now
+    end
+    return -2
+end
+
+local function expire_holders(key, now)
+    local ttl = holders_pttl(key, now)
+    if ttl > 0 then
+        redis.call('pexpire', key .. ':holders', ttl)
+        redis.call('pexpire', key .. ':holders:leases', ttl)
+    end
+end
+
+local function add_holder(key, id, value, ttl_ms, now)
+    redis.call('zadd', key .. ':holders', now + ttl_ms, id)
+    redis.call('hset', key .. ':holders:leases', id, value)
+    expire_holders(key, now)
+end
+"""
+
+# KEYS: lock keys
+# ARGV: all, priority_ms, value_1, ttl_ms_1, value_2, ttl_ms_2, ...
+#
+# takes the exclusive lease on each key which has neither an exclusive
+# holder nor unexpired shared holders; if `all` is '1', takes every one
+# or none of them. a blocked key's `writer_key` is set for priority_ms,
+# if that's > 0, which keeps new shared holders out.
+#
+# returns one entry per key: its fencing token, as `ACQUIRE` does, if
+# it was taken, otherwise the PTTL of its exclusive holder or of its
+# last shared holder.
+RW_ACQUIRE = _HOLDER_HELPERS + _FENCE_HELPERS + """
+local all = ARGV[1] == '1'
+local priority_ms = tonumber(ARGV[2])
+local now = now_ms()
+local ttls = {}
+local blocked = false
+for i, key in ipairs(KEYS) do
+    purge_holders(key, now)
+    ttls[i] = redis.call('pttl', key)
+    if ttls[i] == -2 then
+        ttls[i] = holders_pttl(key, now)
+    end
+    if ttls[i] ~= -2 then
+        blocked = true
+        if priority_ms > 0 then
+            redis.call('set', key .. ':writer', '', 'PX', priority_ms)
+        end
+    end
+end
+if all and blocked then
+    return ttls
+end
+local result = {}
+for i, key in ipairs(KEYS) do
+    if ttls[i] == -2 then
+        local token = next_fence(key, ARGV[2 * i + 2])
+        redis.call('set', key, ARGV[2 * i + 1], 'PX', ARGV[2 * i + 2])
+        redis.call('del', key .. ':writer')
+        result[i] = {token}
+    else
+        result[i] = ttls[i]
+    end
+end
+return result
+"""
+
+# KEYS: lock keys
+# ARGV: all, id_1, value_1, ttl_ms_1, id_2, value_2, ttl_ms_2, ...
+#
+# adds a shared lease to each key which has no exclusive holder and
+# no waiting writer; if `all` is '1', to every one or none of them.
+#
+# returns one entry per key: nil if it was taken, otherwise the PTTL of
+# its exclusive holder or of the waiting writer's priority. with `all`,
+# returns an empty list on success. shared leases get no fencing token.
+RW_ACQUIRE_SHARED = _HOLDER_HELPERS + """
+local all = ARGV[1] == '1'
+local now = now_ms()
+local ttls = {}
+local blocked = false
+for i, key in ipairs(KEYS) do
+    ttls[i] = redis.call('pttl', key)
+    if ttls[i] == -2 then
+        ttls[i] = redis.call('pttl', key .. ':writer')
+    end
+    if ttls[i] ~= -2 then
+        blocked = true
+    end
+end
+if all and blocked then
+    return ttls
+end
+local result = {}
+for i, key in ipairs(KEYS) do
+    if ttls[i] == -2 then
+        purge_holders(key, now)
+        add_holder(key, ARGV[3 * i - 1], ARGV[3 * i], tonumber(ARGV[3 * i + 1]), now)
+        result[i] = false
+    else
+        result[i] = ttls[i]
+    end
+end
+if all then
+    return {}
+end
+return result
+"""
+
+# KEYS: lock keys
+# ARGV: expected shared lease IDs, one per key
+#
+# removes each shared lease which is still held, and publishes to
+# the key's `release_channel`. returns RELEASED or NOT_OWNED per key.
+MEMBER_RELEASE = _HOLDER_HELPERS + """
+local now = now_ms()
+local result = {}
+for i, key in ipairs(KEYS) do
+    purge_holders(key, now)
+    if redis.call('zrem', key .. ':holders', ARGV[i]) == 1 then
+        redis.call('hdel', key .. ':holders:leases', ARGV[i])
+        redis.call('publish', key .. ':released', ARGV[i])
+        result[i] = 1
+    else
+        result[i] = 0
+    end
+end
+return result
+"""
+
+# KEYS: lock keys
+# ARGV: id_1, ttl_ms_1, id_2, ttl_ms_2, ...
+#
+# resets the TTL of each shared lease which is still held, and of the
+# key's fencing token counter, as `EXTEND` does, so the counter lives as
+# long as any lease on the key. returns EXTENDED or 0 per key.
+MEMBER_EXTEND = _HOLDER_HELPERS + """
+local now = now_ms()
+local result = {}
+for i, key in ipairs(KEYS) do
+    purge_holders(key, now)
+    if redis.call('zscore', key .. ':holders', ARGV[2 * i - 1]) then
+        redis.call('zadd', key .. ':holders', now + tonumber(ARGV[2 * i]), ARGV[2 * i - 1])
+        expire_holders(key, now)
+        redis.call('pexpire', '\\255fence:' .. key, ARGV[2 * i])
+        result[i] = 1
+    else
+        result[i] = 0
+    end
+end
+return result
+"""
+
+# KEYS: lock keys
+# ARGV: shared lease IDs, one per key
+#
+# returns, per key, the shared lease's value if it's still
+# held, otherwise nil.
+MEMBER_GET = _TIME_HELPERS + """
+local now = now_ms()
+local result = {}
+for i, key in ipairs(KEYS) do
+    local expires_at = redis.call('zscore', key .. ':holders', ARGV[i])
+    if expires_at and tonumber(expires_at) > now then
+        result[i] = redis.call('hget', key .. ':holders:leases', ARGV[i])
+    else
+        result[i] = false
+    end
+end
+return result
+"""
+
+# KEYS: lock keys
+#
+# returns, per key, how many leases are held on it: its unexpired
+# shared leases, plus one if it's held exclusively.
+HOLDER_COUNT = _TIME_HELPERS + """
+local now = now_ms()
+local result = {}
+for i, key in ipairs(KEYS) do
+    result[i] = redis.call('zcount', key .. ':holders', '(' .. now, '+inf') + redis.call('exists', key)
+end
+return result
+"""
+
+# KEYS: semaphore keys
+# ARGV: limit, id_1, value_1, ttl_ms_1, id_2, value_2, ttl_ms_2, ...
+#
+# adds a shared lease to each key which has fewer than `limit`
+# unexpired ones, dropping expired leases first.
+#
+# returns one entry per key: nil if a lease was added, otherwise the
+# milliseconds until the first of its current leases expires.
+SEMAPHORE_ACQUIRE = _HOLDER_HELPERS + """
+local limit = tonumber(ARGV[1])
+local now = now_ms()
+local result = {}
+for i, key in ipairs(KEYS) do
+    purge_holders(key, now)
+    if redis.call('zcard', key .. ':holders') < limit then
+        add_holder(key, ARGV[3 * i - 1], ARGV[3 * i], tonumber(ARGV[3 * i + 1]), now)
+        result[i] = false
+    else
+        result[i] = redis.call('zrange', key .. ':holders', 0, 0, 'withscores')[2] - now
+    end
+end
+return result
+"""
@@ -9,7 +9,18 @@ class LockError(BaseLocksError, RuntimeError):
     pass
 
 class LockAlreadyHeld(LockError):
-    pass
+    def __init__(self, key, remaining_ttl=None):
+        super(LockAlreadyHeld, self).__init__(key)
+        self.key = key
+        # seconds until the current holder's lease expires,
+        # or None if that isn't known.
+        self.remaining_ttl = remaining_ttl
+
+class QuorumNotReached(LockAlreadyHeld):
+    """
+    a quorum lock couldn't be taken on a majority of its nodes,
+    whether because they were held or because they failed.
+    """
 
 class LockNotOwned(LockError):
     pass
@@ -22,3 +33,8 @@ class InvalidLockValue(LockError, ValueError):
 
 class SerializationError(InvalidLockValue):
     pass
+
+class InvalidLeaseToken(InvalidLockValue):
+    """
+    a lease token was malformed, or its signature didn't match.
+    """
@@ -0,0 +1,280 @@
+"""
+Hooks for measuring what locks do.
+
+Locks and their handles report to an `Instrumentation`.
+The default one does nothing. To collect measurements, pass an
+instance to the lock factory, or make it the process-wide default with
+`set_default_instrumentation` before building locks.
+
+`InMemoryInstrumentation` aggregates counters and latency histograms
+per lock prefix, and hands snapshots of them to a sink on `flush`.
+To send measurements elsewhere as they happen (e.g. to statsd),
+subclass `Instrumentation` instead.
+"""
+import bisect
+import collections
+import logging
+import threading
+from pylocks.errors import LockAlreadyHeld, LockExpired, LockNotOwned
+from pylocks.util import monotonic
+
+logger = logging.getLogger(__name__)
+
+# outcomes of an operation
+OK = 'ok'
+HELD = 'held'
+NOT_OWNED = 'not_owned'
+EXPIRED = 'expired'
+ERROR = 'error'
+
+
+def outcome_of(error):
+    if isinstance(error, LockAlreadyHeld):
+        return HELD
+    if isinstance(error, LockExpired):
+        return EXPIRED
+    if isinstance(error, LockNotOwned):
+        return NOT_OWNED
+    return ERROR
+
+
+class Instrumentation(object):
+    """
+    Receives measurements; every method does nothing by default.
+
+    `prefix` is the lock prefix an operation was made under, or
+    None if it isn't known (e.g. for keys passed in directly).
+    """
+    def operation(self, prefix, name, seconds, outcome=OK, round_trips=1):
+        """
+        an API call `name` took `seconds`, ended with `outcome`, and made
+        `round_trips` requests to redis (0 if it was answered locally).
+        """
+
+    def count(self, prefix, name, value=1):
+        """
+        anything else worth counting, e.g. acquires refused locally.
+        """
+
+    def hold_time(self, prefix, seconds):
+        """
+        a lease was released `seconds` after it was acquired.
+        """
+
+    def ttl_headroom(self, prefix, seconds):
+        """
+        a lease was released or extended with about `seconds` of its
+        TTL left. values near zero mean its TTL is too short.
+        """
+
+    def trace(self, event, **fields):
+        """
+        a debug event, such as a raw lease value being read.
+        """
+
+
+class measure(object):
+    """
+    context manager which reports an operation to `instrumentation`,
+    taking its outcome from the exception raised, if any. callers can
+    update `round_trips` and `outcome` inside the block.
+    """
+    __slots__ = ('instrumentation', 'prefix', 'name', 'round_trips', 'outcome', 'started_at')
+
+    def __init__(self, instrumentation, prefix, name, round_trips=1):
+        self.instrumentation = instrumentation
+        self.prefix = prefix
+        self.name = name
+        self.round_trips = round_trips
+        self.outcome = OK
+
+    def __enter__(self):
+        self.started_at = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is not None:
+            self.outcome = outcome_of(exc_value)
+        self.instrumentation.operation(
+            self.prefix, self.name, monotonic() - self.started_at,
+            outcome=self.outcome, round_trips=self.round_trips
+        )
+        return False
+
+
+class Histogram(object):
+    """
+    counts values in exponentially sized buckets, from 50 microseconds
+    up to about 30 minutes, so percentiles are accurate within one bucket.
+    """
+    BOUNDS = tuple(0.00005 * 2 ** i for i in range(26))
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        returns the upper bound of the bucket holding the given
+        percentile (capped at the largest value seen).
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if index < len(self.BOUNDS):
+                    return min(self.BOUNDS[index], self.max)
+                return self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class _OperationStats(object):
+    def __init__(self):
+        self.round_trips = 0
+        self.latency = Histogram()
+
+
+class InMemoryInstrumentation(Instrumentation):
+    """
+    Aggregates measurements in memory, per prefix.
+
+    `snapshot()` returns them as plain dicts:
+
+        operations      {prefix: {operation: {outcome: {
+                            'count', 'round_trips', 'latency': {histogram summary}}}}}
+        counters        {prefix: {name: value}}
+        hold_time       {prefix: {histogram summary}}
+        ttl_headroom    {prefix: {histogram summary}}
+
+    `flush()` passes a snapshot to `sink` (any callable) and starts over.
+
+    with `trace=True`, debug events are logged at DEBUG level and the
+    last `max_events` of them are kept in `events`.
+    """
+    def __init__(self, sink=None, trace=False, max_events=1000):
+        self.sink = sink
+        self.tracing = trace
+        self.events = collections.deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._operations = {}
+        self._counters = {}
+        self._hold_time = {}
+        self._ttl_headroom = {}
+
+    def operation(self, prefix, name, seconds, outcome=OK, round_trips=1):
+        with self._lock:
+            key = (prefix, name, outcome)
+            stats = self._operations.get(key)
+            if stats is None:
+                stats = self._operations[key] = _OperationStats()
+            stats.round_trips += round_trips
+            stats.latency.add(seconds)
+
+    def count(self, prefix, name, value=1):
+        with self._lock:
+            key = (prefix, name)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def hold_time(self, prefix, seconds):
+        with self._lock:
+            self._histogram(self._hold_time, prefix).add(seconds)
+
+    def ttl_headroom(self, prefix, seconds):
+        with self._lock:
+            self._histogram(self._ttl_headroom, prefix).add(seconds)
+
+    def trace(self, event, **fields):
+        if not self.tracing:
+            return
+        logger.debug('%s %r', event, fields)
+        self.events.append((event, fields))
+
+    def _histogram(self, histograms, prefix):
+        histogram = histograms.get(prefix)
+        if histogram is None:
+            histogram = histograms[prefix] = Histogram()
+        return histogram
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        operations = {}
+        for (prefix, name, outcome), stats in self._operations.items():
+            operations.setdefault(prefix, {}).setdefault(name, {})[outcome] = {
+                'count': stats.latency.count,
+                'round_trips': stats.round_trips,
+                'latency': stats.latency.summary(),
+            }
+        counters = {}
+        for (prefix, name), value in self._counters.items():
+            counters.setdefault(prefix, {})[name] = value
+        return {
+            'operations': operations,
+            'counters': counters,
+            'hold_time': dict((p, h.summary()) for p, h in self._hold_time.items()),
+            'ttl_headroom': dict((p, h.summary()) for p, h in self._ttl_headroom.items()),
+        }
+
+    def flush(self):
+        """
+        passes a snapshot to the sink, if there is one, and resets.
+        returns the snapshot.
+        """
+        with self._lock:
+            snapshot = self._snapshot()
+            self._reset()
+        if self.sink is not None:
+            self.sink(snapshot)
+        return snapshot
+
+
+NULL_INSTRUMENTATION = Instrumentation()
+
+_default_instrumentation = NULL_INSTRUMENTATION
+
+def set_default_instrumentation(instrumentation):
+    """
+    sets the `Instrumentation` used by locks and handles which aren't
+    given one. None restores the default, which does nothing.
+    """
+    global _default_instrumentation
+    _default_instrumentation = instrumentation or NULL_INSTRUMENTATION
+
+def get_instrumentation(instrumentation=None):
+    """
+    returns `instrumentation`, or the default if it's None.
+    """
+    if instrumentation is None:
+        return _default_instrumentation
+    return instrumentation
@@ -1,13 +1,50 @@
 from __future__ import print_function
 import pickle
+import struct
 from pylocks.errors import SerializationError
 
+# Lease values start with a small header so that server-side scripts
+# can compare lease IDs without decoding the rest of the value:
+#
+#   byte 0       format version (always < 0x80, which starts a pickle)
+#   byte 1       length of the lease ID in bytes
+#   bytes 2..    the lease ID, followed by the payload
+#
+FRAMED_PICKLE_VERSION = 1
+
+_HEADER = struct.Struct('>BB')
+
 def serialize_impl(x):
     return pickle.dumps(x, 2)
 
 def deserialize_impl(x):
     return pickle.loads(x)
 
+def to_bytes(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+def frame(lease_id, payload, version=FRAMED_PICKLE_VERSION):
+    lease_id = to_bytes(lease_id)
+    if len(lease_id) > 255:
+        raise SerializationError('lease id is too long: %r' % lease_id)
+    return _HEADER.pack(version, len(lease_id)) + lease_id + payload
+
+def is_framed(data):
+    return len(data) >= _HEADER.size and _HEADER.unpack_from(data)[0] < 0x80
+
+def read_frame(data):
+    """
+    returns a tuple of (version, lease_id, payload) for a framed value.
+    """
+    if not is_framed(data):
+        raise SerializationError(data)
+    version, id_length = _HEADER.unpack_from(data)
+    id_end = _HEADER.size + id_length
+    lease_id = data[_HEADER.size:id_end].decode('utf-8')
+    return version, lease_id, data[id_end:]
+
 
 class Serializable(object):
     def serialize(self):
@@ -19,3 +56,31 @@ class Serializable(object):
         if not isinstance(instance, cls):
             raise SerializationError(data)
         return instance
+
+
+class FramedSerializable(Serializable):
+    """
+    A `Serializable` whose serialized form is framed with its `id`.
+
+    Unframed (plain pickle) values are still accepted by `deserialize`.
+    """
+    def serialize(self):
+        return frame(self.id, serialize_impl(self))
+
+    @classmethod
+    def read_id(cls, data):
+        """
+        returns the id of a serialized instance, decoding
+        as little of it as possible.
+        """
+        if is_framed(data):
+            return read_frame(data)[1]
+        return cls.deserialize(data).id
+
+    @classmethod
+    def deserialize(cls, data):
+        if is_framed(data):
+            version, _, data = read_frame(data)
+            if version != FRAMED_PICKLE_VERSION:
+                raise SerializationError(data)
+        return super(FramedSerializable, cls).deserialize(data)
@@ -0,0 +1,123 @@
+import asyncio
+import time
+import unittest
+import redis.asyncio
+from pylocks.aio import AsyncRedisLockFactory, AsyncLeaseHandle
+from pylocks.blocking import BlockingRedisLockFactory
+from pylocks.test.errors import BadNewsBears
+from pylocks.errors import LockAlreadyHeld, LockExpired, LockNotOwned
+
+
+class TestAsyncRedisLock(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        import redislite
+        self.r = redislite.StrictRedis()
+        self.lock_factory = AsyncRedisLockFactory(prefix='foo', ttl=60, arity=1)
+
+    async def asyncSetUp(self):
+        self.ar = redis.asyncio.Redis(unix_socket_path=self.r.socket_file)
+
+    async def asyncTearDown(self):
+        await self.ar.aclose()
+
+    def make_lock(self):
+        return self.lock_factory.build(redis_conn=self.ar)
+
+    async def test_already_locked(self):
+        lock = self.make_lock()
+        handle = await lock.acquire('x')
+        self.assertTrue(isinstance(handle, AsyncLeaseHandle))
+        with self.assertRaises(LockAlreadyHeld):
+            await lock.acquire('x')
+        await handle.release()
+        handle_2 = await lock.acquire('x')
+        await handle_2.check_if_owned()
+        self.assertTrue(await lock.is_held('x'))
+
+    async def test_handle_still_holding(self):
+        lock = self.make_lock()
+        handle = await lock.acquire('x')
+        self.assertTrue(await handle.do_i_still_have_lock())
+        self.r.delete(lock.make_key('x'))
+        self.assertFalse(await handle.do_i_still_have_lock())
+        with self.assertRaises(LockNotOwned):
+            await handle.check_if_owned()
+        with self.assertRaises(LockNotOwned):
+            await handle.release()
+        self.assertFalse(await handle.release(ignore_failure=True))
+
+    async def test_releasing(self):
+        lock = self.make_lock()
+        handle = await lock.acquire('x')
+        with self.assertRaises(BadNewsBears):
+            async with handle.releasing():
+                raise BadNewsBears()
+        self.assertFalse(await lock.is_held('x'))
+
+    async def test_extend(self):
+        lock = self.make_lock()
+        handle = await lock.acquire('x')
+        await handle.extend(600)
+        self.assertTrue(self.r.pttl(lock.make_key('x')) > 60000)
+
+    async def test_macquire(self):
+        lock = self.make_lock()
+        await lock.acquire('y')
+        handles, missing = await lock.macquire(['x', 'y', 'z'])
+        self.assertEqual(['y'], missing)
+        self.assertEqual({'x', 'z'}, set(handles.keys()))
+        self.assertTrue(handles['x'].fence > 0)
+        handles, missing = await lock.macquire(['w', 'x'], atomic=True)
+        self.assertEqual({}, handles)
+        self.assertEqual(['x'], missing)
+        self.assertFalse(await lock.is_held('w'))
+
+    async def test_release_expected(self):
+        lock = self.make_lock()
+        handles, _ = await lock.macquire(['x', 'y'])
+        with self.assertRaises(LockNotOwned):
+            await lock.release_expected('x', 'not right!')
+        await lock.release_expected('x', handles['x'].id)
+        released, missing = await lock.mrelease_expected({
+            'x': handles['x'].id, 'y': handles['y'].id
+        })
+        self.assertEqual(['y'], released)
+        self.assertEqual(['x'], missing)
+
+    async def test_get_lease_handle(self):
+        lock = self.make_lock()
+        with self.assertRaises(LockExpired):
+            await lock.get_lease_handle('x', 'nope')
+        handle = await lock.acquire('x')
+        handle_2 = await lock.get_lease_handle('x', handle.id)
+        await handle_2.check_if_owned()
+        self.assertTrue(handle.fence > 0)
+        self.assertEqual(handle.fence, handle_2.fence)
+
+    async def test_acquire_wait(self):
+        lock = self.make_lock()
+        handle = await lock.acquire('x')
+
+        async def release_later():
+            await asyncio.sleep(0.2)
+            await handle.release()
+
+        releaser = asyncio.ensure_future(release_later())
+        start = time.time()
+        handle_2 = await lock.acquire('x', wait=5)
+        await releaser
+        self.assertTrue(time.time() - start < 2)
+        await handle_2.check_if_owned()
+        with self.assertRaises(LockAlreadyHeld):
+            await lock.acquire('x', wait=0.1)
+
+    async def test_shared_with_blocking_lock(self):
+        blocking_lock = BlockingRedisLockFactory(prefix='foo', ttl=60, arity=1).build(redis_conn=self.r)
+        lock = self.make_lock()
+        blocking_handle = blocking_lock.acquire('x')
+        with self.assertRaises(LockAlreadyHeld):
+            await lock.acquire('x')
+        handle = await lock.get_lease_handle('x', blocking_handle.id)
+        await handle.release()
+        handle = await lock.acquire('x')
+        blocking_lock.release_expected('x', handle.id)
@@ -1,8 +1,10 @@
 import time
 import unittest
+import redis
 from pylocks.errors import LockAlreadyHeld, LockNotOwned
 from pylocks.blocking.blocking_redis_lease_handle import BlockingRedisLeaseHandle
 from pylocks.blocking.base_blocking_redis_lock import BaseBlockingRedisLock
+from pylocks.core import scripts
 from pylocks.core.lock_request import LockRequest
 
 class TestBaseBlockingRedisLock(unittest.TestCase):
@@ -92,3 +94,99 @@ class TestBaseBlockingRedisLock(unittest.TestCase):
         lock.acquire(self.make_request('x'))
         self.assertTrue(lock.is_held('x'))
 
+    def test_already_held_reports_remaining_ttl(self):
+        lock = self.make_lock()
+        lock.acquire(self.make_request('x', ttl=20))
+        with self.assertRaises(LockAlreadyHeld) as ctx:
+            lock.acquire(self.make_request('x', ttl=20))
+        self.assertEqual('x', ctx.exception.key)
+        self.assertTrue(0 < ctx.exception.remaining_ttl <= 20)
+
+    def test_failed_acquire_leaves_no_extra_keys(self):
+        lock = self.make_lock()
+        lock.acquire(self.make_request('x'))
+        for _ in range(5):
+            with self.assertRaises(LockAlreadyHeld):
+                lock.acquire(self.make_request('x'))
+        lock.macquire(list(map(self.make_request, ['x', 'y'])))
+        # besides the fencing token counters of the locks which were taken
+        self.assertEqual(
+            {b'x', b'y', scripts.fence_key('x'), scripts.fence_key('y')}, set(self.r.keys('*'))
+        )
+
+    def test_fencing_tokens(self):
+        lock = self.make_lock()
+        first = lock.acquire(self.make_request('x'))
+        self.assertTrue(first.fence > 0)
+        first.release()
+        second = lock.acquire(self.make_request('x'))
+        self.assertEqual(first.fence + 1, second.fence)
+        self.assertEqual(second.fence, lock.get_lease_handle('x', second.id).fence)
+        lock.release_hard('x')
+        handles, _ = lock.macquire(list(map(self.make_request, ['x', 'y'])))
+        fences = dict((req.key, h.fence) for req, h in handles.items())
+        self.assertEqual(second.fence + 1, fences['x'])
+        self.assertTrue(fences['y'] > 0)
+        with self.assertRaises(LockAlreadyHeld):
+            lock.acquire(self.make_request('x'))
+        lock.release_hard('x')
+        handles, _ = lock.macquire([self.make_request('x'), self.make_request('z')], atomic=True)
+        self.assertEqual(second.fence + 2, dict((req.key, h.fence) for req, h in handles.items())['x'])
+
+    def test_fencing_tokens_outlive_their_counter(self):
+        lock = self.make_lock()
+        first = lock.acquire(self.make_request('x', ttl=20))
+        self.assertTrue(19000 < self.r.pttl(scripts.fence_key('x')) <= 20000)
+        first.release()
+        self.r.delete(scripts.fence_key('x'))
+        self.assertTrue(lock.acquire(self.make_request('x')).fence > first.fence)
+
+    def test_extend_keeps_the_fence_counter(self):
+        lock = self.make_lock()
+        handle = lock.acquire(self.make_request('x', ttl=0.3))
+        handle.extend(20)
+        time.sleep(0.4)
+        self.assertTrue(19000 < self.r.pttl(scripts.fence_key('x')) <= 20000)
+        self.assertEqual(handle.fence, lock.get_lease_handle('x', handle.id).fence)
+
+    def test_fence_counters_dont_collide_with_locks(self):
+        lock = self.make_lock()
+        lock.acquire(self.make_request('x:fence'))
+        self.assertTrue(lock.acquire(self.make_request('x')).fence > 0)
+
+    def test_fence_error_leaves_lock_free(self):
+        lock = self.make_lock()
+        self.r.set(scripts.fence_key('x'), b'not a number')
+        with self.assertRaises(redis.ResponseError):
+            lock.acquire(self.make_request('x'))
+        self.assertFalse(lock.is_held('x'))
+
+    def test_acquire_sets_ttl(self):
+        lock = self.make_lock()
+        lock.acquire(self.make_request('x', ttl=20))
+        self.assertTrue(19000 < self.r.pttl('x') <= 20000)
+
+    def test_mrelease_expected(self):
+        lock = self.make_lock()
+        reqs = list(map(self.make_request, ['x', 'y', 'z']))
+        handles, _ = lock.macquire(reqs)
+        keys_to_ids = dict((req.key, handles[req].id) for req in reqs)
+        keys_to_ids['y'] = 'not right!'
+        released, missing = lock.mrelease_expected(keys_to_ids)
+        self.assertEqual({'x', 'z'}, set(released))
+        self.assertEqual(['y'], missing)
+        self.assertEqual([b'y'], self.r.keys('?'))
+
+    def test_macquire_atomic(self):
+        lock = self.make_lock()
+        lock.acquire(self.make_request('y'))
+        reqs = list(map(self.make_request, ['x', 'y', 'z']))
+        handles, missing = lock.macquire(reqs, atomic=True)
+        self.assertEqual({}, handles)
+        self.assertEqual(['y'], [m.key for m in missing])
+        self.assertEqual({b'y', scripts.fence_key('y')}, set(self.r.keys('*')))
+        lock.release_hard('y')
+        handles, missing = lock.macquire(reqs, atomic=True)
+        self.assertEqual([], missing)
+        self.assertEqual({'x', 'y', 'z'}, set([h.key for h in handles.keys()]))
+        self.assertTrue(19000 < self.r.pttl('z') <= 20000)
@@ -0,0 +1,101 @@
+import threading
+from pylocks.test.redis_test import RedisTest
+from pylocks.blocking.batcher import LockBatcher
+from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
+from pylocks.core import scripts
+from pylocks.errors import LockAlreadyHeld, LockNotOwned
+
+
+class TestLockBatcher(RedisTest):
+    def setUp(self):
+        super(TestLockBatcher, self).setUp()
+        self.factory = BlockingRedisLockFactory(prefix='foo', ttl=5, arity=1, batch_window=0.05)
+        self.lock = self.factory.build(self.r)
+        self.batcher = self.factory.get_batcher(self.r)
+
+    def tearDown(self):
+        self.batcher.stop()
+
+    def test_acquire_and_release(self):
+        handle = self.lock.acquire('x')
+        first_fence = handle.fence
+        with self.assertRaises(LockAlreadyHeld) as ctx:
+            self.lock.acquire('x')
+        self.assertTrue(0 < ctx.exception.remaining_ttl <= 5)
+        handle.release()
+        self.assertFalse(self.lock.is_held('x'))
+        with self.assertRaises(LockNotOwned):
+            handle.release()
+        handle = self.lock.acquire('x')
+        self.assertEqual(first_fence + 1, handle.fence)
+        self.lock.release_expected('x', handle.id)
+        self.assertFalse(self.lock.is_held('x'))
+
+    def test_many_threads_share_round_trips(self):
+        barrier = threading.Barrier(64)
+        handles = {}
+
+        def acquire_and_release(i):
+            barrier.wait()
+            handles[i] = self.lock.acquire(str(i))
+            handles[i].check_if_owned()
+            barrier.wait()
+            handles[i].release()
+        threads = [threading.Thread(target=acquire_and_release, args=(i,)) for i in range(64)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(64, len(set(handle.id for handle in handles.values())))
+        self.assertFalse(any(self.lock.is_held(str(i)) for i in range(64)))
+        # 64 acquires and 64 releases in a handful of pipelines
+        self.assertTrue(self.batcher.round_trips <= 8, self.batcher.round_trips)
+
+    def test_release_goes_first(self):
+        self.batcher.window = 0.2
+        handle = self.lock.acquire('x')
+        results = []
+        releasing = threading.Thread(
+            target=lambda: results.append(self.batcher.release(handle.key, handle.id))
+        )
+        releasing.start()
+        next_handle = self.lock.acquire('x')
+        releasing.join()
+        self.assertEqual([scripts.RELEASED], results)
+        next_handle.check_if_owned()
+
+    def test_reloads_scripts(self):
+        self.lock.acquire('x')
+        self.r.script_flush()
+        with self.assertRaises(LockAlreadyHeld):
+            self.lock.acquire('x')
+
+    def test_reloads_only_missing_scripts(self):
+        # one script cached, the other flushed: the one which ran
+        # mustn't run again when the other is retried
+        self.batcher.window = 0.2
+        for cached in (scripts.ACQUIRE, scripts.RELEASE):
+            handle = self.lock.acquire('x')
+            self.r.script_flush()
+            self.r.script_load(cached)
+            results = []
+            releasing = threading.Thread(
+                target=lambda: results.append(self.batcher.release(handle.key, handle.id))
+            )
+            releasing.start()
+            acquired = self.lock.acquire('y')
+            releasing.join()
+            self.assertEqual([scripts.RELEASED], results)
+            acquired.check_if_owned()
+            acquired.release()
+
+    def test_errors_reach_callers(self):
+        batcher = LockBatcher(self.r)
+        self.r.lpush('y', 'not a lease')
+        with self.assertRaises(Exception):
+            batcher.release('y', 'some id')
+        batcher.stop()
+
+    def test_one_batcher_per_connection(self):
+        self.assertIs(self.batcher, self.factory.build(self.r).base_lock.batcher)
+        self.assertIsNone(BlockingRedisLockFactory(prefix='foo', ttl=5, arity=1).get_batcher(self.r))
@@ -1,3 +1,4 @@
+import pickle
 import time
 
 from pylocks.test.redis_test import RedisTest
@@ -101,6 +102,23 @@ class TestBlockingRedisLeaseHandle(TestBase):
             with handle.releasing(ignore_failure=True):
                 raise BadNewsBears
 
+    def test_release_mismatched_id_keeps_lock(self):
+        handle = self.lock.acquire(make_handle_data('foo', 'x').request)
+        handle.handle_data.id = 'bad!'
+        with self.assertRaises(LockNotOwned):
+            handle.release()
+        self.assertFalse(handle.release(ignore_failure=True))
+        self.assertTrue(self.lock.is_held('foo'))
+
+    def test_release_unframed_value(self):
+        handle = self.make_handle('foo', 'some-handle-id')
+        self.r.set('foo', pickle.dumps(handle.handle_data, 2))
+        handle.check_if_owned()
+        self.assertTrue(handle.release())
+        self.assertFalse(self.lock.is_held('foo'))
+        with self.assertRaises(LockNotOwned):
+            handle.release()
+
 
 class TestGetHandle(TestBase):
     def test_get_lease_handle_1(self):
@@ -118,3 +136,24 @@ class TestGetHandle(TestBase):
         handle.check_if_owned()
         handle2 = BlockingRedisLeaseHandle.get_lease_handle('foo', handle.id, self.r)
         handle2.check_if_owned()
+
+
+class TestExtend(TestBase):
+    def test_extend(self):
+        handle = self.lock.acquire(make_handle_data('foo', 'x', ttl=5).request)
+        self.assertTrue(self.r.pttl('foo') <= 5000)
+        handle.extend(30)
+        self.assertTrue(self.r.pttl('foo') > 5000)
+        handle.extend()
+        self.assertTrue(self.r.pttl('foo') <= 5000)
+
+    def test_extend_not_owned(self):
+        handle = self.lock.acquire(make_handle_data('foo', 'x', ttl=5).request)
+        self.r.delete('foo')
+        with self.assertRaises(LockExpired):
+            handle.extend(30)
+        handle2 = self.lock.acquire(make_handle_data('foo', 'x', ttl=5).request)
+        with self.assertRaises(LockExpired):
+            handle.extend(30)
+        self.assertTrue(self.r.pttl('foo') <= 5000)
+        handle2.check_if_owned()
@@ -1,7 +1,10 @@
+import pickle
+import threading
+import time
 import unittest
 from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
 from pylocks.blocking.blocking_redis_lease_handle import BlockingRedisLeaseHandle
-from pylocks.errors import LockAlreadyHeld, LockNotOwned
+from pylocks.errors import InvalidLeaseToken, LockAlreadyHeld, LockNotOwned
 
 
 class TestBlockingRedisLock(unittest.TestCase):
@@ -87,3 +90,158 @@ class TestBlockingRedisLock(unittest.TestCase):
         lock.acquire('x')
         self.assertTrue(lock.is_held('x'))
 
+    def test_release_expected(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        with self.assertRaises(LockNotOwned):
+            lock.release_expected('x', 'not right!')
+        self.assertTrue(lock.is_held('x'))
+        lock.release_expected('x', handle.id)
+        self.assertFalse(lock.is_held('x'))
+        with self.assertRaises(LockNotOwned):
+            lock.release_expected('x', handle.id)
+
+    def test_mrelease_expected(self):
+        lock = self.make_lock()
+        handles, _ = lock.macquire(['x', 'y', 'z'])
+        released, missing = lock.mrelease_expected({
+            'x': handles['x'].id,
+            'y': 'not right!',
+            'z': handles['z'].id,
+            'w': handles['x'].id
+        })
+        self.assertEqual({'x', 'z'}, set(released))
+        self.assertEqual({'y', 'w'}, set(missing))
+        self.assertFalse(lock.is_held('x'))
+        self.assertTrue(lock.is_held('y'))
+        self.assertFalse(lock.is_held('z'))
+
+    def test_macquire_atomic_1(self):
+        lock = self.make_lock()
+        handles, missing = lock.macquire(['x', 'y', 'z'], atomic=True)
+        self.assertEqual([], missing)
+        self.assertEqual({'x', 'y', 'z'}, set(handles.keys()))
+        for handle in handles.values():
+            handle.check_if_owned()
+
+    def test_macquire_atomic_2(self):
+        lock = self.make_lock()
+        lock.acquire('y')
+        handles, missing = lock.macquire(['x', 'y', 'z'], atomic=True)
+        self.assertEqual({}, handles)
+        self.assertEqual(['y'], missing)
+        self.assertFalse(lock.is_held('x'))
+        self.assertFalse(lock.is_held('z'))
+
+    def test_pickle_codec(self):
+        pickle_lock = BlockingRedisLockFactory(
+            prefix='foo', ttl=60, arity=1, codec='pickle'
+        ).build(redis_conn=self.r)
+        handle = pickle_lock.acquire('x')
+        self.assertEqual(b'\x01', self.r.get(handle.key)[:1])
+        lock = self.make_lock()
+        handle_2 = lock.get_lease_handle('x', handle.id)
+        handle_2.check_if_owned()
+        lock.release_expected('x', handle.id)
+        self.assertFalse(lock.is_held('x'))
+
+    def test_acquire_wait_for_release(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        releaser = threading.Timer(0.2, handle.release)
+        releaser.start()
+        start = time.time()
+        handle_2 = lock.acquire('x', wait=5)
+        elapsed = time.time() - start
+        releaser.join()
+        handle_2.check_if_owned()
+        self.assertTrue(0.1 < elapsed < 2, elapsed)
+
+    def test_acquire_wait_for_expiry(self):
+        lock = BlockingRedisLockFactory(prefix='foo', ttl=0.3, arity=1).build(redis_conn=self.r)
+        lock.acquire('x')
+        start = time.time()
+        handle = lock.acquire('x', wait=5)
+        elapsed = time.time() - start
+        handle.check_if_owned()
+        self.assertTrue(elapsed < 2, elapsed)
+
+    def test_acquire_wait_timeout(self):
+        lock = self.make_lock()
+        lock.acquire('x')
+        start = time.time()
+        with self.assertRaises(LockAlreadyHeld) as ctx:
+            lock.acquire('x', wait=0.2)
+        self.assertTrue(0.2 <= time.time() - start < 2)
+        self.assertTrue(ctx.exception.remaining_ttl > 50)
+
+    def test_acquire_wait_release_hard(self):
+        lock = self.make_lock()
+        lock.acquire('x')
+        releaser = threading.Timer(0.2, lambda: lock.release_hard('x'))
+        releaser.start()
+        lock.acquire('x', wait=5).check_if_owned()
+        releaser.join()
+
+    def test_local_checks(self):
+        lock = BlockingRedisLockFactory(
+            prefix='foo', ttl=60, arity=1, local_check_margin=1
+        ).build(redis_conn=self.r)
+        handle = lock.acquire('x')
+        self.r.delete(lock.make_key('x'))
+        self.assertTrue(handle.do_i_still_have_lock())
+        handle.check_if_owned()
+        self.assertEqual(2, handle.local_checks)
+        self.assertEqual(0, handle.remote_checks)
+        handle.release(ignore_failure=True)
+        self.assertFalse(handle.do_i_still_have_lock())
+        self.assertEqual(0, handle.remote_checks)
+
+    def test_local_checks_near_expiry(self):
+        lock = BlockingRedisLockFactory(
+            prefix='foo', ttl=1, arity=1, local_check_margin=0.5
+        ).build(redis_conn=self.r)
+        handle = lock.acquire('x')
+        self.assertTrue(handle.do_i_still_have_lock())
+        self.assertEqual(1, handle.local_checks)
+        time.sleep(0.6)
+        self.assertTrue(handle.do_i_still_have_lock())
+        self.assertEqual(1, handle.remote_checks)
+        handle.extend(10)
+        self.assertTrue(handle.do_i_still_have_lock())
+        self.assertEqual(2, handle.local_checks)
+
+    def test_local_checks_off_by_default(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        self.assertTrue(handle.do_i_still_have_lock())
+        self.assertEqual(0, handle.local_checks)
+        self.assertEqual(1, handle.remote_checks)
+
+    def test_lease_tokens(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        token = handle.to_token(secret='s3cret')
+        rebuilt = lock.handle_from_token(token, secret='s3cret')
+        self.assertEqual(handle.id, rebuilt.id)
+        self.assertEqual(handle.fence, rebuilt.fence)
+        self.assertTrue(rebuilt.do_i_still_have_lock())
+        rebuilt.release()
+        self.assertFalse(handle.do_i_still_have_lock())
+        with self.assertRaises(InvalidLeaseToken):
+            lock.handle_from_token(token, secret='other')
+        other = BlockingRedisLockFactory(prefix='bar', ttl=60, arity=1).build(self.r)
+        with self.assertRaises(InvalidLeaseToken):
+            other.handle_from_token(token)
+
+    def test_pickled_handles(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        data = pickle.dumps(handle)
+        self.assertNotIn(b'redislite', data)
+        unpickled = pickle.loads(data)
+        self.assertEqual(None, unpickled.redis_conn)
+        self.assertEqual(handle.id, unpickled.id)
+        lock.attach(unpickled).check_if_owned()
+        unpickled.release()
+        self.assertFalse(lock.is_held('x'))
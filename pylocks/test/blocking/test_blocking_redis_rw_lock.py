@@ -0,0 +1,137 @@
+import threading
+import time
+from pylocks.blocking.blocking_redis_rw_lock import BlockingRedisRWLockFactory
+from pylocks.blocking.shared_lease_handle import SharedLeaseHandle
+from pylocks.core.scripts import holder_keys, writer_key
+from pylocks.errors import LockAlreadyHeld, LockExpired, LockNotOwned
+from pylocks.test.redis_test import RedisTest
+
+
+class TestBlockingRedisRWLock(RedisTest):
+    def setUp(self):
+        super(TestBlockingRedisRWLock, self).setUp()
+        self.lock = BlockingRedisRWLockFactory(prefix='foo', ttl=5, arity=1).build(self.r)
+
+    def test_shared_leases(self):
+        first = self.lock.acquire_shared('x')
+        second = self.lock.acquire_shared('x')
+        self.assertNotEqual(first.id, second.id)
+        self.assertTrue(self.lock.is_held('x'))
+        with self.assertRaises(LockAlreadyHeld) as ctx:
+            self.lock.acquire('x')
+        self.assertTrue(4 < ctx.exception.remaining_ttl <= 5)
+        first.check_if_owned()
+        first.release()
+        self.assertFalse(first.do_i_still_have_lock())
+        second.check_if_owned()
+        with self.assertRaises(LockNotOwned):
+            first.release()
+        second.release()
+        self.assertFalse(self.lock.is_held('x'))
+        self.assertEqual(0, self.r.exists(*holder_keys(self.lock.make_key('x'))))
+        self.lock.acquire('x')
+
+    def test_exclusive_lease(self):
+        handle = self.lock.acquire('x')
+        with self.assertRaises(LockAlreadyHeld):
+            self.lock.acquire_shared('x')
+        with self.assertRaises(LockAlreadyHeld):
+            self.lock.acquire('x')
+        handle.extend(10)
+        handle.release()
+        shared = self.lock.acquire_shared('x')
+        shared.check_if_owned()
+        self.assertEqual(None, shared.fence)
+        shared.release()
+        self.assertEqual(handle.fence + 1, self.lock.acquire('x').fence)
+
+    def test_lease_tokens(self):
+        shared = self.lock.acquire_shared('x')
+        other = self.lock.acquire_shared('x')
+        rebuilt = self.lock.shared_handle_from_token(shared.to_token(secret='s'), secret='s')
+        self.assertTrue(isinstance(rebuilt, SharedLeaseHandle))
+        self.assertEqual(shared.id, rebuilt.id)
+        rebuilt.check_if_owned()
+        rebuilt.release()
+        self.assertFalse(shared.do_i_still_have_lock())
+        other.check_if_owned()
+        other.release()
+
+        handle = self.lock.acquire('x')
+        rebuilt = self.lock.handle_from_token(handle.to_token())
+        self.assertFalse(isinstance(rebuilt, SharedLeaseHandle))
+        rebuilt.release()
+        self.assertFalse(self.lock.is_held('x'))
+
+    def test_shared_leases_expire_on_their_own(self):
+        short = BlockingRedisRWLockFactory(prefix='foo', ttl=0.2, arity=1).build(self.r)
+        short.acquire_shared('x')
+        held = self.lock.acquire_shared('x')
+        time.sleep(0.3)
+        held.check_if_owned()
+        held.extend(0.2)
+        with self.assertRaises(LockAlreadyHeld):
+            self.lock.acquire('x')
+        self.lock.acquire('x', wait=2).check_if_owned()
+        with self.assertRaises(LockExpired):
+            held.extend()
+
+    def test_writer_priority(self):
+        reader = self.lock.acquire_shared('x')
+        writer = []
+        thread = threading.Thread(
+            target=lambda: writer.append(self.lock.acquire('x', wait=5, priority=True))
+        )
+        thread.start()
+        time.sleep(0.2)
+        self.assertTrue(self.r.exists(writer_key(self.lock.make_key('x'))))
+        with self.assertRaises(LockAlreadyHeld):
+            self.lock.acquire_shared('x')
+        reader.release()
+        thread.join()
+        writer[0].check_if_owned()
+        self.assertFalse(self.r.exists(writer_key(self.lock.make_key('x'))))
+        readers = []
+        thread = threading.Thread(
+            target=lambda: readers.append(self.lock.acquire_shared('x', wait=5))
+        )
+        thread.start()
+        writer[0].release()
+        thread.join()
+        readers[0].check_if_owned()
+
+    def test_macquire_shared(self):
+        self.lock.acquire('y')
+        locked, missing = self.lock.macquire_shared(['x', 'y', 'z'])
+        self.assertEqual(set(['x', 'z']), set(locked))
+        self.assertEqual(['y'], missing)
+        self.assertEqual(({}, ['y']), self.lock.macquire_shared(['w', 'y'], atomic=True))
+        self.assertFalse(self.lock.is_held('w'))
+        self.assertEqual(({}, ['x']), self.lock.macquire(['w', 'x'], atomic=True))
+        released, missing = self.lock.mrelease_shared(
+            dict((args_list, handle.id) for args_list, handle in locked.items())
+        )
+        self.assertEqual(set(['x', 'z']), set(released))
+        locked, missing = self.lock.macquire(['w', 'x'], atomic=True)
+        self.assertEqual(set(['w', 'x']), set(locked))
+
+    def test_get_shared_lease_handle(self):
+        handle = self.lock.acquire_shared('x')
+        existing = self.lock.get_shared_lease_handle('x', handle.id)
+        self.assertEqual(handle.id, existing.id)
+        existing.check_if_owned()
+        self.lock.release_shared('x', handle.id)
+        with self.assertRaises(LockExpired):
+            self.lock.get_shared_lease_handle('x', handle.id)
+
+    def test_release_hard(self):
+        self.lock.acquire_shared('x')
+        self.lock.release_hard('x')
+        self.assertFalse(self.lock.is_held('x'))
+        with self.assertRaises(LockNotOwned):
+            self.lock.release_hard('x')
+
+    def test_mis_held(self):
+        self.lock.acquire('x')
+        self.lock.acquire_shared('y')
+        self.assertEqual([True, True, False], self.lock.mis_held(['x', 'y', 'z']))
@@ -0,0 +1,81 @@
+import threading
+import time
+from pylocks.blocking.blocking_redis_semaphore import BlockingRedisSemaphoreFactory
+from pylocks.blocking.shared_lease_handle import SharedLeaseHandle
+from pylocks.errors import LockAlreadyHeld, LockExpired, LockNotOwned
+from pylocks.test.redis_test import RedisTest
+
+
+class TestBlockingRedisSemaphore(RedisTest):
+    def setUp(self):
+        super(TestBlockingRedisSemaphore, self).setUp()
+        self.factory = BlockingRedisSemaphoreFactory(prefix='api', ttl=5, arity=1, limit=3)
+        self.semaphore = self.factory.build(self.r)
+
+    def test_limit(self):
+        handles = [self.semaphore.acquire('x') for _ in range(3)]
+        self.assertEqual(3, len(set(handle.id for handle in handles)))
+        self.assertEqual(3, self.semaphore.count('x'))
+        with self.assertRaises(LockAlreadyHeld) as ctx:
+            self.semaphore.acquire('x')
+        self.assertTrue(4 < ctx.exception.remaining_ttl <= 5)
+        self.semaphore.acquire('y').check_if_owned()
+        handles[1].check_if_owned()
+        handles[1].release()
+        with self.assertRaises(LockNotOwned):
+            handles[1].release()
+        self.semaphore.acquire('x').check_if_owned()
+
+    def test_expired_leases_are_reclaimed(self):
+        short = BlockingRedisSemaphoreFactory(prefix='api', ttl=0.2, arity=1, limit=3).build(self.r)
+        expiring = [short.acquire('x') for _ in range(2)]
+        kept = self.semaphore.acquire('x')
+        with self.assertRaises(LockAlreadyHeld):
+            self.semaphore.acquire('x')
+        time.sleep(0.3)
+        self.assertEqual(1, self.semaphore.count('x'))
+        self.semaphore.acquire('x')
+        self.semaphore.acquire('x')
+        kept.extend(10)
+        with self.assertRaises(LockExpired):
+            expiring[0].extend()
+
+    def test_wait(self):
+        handles = [self.semaphore.acquire('x') for _ in range(3)]
+        timer = threading.Timer(0.1, handles[0].release)
+        timer.start()
+        started_at = time.time()
+        self.semaphore.acquire('x', wait=3).check_if_owned()
+        self.assertTrue(time.time() - started_at < 2)
+        timer.join()
+        with self.assertRaises(LockAlreadyHeld):
+            self.semaphore.acquire('x', wait=0.1)
+
+    def test_macquire(self):
+        for _ in range(3):
+            self.semaphore.acquire('y')
+        locked, missing = self.semaphore.macquire(['x', 'y', 'z'])
+        self.assertEqual(set(['x', 'z']), set(locked))
+        self.assertEqual(['y'], missing)
+        released, missing = self.semaphore.mrelease_expected(
+            dict((args_list, handle.id) for args_list, handle in locked.items())
+        )
+        self.assertEqual(set(['x', 'z']), set(released))
+        self.assertEqual([], missing)
+        self.assertFalse(self.semaphore.is_held('x'))
+
+    def test_get_lease_handle_and_release_hard(self):
+        handle = self.semaphore.acquire('x')
+        self.assertEqual(handle.id, self.semaphore.get_lease_handle('x', handle.id).id)
+        self.semaphore.release_hard('x')
+        with self.assertRaises(LockExpired):
+            self.semaphore.get_lease_handle('x', handle.id)
+        with self.assertRaises(LockNotOwned):
+            self.semaphore.release_expected('x', handle.id)
+
+    def test_lease_tokens(self):
+        handle = self.semaphore.acquire('x')
+        rebuilt = self.semaphore.handle_from_token(handle.to_token())
+        self.assertTrue(isinstance(rebuilt, SharedLeaseHandle))
+        rebuilt.release()
+        self.assertEqual(0, self.semaphore.count('x'))
@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+from pylocks.blocking.fair_blocking_redis_lock import FairBlockingRedisLockFactory
+from pylocks.core.scripts import queue_keys
+from pylocks.errors import LockAlreadyHeld
+
+
+class TestFairBlockingRedisLock(unittest.TestCase):
+    def setUp(self):
+        import redislite
+        self.r = redislite.StrictRedis()
+        self.lock_factory = FairBlockingRedisLockFactory(
+            prefix='foo', ttl=60, arity=1
+        )
+
+    def make_lock(self):
+        return self.lock_factory.build(redis_conn=self.r)
+
+    def test_acquire(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        with self.assertRaises(LockAlreadyHeld):
+            lock.acquire('x')
+        handle.release()
+        second = lock.acquire('x')
+        second.check_if_owned()
+        self.assertEqual(handle.fence + 1, second.fence)
+
+    def test_waiters_served_in_order(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        order = []
+
+        def wait_for_lock(i):
+            waiting_handle = self.make_lock().acquire('x', wait=10)
+            order.append(i)
+            time.sleep(0.05)
+            waiting_handle.release()
+
+        threads = []
+        for i in range(4):
+            thread = threading.Thread(target=wait_for_lock, args=(i,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.1)
+        handle.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([0, 1, 2, 3], order)
+
+    def test_queued_waiter_blocks_newcomers(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        queue, deadlines, _ = queue_keys(lock.make_key('x'))
+        self.r.zadd(queue, {'someone': 1})
+        self.r.zadd(deadlines, {'someone': (time.time() + 30) * 1000})
+        handle.release()
+        with self.assertRaises(LockAlreadyHeld):
+            lock.acquire('x')
+
+    def test_timed_out_waiter_leaves_queue(self):
+        lock = self.make_lock()
+        handle = lock.acquire('x')
+        with self.assertRaises(LockAlreadyHeld):
+            lock.acquire('x', wait=0.2)
+        handle.release()
+        lock.acquire('x').check_if_owned()
+        queue, _, _ = queue_keys(lock.make_key('x'))
+        self.assertEqual(0, self.r.zcard(queue))
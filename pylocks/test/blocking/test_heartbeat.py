@@ -0,0 +1,87 @@
+import time
+from pylocks.test.redis_test import RedisTest
+from pylocks.blocking.base_blocking_redis_lock import BaseBlockingRedisLock
+from pylocks.blocking.blocking_redis_semaphore import BlockingRedisSemaphoreFactory
+from pylocks.blocking.heartbeat import LeaseHeartbeat, get_heartbeat
+from pylocks.core.lock_request import LockRequest
+
+class TestLeaseHeartbeat(RedisTest):
+    def setUp(self):
+        super(TestLeaseHeartbeat, self).setUp()
+        self.lock = BaseBlockingRedisLock(redis_conn=self.r)
+
+    def acquire(self, key, ttl):
+        return self.lock.acquire(LockRequest(
+            key=key, request_time=time.time(), initial_ttl=ttl,
+            lock_arity=1, lock_prefix='lock', root_prefix='test'
+        ))
+
+    def test_tick(self):
+        failures = []
+        heartbeat = LeaseHeartbeat(on_failure=failures.append)
+        x = self.acquire('x', ttl=5)
+        y = self.acquire('y', ttl=5)
+        heartbeat.register(x, ttl=30)
+        heartbeat.register(y, ttl=30)
+        self.r.delete('y')
+        heartbeat.tick()
+        self.assertTrue(self.r.pttl('x') > 5000)
+        self.assertFalse(heartbeat.has_failed(x))
+        self.assertTrue(heartbeat.has_failed(y))
+        self.assertEqual([y], failures)
+        heartbeat.unregister(x)
+        heartbeat.tick()
+        self.assertEqual([y], failures)
+        heartbeat.stop()
+
+    def test_stale_handle_on_a_reacquired_key(self):
+        heartbeat = LeaseHeartbeat()
+        stale = self.acquire('x', ttl=5)
+        heartbeat.register(stale, ttl=30)
+        self.r.delete('x')
+        fresh = self.acquire('x', ttl=5)
+        heartbeat.register(fresh, ttl=30)
+        heartbeat.tick()
+        self.assertTrue(heartbeat.has_failed(stale))
+        self.assertFalse(heartbeat.has_failed(fresh))
+        self.assertTrue(self.r.pttl('x') > 5000)
+        fresh.check_if_owned()
+        heartbeat.stop()
+
+    def test_shared_leases(self):
+        heartbeat = LeaseHeartbeat()
+        semaphore = BlockingRedisSemaphoreFactory(prefix='sem', ttl=5, arity=1, limit=2).build(self.r)
+        shared = semaphore.acquire('x')
+        lost = semaphore.acquire('x')
+        exclusive = self.acquire('x', ttl=5)
+        for handle in (shared, lost, exclusive):
+            heartbeat.register(handle, ttl=30)
+        lost.release()
+        heartbeat.tick()
+        self.assertFalse(heartbeat.has_failed(shared))
+        self.assertFalse(heartbeat.has_failed(exclusive))
+        self.assertTrue(heartbeat.has_failed(lost))
+        self.assertTrue(self.r.zscore(shared.key + ':holders', shared.id) > time.time() * 1000 + 5000)
+        shared.check_if_owned()
+        heartbeat.stop()
+
+    def test_rejects_handles_it_cant_renew(self):
+        heartbeat = LeaseHeartbeat()
+        handle = self.acquire('x', ttl=5)
+        handle.redis_conn = None
+        with self.assertRaises(TypeError):
+            heartbeat.register(handle)
+        self.assertIsNone(heartbeat._thread)
+
+    def test_thread(self):
+        heartbeat = LeaseHeartbeat(interval=0.05)
+        handle = self.acquire('x', ttl=0.3)
+        heartbeat.register(handle)
+        time.sleep(0.6)
+        handle.check_if_owned()
+        heartbeat.stop()
+        time.sleep(0.6)
+        self.assertFalse(handle.do_i_still_have_lock())
+
+    def test_get_heartbeat(self):
+        self.assertIs(get_heartbeat(), get_heartbeat())
@@ -0,0 +1,90 @@
+import pickle
+import time
+import uuid
+from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
+from pylocks.blocking.fair_blocking_redis_lock import FairBlockingRedisLockFactory
+from pylocks.core.lock_lease_data import LockLeaseData
+from pylocks.test.redis_test import RedisTest
+
+
+class TestInventory(RedisTest):
+    def setUp(self):
+        super(TestInventory, self).setUp()
+        self.lock = BlockingRedisLockFactory(prefix='foo', ttl=60, arity=1).build(self.r)
+
+    def make_temp_key(self, args_list, lease_id=None):
+        # as acquires did before they were scripted: a plain pickle
+        # of the lease, under '<key>-<lease id>'
+        lease = LockLeaseData(
+            request=self.lock.settings.make_request(args_list),
+            id=str(uuid.uuid4()),
+            acquired_at=time.time()
+        )
+        key = '%s-%s' % (lease.key, lease_id or lease.id)
+        self.r.setex(key, 60, pickle.dumps(lease, 2))
+        return key
+
+    def test_scan_leases(self):
+        handles = dict((i, self.lock.acquire(str(i))) for i in range(25))
+        self.make_temp_key('0')
+        self.r.set('pylocks:foobar:x', b'not ours')
+        FairBlockingRedisLockFactory(prefix='foo', ttl=60, arity=1).build(self.r).acquire('fair')
+        BlockingRedisLockFactory(prefix='bar', ttl=60, arity=1).build(self.r).acquire('0')
+
+        leases = list(self.lock.scan_leases(batch_size=4))
+        by_key = dict((lease.request.key, (lease, ttl)) for lease, ttl in leases)
+        self.assertEqual(26, len(leases))
+        for i, handle in handles.items():
+            lease, ttl = by_key[self.lock.make_key(str(i))]
+            self.assertEqual(handle.id, lease.id)
+            self.assertTrue(59 < ttl <= 60)
+
+    def test_scan_is_lazy(self):
+        for i in range(10):
+            self.lock.acquire(str(i))
+        leases = self.lock.scan_leases(batch_size=2)
+        next(leases)
+        self.lock.release_hard('0')
+        self.lock.release_hard('9')
+        self.assertTrue(len(list(leases)) >= 7)
+
+    def test_reap_temp_keys(self):
+        handle = self.lock.acquire('x')
+        temp_keys = [self.make_temp_key(str(i)) for i in range(30)]
+        self.r.set('pylocks:foo:not-a-temp-key', b'kept')
+        self.assertEqual(30, self.lock.reap_temp_keys(batch_size=7, max_per_second=None))
+        self.assertEqual(0, self.r.exists(*temp_keys))
+        self.assertTrue(self.r.exists('pylocks:foo:not-a-temp-key'))
+        handle.check_if_owned()
+        self.assertEqual(0, self.lock.reap_temp_keys())
+
+    def test_reap_spares_keys_ending_in_a_uuid(self):
+        args_list = 'task-%s' % uuid.uuid4()
+        handle = self.lock.acquire(args_list)
+        other_lock = BlockingRedisLockFactory(prefix='foo', ttl=60, arity=2).build(self.r)
+        other_handle = other_lock.acquire(['a', 'task-%s' % uuid.uuid4()])
+        mislabelled = self.make_temp_key('0', lease_id=str(uuid.uuid4()))
+        self.assertEqual(0, self.lock.reap_temp_keys(max_per_second=None))
+        handle.check_if_owned()
+        other_handle.check_if_owned()
+        self.assertTrue(self.r.exists(mislabelled))
+        self.assertEqual([handle.id], [lease.id for lease, _ in self.lock.scan_leases()
+                                       if lease.key == handle.key])
+
+    def test_reap_legacy_multi_arg_keys(self):
+        # older formatters wrote the args list of multi-arg locks whole
+        lock = BlockingRedisLockFactory(prefix='pair', ttl=60, arity=2).build(self.r)
+        request = lock.settings.make_request(['x', 'y'])
+        request.key = "pylocks:pair:('x', 'y')"
+        lease = LockLeaseData(request=request, id=str(uuid.uuid4()), acquired_at=time.time())
+        key = '%s-%s' % (request.key, lease.id)
+        self.r.setex(key, 60, pickle.dumps(lease, 2))
+        self.assertEqual(1, lock.reap_temp_keys(max_per_second=None))
+        self.assertFalse(self.r.exists(key))
+
+    def test_reap_is_rate_limited(self):
+        for i in range(20):
+            self.make_temp_key(str(i))
+        started_at = time.time()
+        self.assertEqual(20, self.lock.reap_temp_keys(batch_size=5, max_per_second=100))
+        self.assertTrue(time.time() - started_at >= 0.15)
@@ -0,0 +1,115 @@
+import time
+from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
+from pylocks.blocking.blocking_redis_lease_handle import get_script
+from pylocks.blocking.blocking_redis_semaphore import BlockingRedisSemaphoreFactory
+from pylocks.blocking.lease_set import LeaseSet
+from pylocks.core import scripts
+from pylocks.errors import LockExpired
+from pylocks.instrumentation import InMemoryInstrumentation
+from pylocks.test.redis_test import RedisTest
+
+
+class TestLeaseSet(RedisTest):
+    def setUp(self):
+        super(TestLeaseSet, self).setUp()
+        self.instrumentation = InMemoryInstrumentation()
+        self.lock = BlockingRedisLockFactory(
+            prefix='foo', ttl=5, arity=1, instrumentation=self.instrumentation
+        ).build(self.r)
+        self.keys = [str(i) for i in range(100)]
+
+    def round_trips(self, name):
+        return self.instrumentation.snapshot()['operations']['foo'][name]['ok']['round_trips']
+
+    def test_check_all(self):
+        locked, _ = self.lock.macquire(self.keys)
+        leases = LeaseSet(locked)
+        self.assertEqual(100, len(leases))
+        self.assertEqual(locked['3'], leases['3'])
+        self.lock.release_hard('3')
+        self.lock.release_hard('4')
+        self.lock.acquire('4')
+        owned, lost = leases.check_all()
+        self.assertEqual(98, len(owned))
+        self.assertEqual(set(['3', '4']), set(lost))
+        self.assertEqual(98, len(leases))
+        self.assertFalse('3' in leases)
+        self.assertEqual(1, self.round_trips('check_all'))
+        with self.assertRaises(LockExpired):
+            locked['3'].check_if_owned()
+
+    def test_check_all_locally(self):
+        lock = BlockingRedisLockFactory(
+            prefix='foo', ttl=5, arity=1, local_check_margin=1
+        ).build(self.r)
+        locked, _ = lock.macquire(self.keys[:10])
+        leases = LeaseSet(locked)
+        self.assertEqual((10, 0), tuple(map(len, leases.check_all())))
+        self.assertEqual(0, sum(handle.remote_checks for handle in locked.values()))
+
+    def test_extend_all(self):
+        short = BlockingRedisLockFactory(prefix='foo', ttl=0.2, arity=1).build(self.r)
+        locked, _ = short.macquire(self.keys[:10])
+        leases = LeaseSet(locked)
+        short.release_hard('0')
+        extended, lost = leases.extend_all(10)
+        self.assertEqual(['0'], lost)
+        self.assertEqual(9, len(extended))
+        time.sleep(0.3)
+        self.assertEqual([False] + [True] * 9, short.mis_held(self.keys[:10]))
+
+    def test_release_all(self):
+        with LeaseSet(self.lock.macquire(self.keys)[0]) as leases:
+            self.assertTrue(all(self.lock.mis_held(self.keys)))
+        self.assertEqual(0, len(leases))
+        self.assertEqual([False] * 100, self.lock.mis_held(self.keys))
+        self.assertEqual(1, self.round_trips('release_all'))
+
+        locked, _ = self.lock.macquire(self.keys[:2])
+        self.lock.release_hard('1')
+        self.assertEqual((['0'], ['1']), LeaseSet(locked).release_all())
+
+    def test_handles_sharing_a_key(self):
+        stale = self.lock.acquire('0')
+        self.lock.release_hard('0')
+        fresh = self.lock.acquire('0')
+        leases = LeaseSet({'stale': stale, 'fresh': fresh})
+        self.assertEqual((['fresh'], ['stale']), leases.check_all())
+        self.assertEqual((['fresh'], []), leases.extend_all())
+        fresh.check_if_owned()
+
+        semaphore = BlockingRedisSemaphoreFactory(prefix='bar', ttl=5, arity=1, limit=2).build(self.r)
+        first, second = semaphore.acquire('0'), semaphore.acquire('0')
+        first.release()
+        leases = LeaseSet({'first': first, 'second': second})
+        self.assertEqual((['second'], ['first']), leases.extend_all())
+        self.assertEqual((['second'], []), leases.release_all())
+        self.assertEqual([False], semaphore.mis_held(['0']))
+
+    def test_mixed_handles(self):
+        semaphore = BlockingRedisSemaphoreFactory(prefix='bar', ttl=5, arity=1, limit=2).build(self.r)
+        handles = dict(self.lock.macquire(self.keys[:5])[0])
+        handles.update((('bar', args_list), handle)
+                       for args_list, handle in semaphore.macquire(self.keys[:5])[0].items())
+        leases = LeaseSet(handles)
+        semaphore.release_hard('0')
+        owned, lost = leases.check_all()
+        self.assertEqual([('bar', '0')], lost)
+        self.assertEqual(9, len(owned))
+        leases.release_all()
+        self.assertEqual([False] * 5, semaphore.mis_held(self.keys[:5]))
+        self.assertEqual([False] * 5, self.lock.mis_held(self.keys[:5]))
+
+    def test_scripts_registered_once(self):
+        locked, _ = self.lock.macquire(self.keys[:2])
+        leases = LeaseSet(locked)
+        leases.extend_all()
+        script = get_script(self.r, scripts.EXTEND)
+        self.r.script_flush()
+        self.assertEqual((['0', '1'], []), leases.extend_all())
+        self.assertIs(script, get_script(self.r, scripts.EXTEND))
+
+    def test_mis_held(self):
+        self.lock.acquire('1')
+        self.assertEqual([False, True, False], self.lock.mis_held(['0', '1', '2']))
+        self.assertEqual([], self.lock.mis_held([]))
@@ -0,0 +1,131 @@
+import pickle
+import threading
+import time
+from pylocks.test.redis_test import RedisTest
+from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
+from pylocks.blocking.local_coordinator import LocalLockCoordinator
+from pylocks.errors import LockAlreadyHeld, LockExpired, LockNotOwned
+
+
+class TestLocalLockCoordinator(RedisTest):
+    def setUp(self):
+        super(TestLocalLockCoordinator, self).setUp()
+        self.factory = BlockingRedisLockFactory(
+            prefix='foo', ttl=5, arity=1, coordinate_locally=True
+        )
+        self.lock = self.factory.build(self.r)
+        self.attempts = []
+        acquire = self.lock._acquire
+
+        def counting_acquire(request, wait):
+            self.attempts.append(request.key)
+            return acquire(request, wait)
+        self.lock._acquire = counting_acquire
+
+    def test_refused_locally_while_held(self):
+        handle = self.lock.acquire('x')
+        with self.assertRaises(LockAlreadyHeld) as ctx:
+            self.lock.acquire('x')
+        self.assertTrue(0 < ctx.exception.remaining_ttl <= 5)
+        self.assertEqual(1, len(self.attempts))
+        handle.release()
+        self.assertFalse(self.lock.is_held('x'))
+        self.lock.acquire('x').release()
+        self.assertEqual(2, len(self.attempts))
+        self.assertEqual({}, self.factory.coordinator._states)
+
+    def test_concurrent_attempts_coalesce(self):
+        # hold the key from "another process" so every attempt fails
+        other = BlockingRedisLockFactory(prefix='foo', ttl=5, arity=1).build(self.r)
+        other.acquire('x')
+        started = threading.Event()
+        proceed = threading.Event()
+        acquire = self.lock._acquire
+
+        def slow_acquire(request, wait):
+            started.set()
+            proceed.wait()
+            return acquire(request, wait)
+        self.lock._acquire = slow_acquire
+
+        errors = []
+
+        def contend():
+            try:
+                self.lock.acquire('x')
+            except LockAlreadyHeld as e:
+                errors.append(e)
+        threads = [threading.Thread(target=contend) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        proceed.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(5, len(errors))
+        self.assertEqual(1, len(self.attempts))
+
+    def test_hand_over(self):
+        handle = self.lock.acquire('x')
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.lock.acquire('x', wait=5)))
+        thread.start()
+        time.sleep(0.1)
+        handle.release()
+        thread.join()
+        [next_handle] = results
+        self.assertEqual(handle.id, next_handle.id)
+        self.assertEqual(1, len(self.attempts))
+        self.assertFalse(handle.do_i_still_have_lock())
+        next_handle.check_if_owned()
+        next_handle.release()
+        self.assertFalse(self.lock.is_held('x'))
+
+    def test_release_after_hand_over(self):
+        handle = self.lock.acquire('x')
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.lock.acquire('x', wait=5)))
+        thread.start()
+        time.sleep(0.1)
+        handle.release()
+        thread.join()
+        [next_handle] = results
+        self.assertFalse(handle.release(ignore_failure=True))
+        with self.assertRaises(LockNotOwned):
+            handle.release()
+        with self.assertRaises(LockExpired):
+            handle.extend()
+        next_handle.check_if_owned()
+        self.assertTrue(self.lock.is_held('x'))
+        next_handle.release()
+        self.assertFalse(self.lock.is_held('x'))
+
+    def test_pickled_handles(self):
+        handle = self.lock.acquire('x')
+        unpickled = self.lock.attach(pickle.loads(pickle.dumps(handle)))
+        self.assertIsNone(unpickled._coordinator)
+        unpickled.check_if_owned()
+        self.assertTrue(unpickled.release())
+        self.assertFalse(self.lock.is_held('x'))
+        self.assertFalse(handle.release(ignore_failure=True))
+
+    def test_wait_times_out(self):
+        self.lock.acquire('x')
+        started_at = time.time()
+        with self.assertRaises(LockAlreadyHeld):
+            self.lock.acquire('x', wait=0.2)
+        self.assertTrue(time.time() - started_at < 1)
+
+    def test_stale_holder_is_dropped(self):
+        handle = self.lock.acquire('x')
+        self.r.delete(handle.key)
+        self.assertFalse(handle.do_i_still_have_lock())
+        self.lock.acquire('x')
+        self.assertEqual(2, len(self.attempts))
+
+    def test_shared_by_factory(self):
+        self.assertIs(self.factory.coordinator, self.factory.build(self.r).coordinator)
+        self.assertIsNone(BlockingRedisLockFactory(prefix='foo', ttl=5, arity=1).coordinator)
+        self.assertIsInstance(self.factory.coordinator, LocalLockCoordinator)
@@ -0,0 +1,98 @@
+import unittest
+from pylocks.blocking.quorum_redis_lock import QuorumRedisLockFactory
+from pylocks.errors import LockAlreadyHeld, LockExpired, LockNotOwned, QuorumNotReached
+
+
+class TestQuorumRedisLock(unittest.TestCase):
+    def setUp(self):
+        import redislite
+        self.nodes = [redislite.StrictRedis() for _ in range(3)]
+        self.factory = QuorumRedisLockFactory(prefix='foo', ttl=5, arity=1, node_timeout=1)
+        self.lock = self.factory.build(self.nodes)
+
+    def held_on(self, handle):
+        return [node.get(handle.key) is not None for node in self.nodes]
+
+    def test_acquire_and_release(self):
+        handle = self.lock.acquire('x')
+        self.assertEqual([True, True, True], self.held_on(handle))
+        self.assertTrue(4.5 < handle.validity <= 5)
+        # quorum leases have no fencing tokens, so no counters either
+        self.assertEqual([[b'pylocks:foo:x']] * 3, [node.keys('*') for node in self.nodes])
+        self.assertTrue(self.lock.is_held('x'))
+        with self.assertRaises(LockAlreadyHeld):
+            self.lock.acquire('x')
+        handle.check_if_owned()
+        handle.release()
+        self.assertEqual([False, False, False], self.held_on(handle))
+        with self.assertRaises(LockNotOwned):
+            handle.release()
+
+    def test_minority_held_elsewhere(self):
+        self.nodes[0].set('pylocks:foo:x', 'someone else')
+        handle = self.lock.acquire('x')
+        self.assertEqual([True, True, True], self.held_on(handle))
+        handle.check_if_owned()
+        handle.release()
+        self.assertEqual(b'someone else', self.nodes[0].get('pylocks:foo:x'))
+
+    def test_majority_held_elsewhere_rolls_back(self):
+        self.nodes[0].set('pylocks:foo:x', 'someone else', px=3000)
+        self.nodes[1].set('pylocks:foo:x', 'someone else', px=3000)
+        with self.assertRaises(QuorumNotReached) as ctx:
+            self.lock.acquire('x')
+        self.assertTrue(0 < ctx.exception.remaining_ttl <= 3)
+        self.assertIsNone(self.nodes[2].get('pylocks:foo:x'))
+
+    def test_node_lost(self):
+        # shutting a node down takes a few seconds
+        self.lock = QuorumRedisLockFactory(
+            prefix='foo', ttl=60, arity=1, node_timeout=1
+        ).build(self.nodes)
+        handle = self.lock.acquire('x')
+        self.nodes[2].shutdown()
+        handle.check_if_owned()
+        handle.extend(10)
+        other = self.lock.acquire('y')
+        self.assertTrue(self.lock.is_held('y'))
+        other.release()
+        handle.release()
+        self.nodes[1].shutdown()
+        with self.assertRaises(QuorumNotReached):
+            self.lock.acquire('z')
+        self.assertIsNone(self.nodes[0].get('pylocks:foo:z'))
+
+    def test_extend(self):
+        handle = self.lock.acquire('x')
+        handle.extend(30)
+        self.assertTrue(all(node.pttl(handle.key) > 5000 for node in self.nodes))
+        self.assertTrue(handle.validity > 29)
+        self.nodes[0].delete(handle.key)
+        self.nodes[1].delete(handle.key)
+        with self.assertRaises(LockExpired):
+            handle.extend()
+
+    def test_macquire(self):
+        self.lock.acquire('y')
+        locked, missing = self.lock.macquire(['x', 'y', 'z'])
+        self.assertEqual(set(['x', 'z']), set(locked))
+        self.assertEqual(['y'], missing)
+        released, missing = self.lock.mrelease_expected(
+            dict((args, handle.id) for args, handle in locked.items())
+        )
+        self.assertEqual(set(['x', 'z']), set(released))
+        self.assertEqual([], missing)
+
+    def test_macquire_atomic(self):
+        self.lock.acquire('y')
+        self.assertEqual(({}, ['y']), self.lock.macquire(['x', 'y'], atomic=True))
+        self.assertFalse(self.lock.is_held('x'))
+        locked, missing = self.lock.macquire(['x', 'z'], atomic=True)
+        self.assertEqual(set(['x', 'z']), set(locked))
+
+    def test_get_lease_handle(self):
+        handle = self.lock.acquire('x')
+        self.assertEqual(handle.id, self.lock.get_lease_handle('x', handle.id).id)
+        self.lock.release_expected('x', handle.id)
+        with self.assertRaises(LockExpired):
+            self.lock.get_lease_handle('x', handle.id)
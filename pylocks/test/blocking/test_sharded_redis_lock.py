@@ -0,0 +1,89 @@
+import unittest
+from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
+from pylocks.blocking.lease_set import LeaseSet
+from pylocks.blocking.sharded_redis_lock import ShardedBlockingRedisLock
+from pylocks.errors import LockAlreadyHeld, LockExpired
+
+
+class TestShardedBlockingRedisLock(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import redislite
+        cls.servers = [redislite.StrictRedis() for _ in range(3)]
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+
+    def setUp(self):
+        for server in self.servers:
+            server.flushdb()
+        self.factory = BlockingRedisLockFactory(prefix='foo', ttl=5, arity=1)
+        self.lock = self.factory.build(self.servers)
+        self.keys = [str(i) for i in range(30)]
+
+    def holders(self, args_list):
+        key = self.lock.make_key(args_list)
+        return [i for i, server in enumerate(self.servers) if server.get(key) is not None]
+
+    def test_build(self):
+        self.assertTrue(isinstance(self.lock, ShardedBlockingRedisLock))
+        self.assertEqual(3, len(self.lock.shard_locks))
+        lock = self.factory.build(dict(enumerate(self.servers)))
+        self.assertEqual(set([0, 1, 2]), set(lock.shard_locks))
+
+    def test_acquire_and_release(self):
+        shards = set()
+        for args_list in self.keys:
+            handle = self.lock.acquire(args_list)
+            [shard] = self.holders(args_list)
+            shards.add(shard)
+            self.assertTrue(self.lock.is_held(args_list))
+            with self.assertRaises(LockAlreadyHeld):
+                self.lock.acquire(args_list)
+            self.assertEqual(handle.id, self.lock.get_lease_handle(args_list, handle.id).id)
+            handle.release()
+            self.assertEqual([], self.holders(args_list))
+        self.assertEqual(set([0, 1, 2]), shards)
+        handle = self.lock.acquire('x')
+        self.lock.release_expected('x', handle.id)
+        with self.assertRaises(LockExpired):
+            self.lock.get_lease_handle('x', handle.id)
+
+    def test_macquire(self):
+        self.lock.acquire('3')
+        locked, missing = self.lock.macquire(self.keys)
+        self.assertEqual(['3'], missing)
+        self.assertEqual(set(self.keys) - set(['3']), set(locked))
+        for args_list in locked:
+            self.assertEqual(1, len(self.holders(args_list)))
+        released, missing = self.lock.mrelease_expected(
+            dict((args_list, handle.id) for args_list, handle in locked.items())
+        )
+        self.assertEqual(set(locked), set(released))
+        self.assertEqual([], missing)
+        self.assertEqual(['3'], [k for k in self.keys if self.holders(k)])
+
+    def test_macquire_atomic(self):
+        self.lock.acquire('3')
+        self.assertEqual(({}, ['3']), self.lock.macquire(self.keys, atomic=True))
+        self.assertEqual(['3'], [k for k in self.keys if self.holders(k)])
+        locked, missing = self.lock.macquire(['x', 'y', 'z'], atomic=True)
+        self.assertEqual(set(['x', 'y', 'z']), set(locked))
+        self.assertEqual([], missing)
+
+    def test_mis_held(self):
+        locked, _ = self.lock.macquire(self.keys[::2])
+        self.assertEqual([i % 2 == 0 for i in range(30)], self.lock.mis_held(self.keys))
+        with LeaseSet(locked) as leases:
+            self.assertEqual(set(self.keys[::2]), set(leases.check_all()[0]))
+        self.assertEqual([False] * 30, self.lock.mis_held(self.keys))
+
+    def test_lease_tokens(self):
+        for args_list in self.keys[:5]:
+            token = self.lock.acquire(args_list).to_token()
+            rebuilt = self.lock.handle_from_token(token)
+            self.assertTrue(rebuilt.redis_conn is self.lock.shard_for(args_list).redis_conn)
+            rebuilt.release()
+        self.assertEqual([False] * 5, self.lock.mis_held(self.keys[:5]))
@@ -0,0 +1,87 @@
+import unittest
+from pylocks.blocking import BlockingRedisLockFactory
+from pylocks.errors import LockExpired
+from pylocks.test.redis_test import RedisTest
+
+try:
+    import celery
+except ImportError:
+    celery = None
+
+
+@unittest.skipIf(celery is None, 'celery is not installed')
+class TestLeasedTask(RedisTest):
+    def setUp(self):
+        super(TestLeasedTask, self).setUp()
+        from pylocks.contrib.celery import LeasedTask, leased_task
+        self.lock = BlockingRedisLockFactory(prefix='person', ttl=5, arity=1).build(self.r)
+        self.app = celery.Celery('test', broker='memory://', backend='cache+memory://',
+                                 task_cls=LeasedTask)
+        self.app.conf.task_always_eager = True
+        # the memory transport's queues are shared by every app in the process
+        self.app.conf.task_default_queue = self.id()
+        self.calls = []
+        self.published = []
+        celery.signals.before_task_publish.connect(self.on_publish)
+
+        @leased_task(self.app, self.lock, bind=True, max_retries=1, shared=False,
+                     lock_args=lambda person_id, amount: person_id)
+        def add_to_person(task, person_id, amount):
+            self.calls.append((person_id, task.request.retries, self.lock.is_held(person_id)))
+            if amount < 0 and not task.request.retries:
+                raise task.retry(countdown=0.1)
+            return amount
+        self.task = add_to_person
+
+    def tearDown(self):
+        celery.signals.before_task_publish.disconnect(self.on_publish)
+
+    def on_publish(self, headers=None, **kwargs):
+        self.published.append(headers)
+
+    def test_lease_held_while_running(self):
+        self.assertEqual(3, self.task.delay('1', 3).get())
+        self.assertEqual([('1', 0, True)], self.calls)
+        self.assertFalse(self.lock.is_held('1'))
+
+    def test_duplicate_skipped(self):
+        self.app.conf.task_always_eager = False
+        handle = self.lock.acquire('1')
+        self.assertIsNone(self.task.delay('1', 3))
+        self.assertEqual([], self.published)
+        handle.release()
+        self.task.delay('1', 3)
+        [headers] = self.published
+        self.assertTrue(self.lock.get_lease_handle('1', headers['pylocks_lease']))
+
+    def test_expired_lease(self):
+        from pylocks.contrib.celery import LEASE_HEADER
+        result = self.task.apply_async(('1', 3), headers={LEASE_HEADER: 'gone'})
+        self.assertTrue(isinstance(result.result, LockExpired))
+        self.assertEqual([], self.calls)
+
+    def test_called_directly(self):
+        self.assertEqual(3, self.task('1', 3))
+        self.assertEqual([('1', 0, False)], self.calls)
+
+    def test_leased_group(self):
+        handle = self.lock.acquire('2')
+        group = self.task.leased_group([('1', 1), ('2', 2), ('3', 3), ('1', 4)])
+        self.assertEqual(2, len(group.tasks))
+        self.assertEqual([1, 3], group.apply_async().get())
+        self.assertEqual([('1', 0, True), ('3', 0, True)], self.calls)
+        handle.release()
+
+    def test_leased_chunks(self):
+        chunks = self.task.leased_chunks([(str(i), i) for i in range(5)], 2)
+        self.assertEqual([[0, 1], [2, 3], [4]], chunks.apply_async().get())
+        self.assertEqual([(str(i), 0, True) for i in range(5)], self.calls)
+        self.assertFalse(any(self.lock.is_held(str(i)) for i in range(5)))
+
+    def test_worker_retry_keeps_lease(self):
+        from celery.contrib.testing.worker import start_worker
+        self.app.conf.task_always_eager = False
+        with start_worker(self.app, perform_ping_check=False, pool='solo'):
+            self.assertEqual(-1, self.task.delay('1', -1).get(timeout=10))
+        self.assertEqual([('1', 0, True), ('1', 1, True)], self.calls)
+        self.assertFalse(self.lock.is_held('1'))
@@ -0,0 +1,37 @@
+import unittest
+from pylocks.core.hash_ring import HashRing, hash_tag
+
+
+class TestHashRing(unittest.TestCase):
+    def setUp(self):
+        self.keys = ['key-%i' % i for i in range(10000)]
+
+    def test_spread(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = dict((shard, len(keys)) for shard, keys in ring.split(self.keys).items())
+        self.assertEqual(set(['a', 'b', 'c', 'd']), set(counts))
+        for count in counts.values():
+            self.assertTrue(1500 < count < 3500, counts)
+
+    def test_adding_a_shard_moves_few_keys(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        before = dict((key, ring.shard_for(key)) for key in self.keys)
+        ring.add('e')
+        moved = [key for key in self.keys if ring.shard_for(key) != before[key]]
+        self.assertTrue(len(moved) < 3000, len(moved))
+        self.assertEqual(set(['e']), set(ring.shard_for(key) for key in moved))
+        ring.remove('e')
+        self.assertEqual(before, dict((key, ring.shard_for(key)) for key in self.keys))
+
+    def test_hash_tags(self):
+        self.assertEqual('user1', hash_tag('pylocks:foo:{user1}:x'))
+        self.assertEqual('pylocks:foo:{}:x', hash_tag('pylocks:foo:{}:x'))
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        shards = set(ring.shard_for('pylocks:foo:{user1}:%i' % i) for i in range(100))
+        self.assertEqual(1, len(shards))
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            HashRing().shard_for('x')
+        with self.assertRaises(ValueError):
+            HashRing(['a', 'a'])
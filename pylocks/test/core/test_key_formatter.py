@@ -1,5 +1,5 @@
 import unittest
-from pylocks.core.key_formatter import KeyFormatter
+from pylocks.core.key_formatter import KeyFormatter, KeyPrefixes
 from pylocks.errors import ArityError
 
 class TestKeyFormatter(unittest.TestCase):
@@ -10,3 +10,52 @@ class TestKeyFormatter(unittest.TestCase):
         with self.assertRaises(ArityError):
             fmt.format()
         self.assertEqual('root:foo:x', fmt.format('x'))
+
+    def test_format_args(self):
+        fmt = KeyFormatter(prefix='foo', arity=2, root_prefix='root')
+        self.assertEqual('root:foo:x:1', fmt.format_args(('x', 1)))
+        self.assertEqual('root:foo:x:1', fmt.format_args(['x', 1]))
+        with self.assertRaises(ArityError):
+            fmt.format_args('x')
+        with self.assertRaises(ArityError):
+            fmt.format_args(['x', 'y', 'z'])
+        single = KeyFormatter(prefix='foo', arity=1, root_prefix='root')
+        self.assertEqual('root:foo:x', single.format_args('x'))
+        self.assertEqual('root:foo:x', single.format_args(('x',)))
+
+    def test_parse(self):
+        fmt = KeyFormatter(prefix='foo', arity=2, root_prefix='root')
+        self.assertEqual(('x', '1'), fmt.parse(fmt.format_args(('x', 1))))
+        self.assertEqual(('x', '1:2'), fmt.parse(b'root:foo:x:1:2'))
+        with self.assertRaises(ValueError):
+            fmt.parse('root:bar:x:1')
+        with self.assertRaises(ArityError):
+            fmt.parse('root:foo:x')
+
+    def test_compact(self):
+        fmt = KeyFormatter(prefix='a-rather-long-prefix', arity=1, root_prefix='root', compact=True)
+        key = fmt.format_args('x')
+        self.assertTrue(key.startswith('root:'))
+        self.assertEqual(len('root:') + 9 + len('x'), len(key))
+        self.assertEqual(('x',), fmt.parse(key))
+        other = KeyFormatter(prefix='another-prefix', arity=1, root_prefix='root', compact=True)
+        self.assertNotEqual(key, other.format_args('x'))
+
+    def test_format_many(self):
+        fmt = KeyFormatter(prefix='foo', arity=2, root_prefix='root')
+        self.assertEqual(['root:foo:x:1', 'root:foo:y:2'], fmt.format_many([('x', 1), ['y', 2]]))
+        with self.assertRaises(ArityError):
+            fmt.format_many([('x', 1), 'y'])
+        single = KeyFormatter(prefix='foo', arity=1, root_prefix='root')
+        self.assertEqual(['root:foo:x', 'root:foo:1'], single.format_many(['x', (1,)]))
+
+    def test_key_prefixes(self):
+        prefixes = KeyPrefixes(['foo', 'foo:bar'], root_prefix='root')
+        self.assertEqual('foo', prefixes.prefix_of('root:foo:x'))
+        self.assertEqual('foo:bar', prefixes.prefix_of(b'root:foo:bar:x'))
+        self.assertEqual('baz', prefixes.prefix_of('root:baz:x:y'))
+        self.assertEqual(None, prefixes.prefix_of('other:foo:x'))
+        compact = KeyFormatter(prefix='quux', root_prefix='root', compact=True).format_args('x')
+        self.assertNotEqual('quux', prefixes.prefix_of(compact))
+        prefixes.add('quux')
+        self.assertEqual('quux', prefixes.prefix_of(compact))
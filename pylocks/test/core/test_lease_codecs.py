@@ -0,0 +1,74 @@
+import pickle
+import unittest
+from pylocks.core import lease_codecs
+from pylocks.core.lock_lease_data import LockLeaseData
+from pylocks.core.lock_request import LockRequest
+from pylocks.errors import SerializationError
+
+def make_lease_data():
+    return LockLeaseData(
+        request=LockRequest(
+            key='root:yes:k',
+            request_time=70,
+            initial_ttl=12.5,
+            lock_arity=2,
+            lock_prefix='yes',
+            root_prefix='root'
+        ),
+        id='some-id',
+        acquired_at=80.25
+    )
+
+class TestLeaseCodecs(unittest.TestCase):
+    def test_compact_round_trip(self):
+        codec = lease_codecs.get_codec('compact')
+        data = codec.encode(make_lease_data())
+        self.assertEqual(b'\x02\x07some-id', data[:9])
+        self.assertEqual('some-id', LockLeaseData.read_id(data))
+        lease = lease_codecs.decode_lease(data, key=b'root:yes:k')
+        self.assertEqual('root:yes:k', lease.key)
+        self.assertEqual('some-id', lease.id)
+        self.assertEqual(80.25, lease.acquired_at)
+        self.assertEqual(12.5, lease.request.initial_ttl)
+        self.assertEqual(2, lease.request.lock_arity)
+        self.assertEqual('yes', lease.request.lock_prefix)
+        self.assertEqual('root', lease.request.root_prefix)
+
+    def test_compact_needs_key(self):
+        data = lease_codecs.get_codec('compact').encode(make_lease_data())
+        with self.assertRaises(SerializationError):
+            lease_codecs.decode_lease(data)
+
+    def test_compact_is_smaller(self):
+        lease = make_lease_data()
+        compact = lease_codecs.get_codec('compact').encode(lease)
+        pickled = lease_codecs.get_codec('pickle').encode(lease)
+        self.assertTrue(len(compact) * 4 < len(pickled))
+
+    def test_decode_pickle(self):
+        data = lease_codecs.get_codec('pickle').encode(make_lease_data())
+        lease = lease_codecs.decode_lease(data)
+        self.assertEqual('root:yes:k', lease.key)
+        self.assertEqual(70, lease.request.request_time)
+
+    def test_decode_unframed_pickle(self):
+        data = pickle.dumps(make_lease_data(), 2)
+        lease = lease_codecs.decode_lease(data)
+        self.assertEqual('some-id', lease.id)
+
+    def test_decode_unknown_version(self):
+        with self.assertRaises(SerializationError):
+            lease_codecs.decode_lease(b'\x7f\x01x')
+
+    def test_get_codec(self):
+        codec = lease_codecs.get_codec('pickle')
+        self.assertIs(codec, lease_codecs.get_codec(codec))
+        self.assertEqual('compact', lease_codecs.get_codec().name)
+        with self.assertRaises(ValueError):
+            lease_codecs.get_codec('nope')
+
+    def test_register_conflicting_version(self):
+        class Conflicting(lease_codecs.CompactLeaseCodec):
+            name = 'conflicting'
+        with self.assertRaises(ValueError):
+            lease_codecs.register_codec(Conflicting())
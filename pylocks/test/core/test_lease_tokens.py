@@ -0,0 +1,57 @@
+import unittest
+from pylocks.core import lease_tokens
+from pylocks.core.lock_lease_data import LockLeaseData
+from pylocks.core.lock_request import LockRequest
+from pylocks.errors import InvalidLeaseToken
+
+
+def make_lease_data(fence=None):
+    return LockLeaseData(
+        request=LockRequest(
+            key='root:yes:k:1',
+            request_time=80.25,
+            initial_ttl=12.5,
+            lock_arity=2,
+            lock_prefix='yes',
+            root_prefix='root'
+        ),
+        id='some-id',
+        acquired_at=80.25,
+        fence=fence
+    )
+
+
+class TestLeaseTokens(unittest.TestCase):
+    def test_round_trip(self):
+        token = lease_tokens.encode_token(make_lease_data(fence=7))
+        self.assertTrue(len(token) < 100)
+        lease = lease_tokens.decode_token(token)
+        self.assertEqual(make_lease_data(), lease)
+        self.assertEqual('root:yes:k:1', lease.key)
+        self.assertEqual(80.25, lease.acquired_at)
+        self.assertEqual(12.5, lease.request.initial_ttl)
+        self.assertEqual(('yes', 2, 'root'), (
+            lease.request.lock_prefix, lease.request.lock_arity, lease.request.root_prefix
+        ))
+        self.assertEqual(7, lease.fence)
+        self.assertEqual(None, lease_tokens.decode_token(
+            lease_tokens.encode_token(make_lease_data())
+        ).fence)
+
+    def test_signed(self):
+        token = lease_tokens.encode_token(make_lease_data(), secret='s3cret')
+        self.assertEqual('some-id', lease_tokens.decode_token(token, secret=b's3cret').id)
+        with self.assertRaises(InvalidLeaseToken):
+            lease_tokens.decode_token(token, secret='other')
+        with self.assertRaises(InvalidLeaseToken):
+            lease_tokens.decode_token(token.split('.')[0], secret='s3cret')
+        # the signature covers every byte of the lease
+        encoded, signature = token.split('.')
+        tampered = encoded[:-2] + ('A' if encoded[-2] != 'A' else 'B') + encoded[-1]
+        with self.assertRaises(InvalidLeaseToken):
+            lease_tokens.decode_token(tampered + '.' + signature, secret='s3cret')
+
+    def test_invalid(self):
+        for token in ('', 'nope', '!!!!', lease_tokens.encode_token(make_lease_data())[:12]):
+            with self.assertRaises(InvalidLeaseToken):
+                lease_tokens.decode_token(token)
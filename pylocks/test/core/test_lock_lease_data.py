@@ -1,3 +1,4 @@
+import pickle
 import unittest
 from pylocks.core.lock_lease_data import LockLeaseData
 from pylocks.core.lock_request import LockRequest
@@ -11,3 +12,23 @@ class TestLockLeaseData(unittest.TestCase):
         )
         handle2 = LockLeaseData.deserialize(handle.serialize())
         self.assertEqual('k', handle2.key)
+
+    def test_serialized_value_leads_with_id(self):
+        handle = LockLeaseData(
+            request=LockRequest(key='k', request_time=70, initial_ttl=1000, lock_arity=2, lock_prefix='yes'),
+            id='some-id',
+            acquired_at=80
+        )
+        data = handle.serialize()
+        self.assertEqual(b'\x01\x07some-id', data[:9])
+        self.assertEqual('some-id', LockLeaseData.read_id(data))
+
+    def test_deserialize_unframed(self):
+        handle = LockLeaseData(
+            request=LockRequest(key='k', request_time=70, initial_ttl=1000, lock_arity=2, lock_prefix='yes'),
+            id='some-id',
+            acquired_at=80
+        )
+        data = pickle.dumps(handle, 2)
+        self.assertEqual('k', LockLeaseData.deserialize(data).key)
+        self.assertEqual('some-id', LockLeaseData.read_id(data))
@@ -22,3 +22,10 @@ class TestLockSettings(unittest.TestCase):
         self.assertEqual(kwargs['root_prefix'], request.root_prefix)
         for part in ('some-key', 'x', 'y'):
             self.assertTrue(part in request.key)
+
+    def test_make_requests(self):
+        settings = LockSettings(prefix='foo', ttl=5, arity=2, root_prefix='root')
+        requests = settings.make_requests([('x', 1), ('y', 2)], now=500)
+        self.assertEqual(['root:foo:x:1', 'root:foo:y:2'], [r.key for r in requests])
+        self.assertEqual([500, 500], [r.request_time for r in requests])
+        self.assertEqual(('y', '2'), settings.parse_key(requests[1].key))
@@ -0,0 +1,82 @@
+import unittest
+from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
+from pylocks.errors import LockAlreadyHeld
+from pylocks.instrumentation import (
+    NULL_INSTRUMENTATION, Histogram, InMemoryInstrumentation,
+    get_instrumentation, set_default_instrumentation
+)
+from pylocks.test.redis_test import RedisTest
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(0.5))
+        for _ in range(99):
+            histogram.add(0.001)
+        histogram.add(2)
+        self.assertTrue(0.001 <= histogram.percentile(0.5) < 0.002)
+        self.assertTrue(0.001 <= histogram.percentile(0.99) < 0.002)
+        self.assertEqual(2, histogram.percentile(1))
+        self.assertEqual(100, histogram.summary()['count'])
+
+
+class TestInstrumentation(RedisTest):
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+        self.instrumentation = InMemoryInstrumentation(trace=True)
+        self.lock = BlockingRedisLockFactory(
+            prefix='foo', ttl=5, arity=1, instrumentation=self.instrumentation
+        ).build(self.r)
+
+    def test_operations(self):
+        handle = self.lock.acquire('x')
+        with self.assertRaises(LockAlreadyHeld):
+            self.lock.acquire('x')
+        self.lock.is_held('x')
+        handle.release()
+        self.lock.macquire(['y', 'z'])
+        operations = self.instrumentation.snapshot()['operations']['foo']
+        self.assertEqual(1, operations['acquire']['ok']['count'])
+        self.assertEqual(1, operations['acquire']['held']['count'])
+        self.assertEqual(1, operations['acquire']['held']['round_trips'])
+        self.assertEqual(1, operations['is_held']['ok']['count'])
+        self.assertEqual(1, operations['release']['ok']['count'])
+        self.assertEqual(1, operations['macquire']['ok']['count'])
+        self.assertTrue(operations['acquire']['ok']['latency']['max'] > 0)
+
+    def test_hold_time_and_headroom(self):
+        handle = self.lock.acquire('x')
+        handle.extend()
+        handle.release()
+        snapshot = self.instrumentation.snapshot()
+        self.assertEqual(1, snapshot['hold_time']['foo']['count'])
+        self.assertEqual(2, snapshot['ttl_headroom']['foo']['count'])
+        self.assertTrue(4 < snapshot['ttl_headroom']['foo']['min'] <= 5)
+
+    def test_lease_value_trace(self):
+        handle = self.lock.acquire('x')
+        self.lock.get_lease_handle('x', handle.id)
+        [(event, fields)] = self.instrumentation.events
+        self.assertEqual('lease_value', event)
+        self.assertEqual(handle.key, fields['key'])
+        self.assertEqual(handle.serialize(), fields['value'])
+        operations = self.instrumentation.snapshot()['operations']['foo']
+        self.assertEqual(1, operations['get_lease_handle']['ok']['count'])
+
+    def test_flush(self):
+        snapshots = []
+        self.instrumentation.sink = snapshots.append
+        self.lock.acquire('x')
+        self.instrumentation.flush()
+        self.assertEqual(1, snapshots[0]['operations']['foo']['acquire']['ok']['count'])
+        self.assertEqual({}, self.instrumentation.snapshot()['operations'])
+
+    def test_default(self):
+        self.assertIs(NULL_INSTRUMENTATION, get_instrumentation())
+        set_default_instrumentation(self.instrumentation)
+        try:
+            self.assertIs(self.instrumentation, get_instrumentation())
+        finally:
+            set_default_instrumentation(None)
+        self.assertIs(NULL_INSTRUMENTATION, get_instrumentation())
@@ -0,0 +1,90 @@
+import io
+import json
+import threading
+import time
+from pylocks import cli, top
+from pylocks.blocking.blocking_redis_lock import BlockingRedisLockFactory
+from pylocks.blocking.blocking_redis_semaphore import BlockingRedisSemaphoreFactory
+from pylocks.blocking.fair_blocking_redis_lock import FairBlockingRedisLockFactory
+from pylocks.core.key_formatter import KeyPrefixes
+from pylocks.test.redis_test import RedisTest
+
+
+class TestTop(RedisTest):
+    def setUp(self):
+        super(TestTop, self).setUp()
+        self.prefixes = KeyPrefixes()
+        self.person_lock = BlockingRedisLockFactory(prefix='person', ttl=60, arity=1).build(self.r)
+        self.short_lock = BlockingRedisLockFactory(
+            prefix='short', ttl=0.1, arity=1, compact_keys=True
+        ).build(self.r)
+
+    def snapshot(self):
+        return top.take_snapshot(self.r, self.prefixes, batch_size=3)
+
+    def test_rates(self):
+        kept = self.person_lock.acquire('kept')
+        released = self.person_lock.acquire('released')
+        self.short_lock.acquire('x')
+        before = self.snapshot()
+        released.release()
+        time.sleep(0.2)
+        self.person_lock.acquire('new')
+        semaphore = BlockingRedisSemaphoreFactory(prefix='api', ttl=60, arity=1, limit=3).build(self.r)
+        semaphore.acquire('partner')
+        semaphore.acquire('partner')
+        report = top.compare(before, self.snapshot(), self.prefixes)
+
+        person = report['prefixes']['person']
+        self.assertEqual(2, person['held'])
+        self.assertTrue(0 < person['acquired'] * report['interval'] < 1.01)
+        self.assertTrue(0 < person['released'] * report['interval'] < 1.01)
+        self.assertEqual(0, person['expired'])
+        # learned from the lease, though its key is compact
+        self.assertTrue(0 < report['prefixes']['short']['expired'] * report['interval'] < 1.01)
+        self.assertEqual(2, report['prefixes']['api']['held'])
+        self.assertEqual(4, sum(report['ttls'].values()))
+        self.assertEqual(4, report['ttls']['<1m'] + report['ttls']['<10m'])
+        self.assertEqual(semaphore.make_key('partner'), report['top_keys'][0]['key'])
+        self.assertEqual(2, report['top_keys'][0]['holders'])
+        kept.check_if_owned()
+
+    def test_ttl_bucket(self):
+        self.assertEqual('<1s', top.ttl_bucket(0.5))
+        self.assertEqual('<1m', top.ttl_bucket(59.9))
+        self.assertEqual('>=1h', top.ttl_bucket(7200))
+        self.assertEqual('none', top.ttl_bucket(None))
+
+    def test_waiters(self):
+        fair = FairBlockingRedisLockFactory(prefix='fair', ttl=60, arity=1).build(self.r)
+        handle = fair.acquire('hot')
+        waiting = threading.Thread(target=fair.acquire, args=('hot',), kwargs={'wait': 5})
+        waiting.start()
+        try:
+            time.sleep(0.2)
+            before = self.snapshot()
+            report = top.compare(before, self.snapshot(), self.prefixes)
+        finally:
+            handle.release()
+            waiting.join()
+        self.assertEqual(1, report['prefixes']['fair']['waiting'])
+        self.assertEqual(
+            [{'key': fair.make_key('hot'), 'prefix': 'fair', 'acquired': 0,
+              'waiting': 1, 'holders': 1, 'contention': 1}],
+            report['top_keys']
+        )
+
+    def test_run(self):
+        self.person_lock.acquire('x')
+        out = io.StringIO()
+        top.run(self.r, interval=0.05, as_json=True, iterations=2, out=out)
+        reports = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(2, len(reports))
+        self.assertEqual(1, reports[1]['prefixes']['person']['held'])
+        table = top.format_report(reports[1])
+        self.assertIn('person', table)
+        self.assertIn('REMAINING TTL', table)
+
+    def test_cli(self):
+        with self.assertRaises(SystemExit):
+            cli.main(['top', '--interval', 'soon'])
@@ -0,0 +1,284 @@
+"""
+A live view of lock activity, for finding the hottest locks during an incident.
+
+    pylocks top [--url redis://localhost:6379/0] [--interval 2] [--prefix person ...]
+    pylocks top --json --iterations 1
+
+Every `--interval` seconds this takes a snapshot of every key under the
+root prefix with SCAN, reading each batch of keys in one pipeline, and
+compares it with the last one. A lease which appears between snapshots
+was acquired; one which disappears expired if its TTL ran out in the
+meantime, and was released otherwise. Leases which come and go between
+two snapshots aren't seen, so rates are lower bounds; a shorter interval
+sees more of them, at the cost of scanning more often.
+
+Waiters are counted from the queues of fair locks, and a key's
+contention is its waiters plus the leases acquired on it during the
+interval. Compact keys are shown under their prefix once a lease
+naming it has been read, or if it's given with `--prefix`.
+"""
+from __future__ import print_function
+import json
+import sys
+import time
+from pylocks.blocking.inventory import glob_escape, is_temp_lease, scan_keys
+from pylocks.conf import DEFAULT_ROOT_PREFIX
+from pylocks.core import lease_codecs, operations
+from pylocks.core.key_formatter import KeyPrefixes
+
+# remaining TTL buckets, in seconds, for the TTL distribution
+TTL_BUCKETS = ((1, '<1s'), (10, '<10s'), (60, '<1m'), (600, '<10m'), (3600, '<1h'))
+TTL_BUCKET_LABELS = [label for _, label in TTL_BUCKETS] + ['>=1h', 'none']
+
+# suffixes of the keys kept alongside a lock key, and whether they're read
+_HOLDERS_SUFFIX = ':holders'
+_QUEUE_SUFFIX = ':queue'
+_IGNORED_SUFFIXES = (':holders:leases', ':queue:deadlines', ':queue:ticket', ':writer')
+
+
+def ttl_bucket(remaining_ttl):
+    if remaining_ttl is None:
+        return 'none'
+    for limit, label in TTL_BUCKETS:
+        if remaining_ttl < limit:
+            return label
+    return '>=1h'
+
+
+class Snapshot(object):
+    """
+    The leases and waiters under a root prefix at one moment.
+
+    `leases` maps each lock key to a dict of its lease IDs and their
+    remaining TTLs; shared leases (read/write locks and semaphores)
+    have several. `waiters` maps the keys of fair locks to how many
+    are queued on them.
+    """
+    def __init__(self, taken_at, leases, waiters, keys_scanned):
+        self.taken_at = taken_at
+        self.leases = leases
+        self.waiters = waiters
+        self.keys_scanned = keys_scanned
+
+
+def _read_batch(redis_conn, keys, prefixes, leases, waiters):
+    lease_keys, holder_keys, queue_keys = [], [], []
+    for key in keys:
+        if key.endswith(_IGNORED_SUFFIXES):
+            continue
+        if key.endswith(_HOLDERS_SUFFIX):
+            holder_keys.append(key)
+        elif key.endswith(_QUEUE_SUFFIX):
+            queue_keys.append(key)
+        else:
+            lease_keys.append(key)
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.time()
+    for key in lease_keys:
+        pipe.get(key)
+        pipe.pttl(key)
+    for key in holder_keys:
+        pipe.zrange(key, 0, -1, withscores=True)
+    for key in queue_keys:
+        pipe.zcard(key)
+    replies = pipe.execute(raise_on_error=False)
+    seconds, microseconds = replies[0]
+    now_ms = seconds * 1000 + microseconds // 1000
+    replies = iter(replies[1:])
+
+    for key in lease_keys:
+        value, holder_ttl = next(replies), next(replies)
+        if not value or isinstance(value, Exception):
+            continue
+        try:
+            lease = lease_codecs.decode_lease(value, key=key)
+        except Exception:
+            # not a lease; some other value under the root prefix
+            continue
+        if is_temp_lease(key, lease):
+            continue
+        if lease.request.lock_prefix is not None:
+            prefixes.add(lease.request.lock_prefix)
+        leases[key] = {lease.id: operations.remaining_ttl(holder_ttl)}
+    for key in holder_keys:
+        holders = next(replies)
+        if isinstance(holders, Exception):
+            continue
+        live = dict(
+            (lease_id.decode('utf-8'), (expires_at - now_ms) / 1000.0)
+            for lease_id, expires_at in holders if expires_at > now_ms
+        )
+        if live:
+            leases[key[:-len(_HOLDERS_SUFFIX)]] = live
+    for key in queue_keys:
+        count = next(replies)
+        if count and not isinstance(count, Exception):
+            waiters[key[:-len(_QUEUE_SUFFIX)]] = count
+
+
+def take_snapshot(redis_conn, prefixes, batch_size=500):
+    """
+    scans the keys under `prefixes.root_prefix`, a `KeyPrefixes`,
+    one pipeline per SCAN batch. learns the prefixes of the leases it reads.
+    """
+    leases, waiters = {}, {}
+    keys_scanned = 0
+    pattern = glob_escape(prefixes.root_head) + '*'
+    for keys in scan_keys(redis_conn, pattern, batch_size):
+        keys_scanned += len(keys)
+        _read_batch(redis_conn, keys, prefixes, leases, waiters)
+    return Snapshot(time.time(), leases, waiters, keys_scanned)
+
+
+def _prefix_stats():
+    return {'held': 0, 'acquired': 0, 'released': 0, 'expired': 0, 'waiting': 0}
+
+
+def compare(before, after, prefixes, top=10):
+    """
+    returns a dict describing the activity between two snapshots:
+        - `interval`: seconds between them
+        - `prefixes`: per prefix, leases `held` and `waiting` now, and
+          the per-second rates they were `acquired`, `released` and
+          `expired` at
+        - `top_keys`: the `top` most contended keys
+        - `ttls`: how many leases have each bucket of remaining TTL
+    """
+    elapsed = max(after.taken_at - before.taken_at, 1e-6)
+    by_prefix = {}
+    keys = {}
+
+    def stats_for(key):
+        prefix = prefixes.prefix_of(key)
+        if prefix not in by_prefix:
+            by_prefix[prefix] = _prefix_stats()
+        return by_prefix[prefix]
+
+    ttls = dict((label, 0) for label in TTL_BUCKET_LABELS)
+    for key, held in after.leases.items():
+        stats = stats_for(key)
+        stats['held'] += len(held)
+        previously = before.leases.get(key, {})
+        acquired = sum(1 for lease_id in held if lease_id not in previously)
+        stats['acquired'] += acquired
+        for remaining_ttl in held.values():
+            ttls[ttl_bucket(remaining_ttl)] += 1
+        keys[key] = {'acquired': acquired, 'holders': len(held), 'waiting': 0}
+    for key, held in before.leases.items():
+        now_held = after.leases.get(key, {})
+        for lease_id, remaining_ttl in held.items():
+            if lease_id in now_held:
+                continue
+            if remaining_ttl is not None and remaining_ttl <= elapsed:
+                stats_for(key)['expired'] += 1
+            else:
+                stats_for(key)['released'] += 1
+    for key, count in after.waiters.items():
+        stats_for(key)['waiting'] += count
+        keys.setdefault(key, {'acquired': 0, 'holders': 0, 'waiting': 0})['waiting'] = count
+
+    for stats in by_prefix.values():
+        for name in ('acquired', 'released', 'expired'):
+            stats[name] = stats[name] / elapsed
+    contended = sorted(
+        ((info['waiting'] + info['acquired'], key) for key, info in keys.items()
+         if info['waiting'] or info['acquired']),
+        reverse=True
+    )[:top]
+    return {
+        'taken_at': after.taken_at,
+        'interval': elapsed,
+        'keys_scanned': after.keys_scanned,
+        'prefixes': by_prefix,
+        'top_keys': [
+            dict(keys[key], key=key, prefix=prefixes.prefix_of(key), contention=score)
+            for score, key in contended
+        ],
+        'ttls': ttls,
+    }
+
+
+def format_report(report, title=''):
+    lines = [
+        '%s  %i keys scanned, %.1fs interval' % (title, report['keys_scanned'], report['interval']),
+        '',
+        '%-32s %8s %8s %8s %8s %8s' % ('PREFIX', 'HELD', 'ACQ/S', 'REL/S', 'EXP/S', 'WAITING'),
+    ]
+    ordered = sorted(
+        report['prefixes'].items(),
+        key=lambda item: (-item[1]['acquired'], -item[1]['held'], item[0])
+    )
+    for prefix, stats in ordered:
+        lines.append('%-32s %8i %8.1f %8.1f %8.1f %8i' % (
+            prefix, stats['held'], stats['acquired'], stats['released'],
+            stats['expired'], stats['waiting']
+        ))
+    lines += ['', '%-48s %8s %8s %8s' % ('TOP CONTENDED KEYS', 'ACQUIRED', 'WAITING', 'HOLDERS')]
+    for info in report['top_keys']:
+        lines.append('%-48s %8i %8i %8i' % (
+            info['key'], info['acquired'], info['waiting'], info['holders']
+        ))
+    lines += ['', 'REMAINING TTL']
+    total = sum(report['ttls'].values()) or 1
+    for label in TTL_BUCKET_LABELS:
+        count = report['ttls'][label]
+        lines.append('%-6s %8i %s' % (label, count, '#' * int(round(40.0 * count / total))))
+    return '\n'.join(lines)
+
+
+def run(redis_conn, prefixes=(), root_prefix=DEFAULT_ROOT_PREFIX, interval=2.0, top=10,
+        batch_size=500, as_json=False, iterations=None, out=None):
+    """
+    prints a report every `interval` seconds, `iterations` times or
+    until interrupted. with `as_json`, each report is one line of JSON.
+    """
+    out = out or sys.stdout
+    prefixes = KeyPrefixes(prefixes, root_prefix=root_prefix)
+    title = 'pylocks top: %s:*' % root_prefix
+    before = take_snapshot(redis_conn, prefixes, batch_size)
+    done = 0
+    while iterations is None or done < iterations:
+        time.sleep(max(0, interval - (time.time() - before.taken_at)))
+        after = take_snapshot(redis_conn, prefixes, batch_size)
+        report = compare(before, after, prefixes, top=top)
+        if as_json:
+            out.write(json.dumps(report, sort_keys=True) + '\n')
+        else:
+            # clear the terminal and redraw
+            out.write('\x1b[2J\x1b[H' + format_report(report, title) + '\n')
+        out.flush()
+        before = after
+        done += 1
+
+
+def add_arguments(parser):
+    parser.add_argument('--url', default='redis://localhost:6379/0',
+                        help='the lock server (default: %(default)s)')
+    parser.add_argument('--root-prefix', default=DEFAULT_ROOT_PREFIX)
+    parser.add_argument('--prefix', action='append', default=[], dest='prefixes',
+                        help='a lock prefix, to recognise its compact keys; may be repeated')
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help='seconds between snapshots (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=10, help='how many keys to list')
+    parser.add_argument('--batch-size', type=int, default=500, help='SCAN COUNT hint')
+    parser.add_argument('--json', action='store_true', dest='as_json',
+                        help='print one JSON report per line instead of a table')
+    parser.add_argument('--iterations', type=int, default=None,
+                        help='stop after this many reports')
+
+
+def main(args):
+    import redis
+    try:
+        run(
+            redis.StrictRedis.from_url(args.url),
+            prefixes=args.prefixes,
+            root_prefix=args.root_prefix,
+            interval=args.interval,
+            top=args.top,
+            batch_size=args.batch_size,
+            as_json=args.as_json,
+            iterations=args.iterations
+        )
+    except KeyboardInterrupt:
+        pass
@@ -1,4 +1,10 @@
+import time
 import uuid
 
 def make_id():
     return str(uuid.uuid4())
+
+def to_millis(seconds):
+    return int(round(seconds * 1000))
+
+monotonic = getattr(time, 'monotonic', time.time)
@@ -14,8 +14,17 @@ setup(
         'Programming Language :: Python :: 3'
     ],
     install_requires=INSTALL_REQUIRES,
+    extras_require={
+        # pylocks.aio needs redis.asyncio
+        'aio': ['redis>=5.0.1'],
+        # pylocks.contrib.celery
+        'celery': ['celery>=4.0']
+    },
     author='Scott Ivey',
     author_email='scott.ivey@gmail.com',
     license='MIT',
-    packages=find_packages()
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
+    entry_points={
+        'console_scripts': ['pylocks = pylocks.cli:main']
+    }
 )
\ No newline at end of file